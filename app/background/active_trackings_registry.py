@@ -0,0 +1,117 @@
+import asyncio
+import datetime
+import traceback
+from typing import Optional
+
+from loguru import logger
+
+from cruds.trackings import TrackingManager
+from database import async_session_maker
+from models.trackings import TrackingModel
+from schemas.tracking_events import TrackingEventSchema
+
+
+class ActiveTrackingsRegistry:
+    """
+    Реестр активных отслеживаний в памяти воркера, общий для всех фоновых циклов.
+
+    При старте загружает все активные отслеживания, дальше подгружает только изменившиеся
+    (по updated_at отслеживаний и их пользователей). Раз в full_reload_interval делается полная перезагрузка
+    """
+
+    def __init__(
+            self,
+            refresh_interval: float = 5,
+            full_reload_interval: float = 3600,
+            watermark_overlap: float = 60
+    ):
+        """
+        :param refresh_interval: как часто (в секундах) подгружать изменения
+        :param full_reload_interval: как часто (в секундах) полностью перезагружать реестр
+        :param watermark_overlap: на сколько секунд назад от последнего изменения перечитываем записи,
+        чтобы не пропустить транзакции, закоммиченные позже более новых
+        """
+        self._refresh_interval = refresh_interval
+        self._full_reload_interval = full_reload_interval
+        self._watermark_overlap = datetime.timedelta(seconds=watermark_overlap)
+
+        self._trackings: dict[int, TrackingModel] = dict()
+        self._watermark: Optional[datetime.datetime] = None
+        self._loaded = asyncio.Event()
+
+    def get_all(self) -> list[TrackingModel]:
+        """Все активные отслеживания (пользователь подгружен)"""
+        return list(self._trackings.values())
+
+    def get(self, tracking_id: int) -> Optional[TrackingModel]:
+        return self._trackings.get(tracking_id)
+
+    async def wait_until_loaded(self) -> None:
+        await self._loaded.wait()
+
+    def discard(self, tracking_id: int) -> None:
+        """Убирает отслеживание из реестра сразу, не дожидаясь подгрузки изменений (например, после завершения)"""
+        self._trackings.pop(tracking_id, None)
+
+    async def apply_tracking_event(self, event: TrackingEventSchema) -> Optional[TrackingModel]:
+        """Перечитывает отслеживание из события. Возвращает его, если оно активно"""
+        async with async_session_maker() as session:
+            tracking_manager = TrackingManager(session=session)
+            tracking = await tracking_manager.get(obj_id=event.tracking_id, relationships=[TrackingModel.user])
+
+        if tracking is None or tracking.is_finished:
+            self.discard(tracking_id=event.tracking_id)
+            return None
+        self._trackings[tracking.id] = tracking
+        return tracking
+
+    def _move_watermark(self, trackings: list[TrackingModel]) -> None:
+        for tracking in trackings:
+            for updated_at in (tracking.updated_at, tracking.user.updated_at if tracking.user else None):
+                if updated_at is not None and (self._watermark is None or updated_at > self._watermark):
+                    self._watermark = updated_at
+
+    async def load(self) -> None:
+        """Полная загрузка активных отслеживаний"""
+        async with async_session_maker() as session:
+            tracking_manager = TrackingManager(session=session)
+            trackings = await tracking_manager.get_all_tracking(only_active=True)
+
+        self._trackings = {tracking.id: tracking for tracking in trackings}
+        self._move_watermark(trackings)
+        if self._watermark is None:
+            self._watermark = datetime.datetime.utcnow()
+        self._loaded.set()
+        logger.info(f'ActiveTrackingsRegistry loaded {len(self._trackings)} trackings')
+
+    async def refresh(self) -> None:
+        """Подгрузка изменений после последней загрузки"""
+        async with async_session_maker() as session:
+            tracking_manager = TrackingManager(session=session)
+            trackings = await tracking_manager.get_trackings_changed_since(
+                changed_since=self._watermark - self._watermark_overlap
+            )
+
+        for tracking in trackings:
+            if tracking.is_finished:
+                self._trackings.pop(tracking.id, None)
+            else:
+                self._trackings[tracking.id] = tracking
+        self._move_watermark(trackings)
+
+    async def start(self):
+        logger.info('Background ActiveTrackingsRegistry started')
+        last_full_reload_at: Optional[float] = None
+        loop = asyncio.get_running_loop()
+
+        while True:
+            try:
+                if last_full_reload_at is None or loop.time() - last_full_reload_at > self._full_reload_interval:
+                    await self.load()
+                    last_full_reload_at = loop.time()
+                else:
+                    await self.refresh()
+            except Exception:
+                logger.error(f'Global error in cycle of ActiveTrackingsRegistry: \n'
+                             f'{traceback.format_exc()}')
+            await asyncio.sleep(self._refresh_interval)
@@ -0,0 +1,47 @@
+from typing import Optional
+
+from aiohttp import web
+from loguru import logger
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, generate_latest
+
+from utils.tracing import RingBufferTraceExporter
+
+
+class MetricsServer:
+    """HTTP-эндпоинт /metrics с метриками процесса для Prometheus и /traces с последними трассами"""
+
+    def __init__(
+            self,
+            registry: CollectorRegistry,
+            host: str = '127.0.0.1',
+            port: int = 9100,
+            traces: Optional[RingBufferTraceExporter] = None
+    ):
+        self._registry = registry
+        self._traces = traces
+        self._host = host
+        self._port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def _handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(
+            body=generate_latest(self._registry),
+            headers={'Content-Type': CONTENT_TYPE_LATEST, 'X-Content-Type-Options': 'nosniff'}
+        )
+
+    async def _handle_traces(self, request: web.Request) -> web.Response:
+        return web.json_response(self._traces.dump() if self._traces is not None else [])
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle_metrics)
+        app.router.add_get('/traces', self._handle_traces)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host=self._host, port=self._port).start()
+        logger.info(f'Background MetricsServer started on {self._host}:{self._port}')
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,230 @@
+import asyncio
+import bisect
+import hashlib
+import os
+import socket
+import time
+import traceback
+import uuid
+from typing import Callable, Optional
+
+from loguru import logger
+from redis.asyncio import Redis
+
+from utils.route_key import RouteKey
+
+# Берет ключ, если он свободен, или продлевает, если он уже наш
+_ACQUIRE_LEASE_SCRIPT = '''
+local owner = redis.call('GET', KEYS[1])
+if not owner then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+if owner == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+'''
+
+# Продлевает ключ, только если он наш (отпущенный или истекший ключ не создается заново)
+_RENEW_LEASE_SCRIPT = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+'''
+
+# Удаляет ключ, только если он наш
+_RELEASE_LEASE_SCRIPT = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+'''
+
+
+class ShardCoordinator:
+    """
+    Распределение маршрутов между несколькими воркерами.
+
+    Каждый воркер отмечается в redis (heartbeat), по живым воркерам строится кольцо консистентного
+    хеширования, и маршрут обрабатывает только его владелец по кольцу. Пока представления воркеров о составе
+    кольца расходятся (воркер только что появился или умер), двойную обработку исключает аренда маршрута в redis:
+    обработать маршрут можно, только взяв его аренду, а отдает её прошлый владелец после завершения обработки.
+    Аренды продлеваются вместе с heartbeat, а не только при опросе маршрута, поэтому не истекают между опросами,
+    как бы редко маршрут ни опрашивался. Аренды умершего воркера истекают через lease_ttl.
+
+    Снимок мест маршрута (AvailabilityDeltaEngine) к новому владельцу не переходит: первый опрос перешедшего
+    маршрута только запоминает снимок, и отслеживания, по которым уже было уведомление, повторно не уведомляются
+    """
+
+    def __init__(
+            self,
+            redis: Redis,
+            worker_id: Optional[str] = None,
+            key_prefix: str = 'rzd_shards',
+            lease_ttl: float = 120,
+            heartbeat_interval: float = 5,
+            member_ttl: float = 20,
+            virtual_nodes: int = 64,
+            on_members_changed: Optional[Callable[[tuple[str, ...]], None]] = None
+    ):
+        """
+        :param lease_ttl: время жизни аренды маршрута/фоновой задачи (секунды).
+        Удерживаемые аренды продлеваются каждую треть lease_ttl
+        :param heartbeat_interval: как часто воркер подтверждает, что жив, и перечитывает состав кольца (секунды)
+        :param member_ttl: через сколько секунд без heartbeat воркер считается умершим
+        :param virtual_nodes: количество точек каждого воркера на кольце
+        :param on_members_changed: вызывается с новым составом воркеров при каждом его изменении
+        (например, чтобы поделить между воркерами общий лимит Telegram)
+        """
+        self._redis = redis
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}'
+        self._key_prefix = key_prefix
+        self._lease_ttl_ms = int(lease_ttl * 1000)
+        self._heartbeat_interval = heartbeat_interval
+        self._member_ttl_ms = int(member_ttl * 1000)
+        self._virtual_nodes = virtual_nodes
+        self._on_members_changed = on_members_changed
+        self._lease_renew_interval = lease_ttl / 3
+
+        self._members: tuple[str, ...] = tuple()
+        self._ring_hashes: list[int] = []
+        self._ring_members: list[str] = []
+        self._held_leases: set[str] = set()
+        self._leases_renewed_at = time.monotonic()
+        self._ready = asyncio.Event()
+
+        self._acquire_lease_script = self._redis.register_script(_ACQUIRE_LEASE_SCRIPT)
+        self._renew_lease_script = self._redis.register_script(_RENEW_LEASE_SCRIPT)
+        self._release_lease_script = self._redis.register_script(_RELEASE_LEASE_SCRIPT)
+
+    @property
+    def members(self) -> tuple[str, ...]:
+        return self._members
+
+    @property
+    def _members_key(self) -> str:
+        return f'{self._key_prefix}:members'
+
+    def _get_lease_key(self, key: str) -> str:
+        return f'{self._key_prefix}:lease:{key}'
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+    @staticmethod
+    def get_route_lease_key(route_key: RouteKey) -> str:
+        return f'route:{route_key.from_city_id}:{route_key.to_city_id}:{route_key.date.isoformat()}'
+
+    def _rebuild_ring(self, members: tuple[str, ...]) -> None:
+        points = sorted(
+            (self._hash(f'{member}#{i}'), member)
+            for member in members
+            for i in range(self._virtual_nodes)
+        )
+        self._ring_hashes = [point_hash for point_hash, _ in points]
+        self._ring_members = [member for _, member in points]
+        self._members = members
+
+    def owns(self, route_key: RouteKey) -> bool:
+        """Является ли этот воркер владельцем маршрута по кольцу"""
+        if not self._ring_hashes:
+            return False
+        i = bisect.bisect(self._ring_hashes, self._hash(self.get_route_lease_key(route_key))) % len(self._ring_hashes)
+        return self._ring_members[i] == self.worker_id
+
+    async def acquire(self, key: str) -> bool:
+        """Берет или продлевает аренду ключа. False - ключ арендован другим воркером"""
+        acquired = bool(await self._acquire_lease_script(
+            keys=[self._get_lease_key(key)],
+            args=[self.worker_id, self._lease_ttl_ms]
+        ))
+        if acquired:
+            self._held_leases.add(key)
+        else:
+            self._held_leases.discard(key)
+        return acquired
+
+    async def release(self, key: str) -> None:
+        if key not in self._held_leases:
+            return
+        self._held_leases.discard(key)
+        await self._release_lease_script(keys=[self._get_lease_key(key)], args=[self.worker_id])
+
+    async def renew_leases(self) -> None:
+        """Продление всех удерживаемых аренд одним pipeline. Истекшие или взятые другим воркером аренды забываются"""
+        keys = list(self._held_leases)
+        if not keys:
+            return
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                await self._renew_lease_script(
+                    keys=[self._get_lease_key(key)],
+                    args=[self.worker_id, self._lease_ttl_ms],
+                    client=pipe
+                )
+            results = await pipe.execute()
+        for key, renewed in zip(keys, results):
+            if not renewed:
+                logger.warning(f'Lease {key} expired or was taken by another worker')
+                self._held_leases.discard(key)
+
+    async def acquire_route(self, route_key: RouteKey) -> bool:
+        return await self.acquire(self.get_route_lease_key(route_key))
+
+    async def release_route(self, route_key: RouteKey) -> None:
+        await self.release(self.get_route_lease_key(route_key))
+
+    async def wait_until_ready(self) -> None:
+        await self._ready.wait()
+
+    async def heartbeat(self) -> None:
+        """Подтверждает, что воркер жив, и перестраивает кольцо, если состав воркеров изменился"""
+        now_ms = int(time.time() * 1000)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(self._members_key, {self.worker_id: now_ms + self._member_ttl_ms})
+            pipe.zremrangebyscore(self._members_key, '-inf', now_ms)
+            pipe.zrange(self._members_key, 0, -1)
+            _, _, raw_members = await pipe.execute()
+
+        members = tuple(sorted(
+            member.decode() if isinstance(member, bytes) else member for member in raw_members
+        ))
+        if members != self._members:
+            logger.info(f'Shard ring changed: {len(members)} workers ({", ".join(members)}); this is {self.worker_id}')
+            self._rebuild_ring(members)
+            if self._on_members_changed is not None:
+                self._on_members_changed(members)
+        self._ready.set()
+
+        if time.monotonic() - self._leases_renewed_at >= self._lease_renew_interval:
+            await self.renew_leases()
+            self._leases_renewed_at = time.monotonic()
+
+    async def start(self):
+        logger.info(f'Background ShardCoordinator started ({self.worker_id})')
+        try:
+            while True:
+                try:
+                    await self.heartbeat()
+                except Exception:
+                    logger.error(f'Global error in cycle of ShardCoordinator: \n'
+                                 f'{traceback.format_exc()}')
+                await asyncio.sleep(self._heartbeat_interval)
+        finally:
+            await self.stop()
+
+    async def stop(self):
+        """Выход из кольца: остальные воркеры заберут маршруты, не дожидаясь истечения аренд"""
+        try:
+            await self._redis.zrem(self._members_key, self.worker_id)
+            for key in list(self._held_leases):
+                await self.release(key)
+        except Exception:
+            logger.warning(f'Error while stopping ShardCoordinator: \n{traceback.format_exc()}')
+        self._ring_hashes = []
+        self._ring_members = []
+        self._members = tuple()
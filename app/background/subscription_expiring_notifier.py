@@ -1,21 +1,25 @@
 import asyncio
 import datetime
+import time
 import traceback
-from typing import Literal
+from typing import Literal, Optional
 
 from keyboards.subscription_notify import subscription_notify_keyboard
 from loguru import logger
-from aiogram import Bot
 
+from background.shard_coordinator import ShardCoordinator
 from cruds.users import UserManager
 from database import async_session_maker
 from models.users import UserModel
 from schemas.users import UserUpdateSchema
+from utils import metrics
+from utils.telegram_sender import MessagePriority, TelegramSender
 
 
 class SubscriptionExpiringNotifier:
-    def __init__(self, aiogram_bot_token: str):
-        self._aiogram_bot = Bot(token=aiogram_bot_token)
+    def __init__(self, telegram_sender: TelegramSender, shard_coordinator: Optional[ShardCoordinator] = None):
+        self._telegram_sender = telegram_sender
+        self._shard_coordinator = shard_coordinator
 
     async def send_notification(self, notification_type: Literal['3d', '1d', 'after'], user: UserModel):
 
@@ -37,7 +41,8 @@ class SubscriptionExpiringNotifier:
                 '<b>Спасибо за пользование сервисом</b>'
             )
         try:
-            await self._aiogram_bot.send_message(
+            await self._telegram_sender.send_message(
+                priority=MessagePriority.SUBSCRIPTION_REMINDER,
                 text=text,
                 chat_id=user.id,
                 disable_web_page_preview=True,
@@ -124,10 +129,20 @@ class SubscriptionExpiringNotifier:
                 await session.commit()
 
     async def cycle(self):
-        # Получаем всех юзеров
+        # При нескольких воркерах уведомления рассылает только один
+        if self._shard_coordinator is not None and not await self._shard_coordinator.acquire(
+                'subscription_expiring_notifier'
+        ):
+            return
+
+        # Получаем юзеров, которым может быть нужна нотификация: от истекших за последний час до истекающих через 3 дня
+        now = datetime.datetime.utcnow()
         async with async_session_maker() as session:
             user_manager = UserManager(session=session)
-            users = await user_manager.get_multi(limit=10000000)
+            users = await user_manager.get_users_with_subscription_expiring_between(
+                since=now - datetime.timedelta(hours=1),
+                until=now + datetime.timedelta(days=3)
+            )
 
         for user in users:
             try:
@@ -141,8 +156,10 @@ class SubscriptionExpiringNotifier:
 
         while True:
             #  logger.debug('Завершен круг отправки нотификаций об окончании подписки')
+            started_at = time.monotonic()
             try:
                 await self.cycle()
+                metrics.CYCLE_DURATION.labels(cycle='subscription_notifier').observe(time.monotonic() - started_at)
             except Exception:
                 logger.error(f'Global error in cycle of SubscriptionExpiringNotifier: \n'
                              f'{traceback.format_exc()}')
@@ -1,20 +1,33 @@
 import asyncio
 import datetime
+import time
 import traceback
+from typing import Optional
 
 from loguru import logger
-from aiogram import Bot
 
+from background.active_trackings_registry import ActiveTrackingsRegistry
+from background.shard_coordinator import ShardCoordinator
 from cruds.trackings import TrackingManager
 from database import async_session_maker
 from models.trackings import TrackingModel
 from schemas.trackings import TrackingUpdateSchema
+from utils import metrics
+from utils.telegram_sender import MessagePriority, TelegramSender
 
 
 class TrackingCloser:
-    def __init__(self, aiogram_bot_token: str, tg_bot_username: str):
-        self._aiogram_bot = Bot(token=aiogram_bot_token)
+    def __init__(
+            self,
+            telegram_sender: TelegramSender,
+            tg_bot_username: str,
+            active_trackings_registry: ActiveTrackingsRegistry,
+            shard_coordinator: Optional[ShardCoordinator] = None
+    ):
+        self._telegram_sender = telegram_sender
         self._tg_bot_username = tg_bot_username
+        self._active_trackings_registry = active_trackings_registry
+        self._shard_coordinator = shard_coordinator
 
     @staticmethod
     async def close_tracking(tracking_id: int):
@@ -41,7 +54,8 @@ class TrackingCloser:
             f'</a>'
         )
         try:
-            await self._aiogram_bot.send_message(
+            await self._telegram_sender.send_message(
+                priority=MessagePriority.TRACKING_CLOSED,
                 text=text,
                 chat_id=user_id,
                 disable_web_page_preview=True,
@@ -73,15 +87,18 @@ class TrackingCloser:
         if any(filters_without_notifications + filters_with_notifications):
             logger.info(f'Tracking #{tracking.id} closed')
             await self.close_tracking(tracking_id=tracking.id)
+            self._active_trackings_registry.discard(tracking_id=tracking.id)
 
         if any(filters_with_notifications):
             await self.send_tracking_closed_notification(deleted_tracking=tracking, user_id=tracking.user_id)
 
     async def cycle(self):
+        # При нескольких воркерах отслеживания закрывает только один
+        if self._shard_coordinator is not None and not await self._shard_coordinator.acquire('tracking_closer'):
+            return
+
         # Получаем все отслеживания
-        async with async_session_maker() as session:
-            tracking_manager = TrackingManager(session=session)
-            trackings = await tracking_manager.get_all_tracking(only_active=True)
+        trackings = self._active_trackings_registry.get_all()
 
         for tracking in trackings:
             try:
@@ -92,10 +109,13 @@ class TrackingCloser:
 
     async def start(self):
         logger.info('Background TrackingDBCloser started')
+        await self._active_trackings_registry.wait_until_loaded()
 
         while True:
+            started_at = time.monotonic()
             try:
                 await self.cycle()
+                metrics.CYCLE_DURATION.labels(cycle='tracking_closer').observe(time.monotonic() - started_at)
             except Exception:
                 logger.error(f'Global error in cycle of close trackings: \n'
                              f'{traceback.format_exc()}')
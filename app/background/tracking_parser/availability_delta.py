@@ -0,0 +1,122 @@
+import datetime
+from typing import Literal, NamedTuple
+
+from models.trackings import TrackingModel
+from schemas.rzd_parser import TrainAvailability
+from utils.filter_trains import SEAT_TYPES, check_min_price
+from utils.route_key import RouteKey
+
+# (номер поезда, время отправления)
+TrainKey = tuple[str, datetime.datetime]
+
+
+class AvailabilityChange(NamedTuple):
+    kind: Literal['appeared', 'increased', 'price_dropped']
+    # Индекс типа мест в SEAT_TYPES
+    seat_type: int
+    seats: int
+    min_price: float
+
+
+class AvailabilityDeltaEngine:
+    """
+    Изменения наличия мест между проверками маршрута.
+
+    По каждому маршруту хранится последний снимок: места и минимальная цена по каждому поезду и типу мест.
+    Уведомление отправляется, только если по подходящему отслеживанию поезду места появились, их стало больше
+    или подешевели. Новые отслеживания и те, уведомление по которым не отправилось (например, из-за паузы
+    между уведомлениями), остаются "ожидающими" и получают уведомление о любых подходящих местах
+    """
+
+    def __init__(self):
+        self._snapshots: dict[RouteKey, dict[TrainKey, tuple[tuple[int, ...], tuple[float, ...]]]] = dict()
+        # Отслеживания, по которым уже оценивались изменения
+        self._known_tracking_ids: set[int] = set()
+        self._pending_tracking_ids: set[int] = set()
+
+    @staticmethod
+    def get_train_key(train: TrainAvailability) -> TrainKey:
+        return train.train_number, train.departure_date
+
+    def update_route(
+            self,
+            route_key: RouteKey,
+            trains: list[TrainAvailability]
+    ) -> dict[TrainKey, list[AvailabilityChange]]:
+        """Запоминает новый снимок маршрута и возвращает изменения относительно прошлого"""
+        previous_snapshot = self._snapshots.get(route_key, {})
+        snapshot = dict()
+        changes: dict[TrainKey, list[AvailabilityChange]] = dict()
+
+        for train in trains:
+            train_key = self.get_train_key(train)
+            seats = tuple(getattr(train, seats_name) for _, seats_name, _ in SEAT_TYPES)
+            prices = tuple(getattr(train, price_name) for _, _, price_name in SEAT_TYPES)
+            snapshot[train_key] = (seats, prices)
+
+            previous_seats, previous_prices = previous_snapshot.get(
+                train_key, ((0,) * len(SEAT_TYPES), (float('inf'),) * len(SEAT_TYPES))
+            )
+            train_changes = []
+            for seat_type in range(len(SEAT_TYPES)):
+                if seats[seat_type] <= 0:
+                    continue
+                if previous_seats[seat_type] <= 0:
+                    kind = 'appeared'
+                elif seats[seat_type] > previous_seats[seat_type]:
+                    kind = 'increased'
+                elif prices[seat_type] < previous_prices[seat_type]:
+                    kind = 'price_dropped'
+                else:
+                    continue
+                train_changes.append(AvailabilityChange(
+                    kind=kind,
+                    seat_type=seat_type,
+                    seats=seats[seat_type],
+                    min_price=prices[seat_type]
+                ))
+            if train_changes:
+                changes[train_key] = train_changes
+
+        self._snapshots[route_key] = snapshot
+        return changes
+
+    def should_notify(
+            self,
+            tracking: TrackingModel,
+            filtered_trains: list[TrainAvailability],
+            changes: dict[TrainKey, list[AvailabilityChange]],
+            min_seats: int = 1
+    ) -> bool:
+        """Есть ли для отслеживания новые места (filtered_trains - поезда, уже подходящие отслеживанию)"""
+        if not filtered_trains:
+            # Подходящих мест нет - ждать уведомления нечего
+            self._known_tracking_ids.add(tracking.id)
+            self._pending_tracking_ids.discard(tracking.id)
+            return False
+        if tracking.id not in self._known_tracking_ids or tracking.id in self._pending_tracking_ids:
+            return True
+
+        for train in filtered_trains:
+            for change in changes.get(self.get_train_key(train), []):
+                flag_name, _, _ = SEAT_TYPES[change.seat_type]
+                if getattr(tracking, flag_name) and change.seats >= min_seats and \
+                        check_min_price(tracking.max_price, change.min_price):
+                    return True
+        return False
+
+    def mark_notified(self, tracking_id: int) -> None:
+        self._known_tracking_ids.add(tracking_id)
+        self._pending_tracking_ids.discard(tracking_id)
+
+    def mark_pending(self, tracking_id: int) -> None:
+        """Изменения были, но уведомление не отправлено - отправим при следующей возможности"""
+        self._known_tracking_ids.add(tracking_id)
+        self._pending_tracking_ids.add(tracking_id)
+
+    def remove_route(self, route_key: RouteKey) -> None:
+        self._snapshots.pop(route_key, None)
+
+    def remove_tracking(self, tracking_id: int) -> None:
+        self._known_tracking_ids.discard(tracking_id)
+        self._pending_tracking_ids.discard(tracking_id)
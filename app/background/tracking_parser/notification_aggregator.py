@@ -0,0 +1,91 @@
+import asyncio
+from typing import Awaitable, Callable, Generic, Optional, TypeVar
+
+from utils.tracing import Trace, Tracer, get_current_trace
+
+T = TypeVar('T')
+
+
+class NotificationAggregator(Generic[T]):
+    """
+    Окно объединения уведомлений одного пользователя.
+
+    Первое уведомление пользователю открывает окно на window секунд. Всё, что пришло этому пользователю
+    за окно, отправляется одним вызовом send_batch. add() возвращает future, который завершается после отправки.
+
+    Отправка пачки - отдельная трасса со ссылками на трассы, в которых уведомления были добавлены
+    """
+
+    def __init__(
+            self,
+            send_batch: Callable[[int, list[T]], Awaitable[None]],
+            window: float = 2,
+            tracer: Optional[Tracer] = None
+    ):
+        """
+        :param send_batch: отправка накопленных уведомлений: (id пользователя, уведомления)
+        :param window: сколько секунд ждать остальные уведомления пользователю
+        :param tracer: трассировка отправки пачек
+        """
+        self._send_batch = send_batch
+        self._window = window
+        self._tracer = tracer or Tracer()
+
+        # {id пользователя: [(уведомление, future, трасса, в которой уведомление добавлено)]}
+        self._batches: dict[int, list[tuple[T, asyncio.Future, Optional[Trace]]]] = dict()
+        self._flush_tasks: set[asyncio.Task] = set()
+
+    def add(self, user_id: int, item: T) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        # Ожидающий может не дождаться отправки (его отменили) - исключение не должно остаться необработанным
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+        batch = self._batches.get(user_id)
+        if batch is None:
+            batch = self._batches[user_id] = []
+            task = asyncio.create_task(self._flush_later(user_id))
+            self._flush_tasks.add(task)
+            task.add_done_callback(self._flush_tasks.discard)
+        batch.append((item, future, get_current_trace()))
+        return future
+
+    async def _flush_later(self, user_id: int) -> None:
+        try:
+            await asyncio.sleep(self._window)
+        except asyncio.CancelledError:
+            # Пачка уходит из _batches, и stop() её уже не найдет - ожидающих отправки отменяем здесь
+            for _, future, _ in self._batches.pop(user_id, []):
+                future.cancel()
+            raise
+        batch = self._batches.pop(user_id, [])
+        try:
+            # Задача создана внутри трассы, открывшей окно, - отправка всей пачки трассируется отдельно
+            with self._tracer.trace(
+                    'notifications_batch',
+                    links=[trace for _, _, trace in batch],
+                    user_id=str(user_id),
+                    size=str(len(batch))
+            ):
+                await self._send_batch(user_id, [item for item, _, _ in batch])
+        except asyncio.CancelledError:
+            for _, future, _ in batch:
+                future.cancel()
+            raise
+        except Exception as exc:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(exc)
+        else:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_result(None)
+
+    async def stop(self) -> None:
+        """Отмена неотправленных уведомлений"""
+        for task in list(self._flush_tasks):
+            task.cancel()
+        await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+        for batch in self._batches.values():
+            for _, future, _ in batch:
+                future.cancel()
+        self._batches = dict()
@@ -0,0 +1,100 @@
+import asyncio
+import time
+import traceback
+from typing import Optional
+
+from loguru import logger
+
+from cruds.tracking_notifications import TrackingNotificationManager
+from database import async_session_maker
+from schemas.tracking_notifications import TrackingNotificationCreateSchema
+from utils import metrics
+from utils.tracing import Tracer, span
+
+
+class NotificationsWriter:
+    """
+    Отложенная пачечная запись нотификаций в БД.
+
+    Нотификации копятся в памяти и записываются одним многострочным INSERT раз в flush_interval секунд
+    или при накоплении max_batch_size нотификаций. Если запись не удалась, пачка возвращается в буфер.
+    При остановке буфер дописывается
+    """
+
+    def __init__(
+            self,
+            flush_interval: float = 1,
+            max_batch_size: int = 200,
+            stop_flush_attempts: int = 3,
+            tracer: Optional[Tracer] = None
+    ):
+        """
+        :param flush_interval: как часто (в секундах) записывать накопленное
+        :param max_batch_size: сколько нотификаций накопить, чтобы записать, не дожидаясь flush_interval
+        :param stop_flush_attempts: сколько раз пытаться дописать буфер при остановке
+        :param tracer: трассировка записи пачек
+        """
+        self._flush_interval = flush_interval
+        self._max_batch_size = max_batch_size
+        self._stop_flush_attempts = stop_flush_attempts
+        self._tracer = tracer or Tracer()
+
+        self._notifications: list[TrackingNotificationCreateSchema] = []
+        self._flush_requested = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._notifications)
+
+    def add_notification(self, notification: TrackingNotificationCreateSchema) -> None:
+        self._notifications.append(notification)
+        if len(self._notifications) >= self._max_batch_size:
+            self._flush_requested.set()
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            notifications, self._notifications = self._notifications, []
+            if not notifications:
+                return
+            started_at = time.monotonic()
+            try:
+                with span('notifications_flush'):
+                    async with async_session_maker() as session:
+                        tracking_notification_manager = TrackingNotificationManager(session=session)
+                        await tracking_notification_manager.insert_multi(notifications)
+                        await session.commit()
+            except BaseException:
+                # Не записанное возвращаем в начало буфера - запишется следующей пачкой
+                self._notifications = notifications + self._notifications
+                raise
+            metrics.NOTIFICATIONS_FLUSH_DURATION.observe(time.monotonic() - started_at)
+        logger.debug(f'NotificationsWriter flushed {len(notifications)} notifications')
+
+    async def start(self):
+        logger.info('Background NotificationsWriter started')
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            if not self._notifications:
+                continue
+            try:
+                with self._tracer.trace('notifications_writer', size=str(len(self._notifications))):
+                    await self.flush()
+            except Exception:
+                logger.error(f'Global error in cycle of NotificationsWriter: \n'
+                             f'{traceback.format_exc()}')
+
+    async def stop(self):
+        """Запись всего, что осталось в буфере"""
+        for attempt in range(self._stop_flush_attempts):
+            try:
+                await self.flush()
+                return
+            except Exception:
+                logger.warning(f'Error while stopping NotificationsWriter (attempt {attempt + 1}): \n'
+                               f'{traceback.format_exc()}')
+                await asyncio.sleep(1)
+        logger.error(f'NotificationsWriter lost {len(self._notifications)} notifications: {self._notifications}')
@@ -0,0 +1,135 @@
+import asyncio
+import datetime
+import heapq
+import itertools
+import time
+from typing import Optional
+
+from utils.route_key import RouteKey
+
+
+class RouteScheduler:
+    """
+    Планировщик проверок маршрутов: куча по времени следующей проверки.
+
+    Интервал опроса маршрута зависит от того, сколько осталось до отправления ближайшего поезда
+    (или до даты маршрута, пока поезда неизвестны): чем ближе отправление, тем чаще проверяем
+    """
+
+    def __init__(
+            self,
+            poll_interval_tiers: list[tuple[float, float]],
+            default_poll_interval: float
+    ):
+        """
+        :param poll_interval_tiers: список (часов до отправления, интервал опроса в секундах).
+        Берется первый уровень, в который попадает маршрут
+        :param default_poll_interval: интервал опроса маршрутов, не попавших ни в один уровень (секунды)
+        """
+        self._poll_interval_tiers = sorted(poll_interval_tiers)
+        self._default_poll_interval = default_poll_interval
+
+        # [ключ очереди (время проверки или -inf для first), порядковый номер, маршрут или None, если маршрут
+        # снят с проверок, время проверки (time.monotonic)]
+        self._heap: list[list] = []
+        self._entries: dict[RouteKey, list] = dict()
+        self._counter = itertools.count()
+        self._earliest_departures: dict[RouteKey, datetime.datetime] = dict()
+        self._condition = asyncio.Condition()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, route_key: RouteKey) -> bool:
+        return route_key in self._entries
+
+    @staticmethod
+    def _get_moscow_now() -> datetime.datetime:
+        # Время отправления РЖД отдает в местном времени, для большинства маршрутов это московское
+        return datetime.datetime.utcnow() + datetime.timedelta(hours=3)
+
+    def get_poll_interval(self, route_key: RouteKey) -> float:
+        departure = self._earliest_departures.get(route_key)
+        if departure is None:
+            departure = datetime.datetime.combine(route_key.date, datetime.time.min)
+        hours_before_departure = (departure - self._get_moscow_now()).total_seconds() / 3600
+
+        for tier_hours_before_departure, tier_poll_interval in self._poll_interval_tiers:
+            if hours_before_departure <= tier_hours_before_departure:
+                return tier_poll_interval
+        return self._default_poll_interval
+
+    def set_earliest_departure(self, route_key: RouteKey, departures: list[datetime.datetime]) -> None:
+        """Запоминает ближайшее ещё не ушедшее отправление на маршруте"""
+        now = self._get_moscow_now()
+        future_departures = [departure for departure in departures if departure > now]
+        if future_departures:
+            self._earliest_departures[route_key] = min(future_departures)
+        else:
+            self._earliest_departures.pop(route_key, None)
+
+    async def put(self, route_key: RouteKey, delay: Optional[float] = None, first: bool = False) -> None:
+        """
+        Ставит маршрут на проверку через delay секунд (по умолчанию - через интервал опроса маршрута).
+        first=True ставит маршрут в начало очереди, перед просроченными.
+        Если маршрут уже запланирован, остается более раннее время
+        """
+        if first:
+            due_at = time.monotonic()
+            queue_key = float('-inf')
+        else:
+            if delay is None:
+                delay = self.get_poll_interval(route_key)
+            due_at = queue_key = time.monotonic() + delay
+
+        entry = self._entries.get(route_key)
+        if entry is not None:
+            if entry[0] <= queue_key:
+                return
+            entry[2] = None
+
+        entry = [queue_key, next(self._counter), route_key, due_at]
+        self._entries[route_key] = entry
+        heapq.heappush(self._heap, entry)
+        async with self._condition:
+            self._condition.notify_all()
+
+    def get_overdue_count(self) -> int:
+        """Количество маршрутов, время проверки которых уже подошло"""
+        now = time.monotonic()
+        return sum(1 for entry in self._entries.values() if entry[3] <= now)
+
+    def get_max_overdue(self) -> float:
+        """На сколько секунд просрочена проверка самого просроченного маршрута (0 - просроченных нет)"""
+        if not self._entries:
+            return 0
+        return max(time.monotonic() - min(entry[3] for entry in self._entries.values()), 0)
+
+    def remove(self, route_key: RouteKey) -> None:
+        """Снимает маршрут с проверок"""
+        entry = self._entries.pop(route_key, None)
+        if entry is not None:
+            entry[2] = None
+        self._earliest_departures.pop(route_key, None)
+
+    async def get(self) -> RouteKey:
+        """Ждет, пока подойдет время проверки ближайшего маршрута, и возвращает его"""
+        async with self._condition:
+            while True:
+                while self._heap and self._heap[0][2] is None:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    await self._condition.wait()
+                    continue
+
+                delay = self._heap[0][0] - time.monotonic()
+                if delay <= 0:
+                    _, _, route_key, _ = heapq.heappop(self._heap)
+                    del self._entries[route_key]
+                    return route_key
+
+                try:
+                    await asyncio.wait_for(self._condition.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+
@@ -1,64 +1,147 @@
 import asyncio
 import datetime
+import functools
+import time
 import traceback
 from json import JSONDecodeError
-from queue import Queue
+from typing import Optional
 
 import aiohttp
-from aiogram import Bot
 from loguru import logger
 
+from background.active_trackings_registry import ActiveTrackingsRegistry
+from background.shard_coordinator import ShardCoordinator
 from cruds.tracking_notifications import TrackingNotificationManager
 from cruds.trackings import TrackingManager
 from database import async_session_maker
 from keyboards.trackings import found_seats_notification_kb
 from models.trackings import TrackingModel
-from schemas.rzd_parser import Train
+from schemas.rzd_parser import TrainAvailability
+from schemas.tracking_events import TrackingEventSchema
 from schemas.tracking_notifications import TrackingNotificationCreateSchema
-from schemas.trackings import TrackingUpdateSchema
-from utils.filter_trains import filter_trains_by_tracking, check_min_price
+from utils import metrics
+from utils.tracing import Tracer, span
+from utils.availability_history import AvailabilityHistoryStore
+from utils.filter_trains import filter_trains_by_trackings, check_min_price, get_car_types_by_tracking
 from utils.rzd_links_generator import create_url_to_trains
+from utils.route_key import RouteKey, get_route_key
+from utils.rzd_exceptions import (
+    RZDCircuitOpenException,
+    RZDInvalidResponseException,
+    RZDResponseNotRecordedException,
+    RZDRouteQuarantinedException,
+    RZDUnavailableException
+)
 from utils.rzd_parser import RZDParser
-from .exceptions import TrackingFinishedException
+from utils.telegram_sender import MessagePriority, TelegramSender
+from .availability_delta import AvailabilityDeltaEngine
+from .notification_aggregator import NotificationAggregator
+from .notifications_writer import NotificationsWriter
+from .route_scheduler import RouteScheduler
 
 
 class TrackingParser:
     def __init__(
             self,
-            aiogram_bot_token: str,
+            telegram_sender: TelegramSender,
+            rzd_parser: RZDParser,
+            active_trackings_registry: ActiveTrackingsRegistry,
+            shard_coordinator: Optional[ShardCoordinator] = None,
             limit_of_parallel_handlers: int = 15,
+            trackings_refresh_interval: float = 10,
+            poll_interval_tiers: Optional[list[tuple[float, float]]] = None,
+            default_poll_interval: float = 600,
+            availability_history: Optional[AvailabilityHistoryStore] = None,
+            notification_aggregation_window: float = 2,
+            notifications_flush_interval: float = 1,
+            notifications_flush_size: int = 200,
+            tracer: Optional[Tracer] = None
     ):
+        """
+        :param shard_coordinator: если передан, обрабатываются только маршруты этого воркера
+        :param limit_of_parallel_handlers: количество обработчиков маршрутов, работающих параллельно
+        :param trackings_refresh_interval: как часто (в секундах) перечитывать активные отслеживания из реестра
+        :param poll_interval_tiers: список (часов до отправления, интервал опроса маршрута в секундах)
+        :param default_poll_interval: интервал опроса маршрутов с отправлением дальше всех уровней (секунды)
+        :param availability_history: если передано, туда записывается результат каждого опроса маршрута
+        :param notification_aggregation_window: сколько секунд собирать уведомления пользователю в одно сообщение
+        :param notifications_flush_interval: как часто (в секундах) записывать отправленные нотификации в БД
+        :param notifications_flush_size: сколько нотификаций накопить, чтобы записать их, не дожидаясь интервала
+        :param tracer: трассировка этапов обработки маршрута
+        """
+        self._rzd_parser = rzd_parser
+        self._active_trackings_registry = active_trackings_registry
+        self._shard_coordinator = shard_coordinator
         self._limit_of_parallel_handlers = limit_of_parallel_handlers
-        self._current_parallel_handlers = 0
-        self._aiogram_bot = Bot(token=aiogram_bot_token)
+        self._trackings_refresh_interval = trackings_refresh_interval
+        self._availability_history = availability_history
+        self._telegram_sender = telegram_sender
+        self._tracer = tracer or Tracer()
 
-        self._last_connection_statuses: list[bool] = []
-        self._length_of_last_connection_statuses = 10
+        # Очередь маршрутов по времени их следующей проверки
+        self._route_scheduler = RouteScheduler(
+            poll_interval_tiers=poll_interval_tiers or [],
+            default_poll_interval=default_poll_interval
+        )
+        # Уведомления пользователю, найденные почти одновременно, уходят одним сообщением
+        self._notification_aggregator: NotificationAggregator[tuple[TrackingModel, list[TrainAvailability]]] = \
+            NotificationAggregator(
+                send_batch=self._send_seats_alerts,
+                window=notification_aggregation_window,
+                tracer=self._tracer
+            )
+        # Лимит текста поездов в одном сообщении (у Telegram - 4096 символов, остальное - на подпись)
+        self._max_aggregated_text_length = 3500
+        # Нотификации и даты первых нотификаций пишутся в БД пачками
+        self._notifications_writer = NotificationsWriter(
+            flush_interval=notifications_flush_interval,
+            max_batch_size=notifications_flush_size,
+            tracer=self._tracer
+        )
+        # {id отслеживания: дата последней нотификации или None} - пауза между нотификациями без запросов к БД
+        self._last_notifications_at: dict[int, Optional[datetime.datetime]] = dict()
+        self._notification_cooldown = datetime.timedelta(minutes=5)
+        # Изменения наличия мест по маршрутам: уведомляем только о новых местах
+        self._availability_delta = AvailabilityDeltaEngine()
+        # Маршруты, которые сейчас обрабатываются
+        self._in_flight_route_tasks: dict[RouteKey, asyncio.Task] = dict()
+        # Маршруты, перешедшие к этому воркеру от другого (и все маршруты при запуске воркера с шардированием).
+        # Снимка мест по ним нет, и первый опрос счел бы все места новыми: он только запоминает снимок,
+        # а уже уведомленные отслеживания (first_notification_sent_at) не уведомляются повторно
+        self._seed_route_keys: set[RouteKey] = set()
+        # Маршруты из реестра, принадлежавшие другим воркерам при прошлой синхронизации
+        self._foreign_route_keys: set[RouteKey] = set()
+        self._trackings_refreshed = False
+        # Маршруты, которые нужно проверить первыми сразу после текущей обработки (новое отслеживание)
+        self._pending_first_checks: set[RouteKey] = set()
+        # {RouteKey(...): {12: TrackingModel()}}
+        self._mapping_route_to_trackings: dict[RouteKey, dict[int, TrackingModel]] = dict()
 
-    async def _get_tracking(
-            self,
-            queue_tracking_ids: Queue,
-            mapping_id_to_tracking: dict[int, TrackingModel]
-    ) -> TrackingModel:
-        """Получение отслеживания из очереди для последующей обработки"""
-        tracking_id: int = queue_tracking_ids.get(block=False)
-        if tracking_id not in mapping_id_to_tracking:
-            raise TrackingFinishedException(tracking_id=tracking_id)
-        return mapping_id_to_tracking[tracking_id]
-
-    async def _put_tracking(
-            self,
-            tracking: TrackingModel,
-            queue_tracking_ids: Queue,
-            mapping_id_to_tracking: dict[int, TrackingModel]
-    ) -> None:
-        """Занесение отслеживания в очередь после его обработки"""
-        if tracking.id not in mapping_id_to_tracking:
-            raise TrackingFinishedException(tracking_id=tracking.id)
-        queue_tracking_ids.put(tracking.id)
+        self._background_tasks: list[asyncio.Task] = []
+
+        metrics.ROUTES_SCHEDULED.set_function(lambda: len(self._route_scheduler))
+        metrics.ROUTES_OVERDUE.set_function(self._route_scheduler.get_overdue_count)
+        metrics.ROUTES_IN_FLIGHT.set_function(lambda: len(self._in_flight_route_tasks))
+        metrics.MAX_ROUTE_OVERDUE.set_function(self._route_scheduler.get_max_overdue)
+        metrics.ACTIVE_TRACKINGS.set_function(
+            lambda: sum(len(route_trackings) for route_trackings in self._mapping_route_to_trackings.values())
+        )
+
+    async def _put_route(self, route_key: RouteKey, delay: Optional[float] = None, first: bool = False) -> None:
+        """
+        Планирование проверки маршрута, если он ещё активен и сейчас не обрабатывается.
+        first=True для обрабатываемого маршрута запоминается: он встанет в начало очереди после обработки
+        """
+        if route_key not in self._mapping_route_to_trackings:
+            return
+        if route_key in self._in_flight_route_tasks:
+            if first:
+                self._pending_first_checks.add(route_key)
+            return
+        await self._route_scheduler.put(route_key=route_key, delay=delay, first=first)
 
     @staticmethod
-    def _generate_notification_text_from_trains(tracking: TrackingModel, trains: list[Train]) -> str:
+    def _generate_trains_text(tracking: TrackingModel, trains: list[TrainAvailability]) -> str:
         text = f'<b>⚡️ Важно! Найдены подходящие билеты (#{tracking.id}) ⚡️</b>\n\n'
         for i, train in enumerate(trains):
             rzd_train_url = create_url_to_trains(
@@ -99,179 +182,489 @@ class TrackingParser:
             prices_row += ', '.join(available_filtered_seats)
             train_text += f'{prices_row}\n\n'
             text += train_text
-        deactivate_tracking_time = (
-                tracking.first_notification_sent_at + datetime.timedelta(hours=24) - datetime.datetime.utcnow()
-        )
-        text += (
+        return text
+
+    @staticmethod
+    def _generate_notification_footer(trackings: list[TrackingModel]) -> str:
+        now = datetime.datetime.utcnow()
+        # У отслеживания без первой нотификации дата появится после отправки этого сообщения
+        deactivate_tracking_time = min(
+            (tracking.first_notification_sent_at or now) + datetime.timedelta(hours=24) for tracking in trackings
+        ) - now
+        if len(trackings) == 1:
+            return (
+                f'------\n'
+                f'❗️После удачной/неудачной покупки, <b>нажмите на одну из кнопок ниже</b>, в соответствии с тем, взяли вы билет или нет. '
+                f'Если вы ничего не выберите, <b>отслеживание перестанет быть активным через '
+                f'{str(deactivate_tracking_time).split(".")[0]}</b>'
+            )
+        return (
             f'------\n'
-            f'❗️После удачной/неудачной покупки, <b>нажмите на одну из кнопок ниже</b>, в соответствии с тем, взяли вы билет или нет. '
-            f'Если вы ничего не выберите, <b>отслеживание перестанет быть активным через '
+            f'❗️После удачной/неудачной покупки, <b>нажмите на кнопку нужного отслеживания ниже</b>, в соответствии с тем, '
+            f'взяли вы билет или нет. Если вы ничего не выберите, <b>отслеживания начнут переставать быть активными через '
             f'{str(deactivate_tracking_time).split(".")[0]}</b>'
         )
-        return text
-
-    async def _handle_tracking(
-            self,
-            tracking: TrackingModel,
-    ):
 
-        rzd_parser = RZDParser()
-        trains = await rzd_parser.get_trains(
-            from_city_id=tracking.from_city_id,
-            to_city_id=tracking.to_city_id,
-            date=tracking.date
-        )
-        filtered_trains = filter_trains_by_tracking(
-            trains=trains,
-            max_price=tracking.max_price,
-            sw_enabled=tracking.sw_enabled,
-            sid_enabled=tracking.sid_enabled,
-            plaz_seats_plaz_down_enabled=tracking.plaz_seats_plaz_down_enabled,
-            plaz_seats_plaz_up_enabled=tracking.plaz_seats_plaz_up_enabled,
-            plaz_side_down_enabled=tracking.plaz_side_down_enabled,
-            plaz_side_up_enabled=tracking.plaz_side_up_enabled,
-            cupe_up_enabled=tracking.cupe_up_enabled,
-            cupe_down_enabled=tracking.cupe_down_enabled,
-            min_seats=1
-        )
-        async with async_session_maker() as session:
-            tracking_manager = TrackingManager(session=session)
-            tracking_notification_manager = TrackingNotificationManager(session=session)
+    async def _send_seats_alerts(self, user_id: int, alerts: list[tuple[TrackingModel, list[TrainAvailability]]]):
+        """Отправка уведомлений пользователю, накопленных за окно объединения, одним сообщением"""
+        # Сообщение не может быть длиннее 4096 символов - не поместившиеся отслеживания уходят следующим
+        messages_alerts: list[list[tuple[TrackingModel, list[TrainAvailability]]]] = []
+        messages_texts_length = 0
+        for tracking, filtered_trains in alerts:
+            with span('notification_text'):
+                text_length = len(self._generate_trains_text(tracking=tracking, trains=filtered_trains))
+            if not messages_alerts or messages_texts_length + text_length > self._max_aggregated_text_length:
+                messages_alerts.append([])
+                messages_texts_length = 0
+            messages_alerts[-1].append((tracking, filtered_trains))
+            messages_texts_length += text_length
 
-            # Проверка предыдущей нотификации.
-            #  Если в течение 5 минут уже была нотификация по этому отслеживанию, то не отправляем
-            last_notification_by_tracking = await tracking_notification_manager.get_last_notification_by_tracking_id(
-                tracking_id=tracking.id
-            )
-            notification_waited_flag = (
-                    last_notification_by_tracking is None
-                    or (datetime.datetime.utcnow() - datetime.timedelta(
-                minutes=5)) > last_notification_by_tracking.created_at
-            )
-            if notification_waited_flag and len(filtered_trains) > 0:
-                # Сохраняем информацию о первой нотификации об отслеживании
-                if tracking.first_notification_sent_at is None:
-                    await tracking_manager.update(
-                        obj_id=tracking.id,
-                        obj_in=TrackingUpdateSchema(first_notification_sent_at=datetime.datetime.utcnow())
-                    )
-                    tracking = await tracking_manager.get(tracking.id)
-                sent_message = await self._aiogram_bot.send_message(
-                    chat_id=tracking.user_id,
-                    text=self._generate_notification_text_from_trains(tracking=tracking, trains=filtered_trains),
+        for message_alerts in messages_alerts:
+            trackings = [tracking for tracking, _ in message_alerts]
+            for tracking in trackings:
+                self._last_notifications_at[tracking.id] = datetime.datetime.utcnow()
+            with span('notification_text'):
+                text = ''.join(
+                    self._generate_trains_text(tracking=tracking, trains=filtered_trains)
+                    for tracking, filtered_trains in message_alerts
+                ) + self._generate_notification_footer(trackings)
+            # Включая ожидание в очереди отправки
+            with span('send_message'):
+                sent_message = await self._telegram_sender.send_message(
+                    priority=MessagePriority.SEATS_ALERT,
+                    chat_id=user_id,
+                    text=text,
                     parse_mode='HTML',
                     disable_web_page_preview=True,
-                    reply_markup=found_seats_notification_kb(tracking_id=tracking.id)
+                    reply_markup=found_seats_notification_kb(tracking_ids=[tracking.id for tracking in trackings])
                 )
-                #  Сохраняем информацию о нотификации
-                await tracking_notification_manager.create(TrackingNotificationCreateSchema(
+            metrics.NOTIFICATIONS_SENT.inc(len(trackings))
+            # Дата первой нотификации - только после отправки: по ней отслеживание закрывается через 24 часа
+            first_notification_dates = dict()
+            for tracking in trackings:
+                if tracking.first_notification_sent_at is None:
+                    # Отслеживание из реестра: дату увидят и остальные фоновые циклы
+                    tracking.first_notification_sent_at = datetime.datetime.utcnow()
+                    first_notification_dates[tracking.id] = tracking.first_notification_sent_at
+            await self._save_first_notification_dates(first_notification_dates)
+            #  Сами нотификации пишутся в БД следующей пачкой
+            for tracking in trackings:
+                self._notifications_writer.add_notification(TrackingNotificationCreateSchema(
                     tracking_id=tracking.id,
                     user_id=tracking.user_id,
                     telegram_message_id=sent_message.message_id
                 ))
-                logger.info(f'tracking #{tracking.id} sent notification')
-            await session.commit()
+            logger.info(f'trackings {", ".join(f"#{tracking.id}" for tracking in trackings)} sent notification')
 
-        logger.debug(f'#{tracking.id} handled')
+    @staticmethod
+    async def _save_first_notification_dates(first_notification_dates: dict[int, datetime.datetime]) -> None:
+        """
+        Дата первой нотификации пишется сразу, а не пачкой: она не должна потеряться при падении воркера
+        и не должна перезаписать дату, которую пользователь уже сбросил кнопкой "Не успел"
+        """
+        if not first_notification_dates:
+            return
+        try:
+            async with async_session_maker() as session:
+                tracking_manager = TrackingManager(session=session)
+                await tracking_manager.set_first_notification_dates_if_empty(first_notification_dates)
+                await session.commit()
+        except Exception:
+            logger.error(f'Не удалось сохранить даты первых нотификаций {first_notification_dates}:\n '
+                         f'{traceback.format_exc()}')
+
+    async def _get_last_notification_at(self, tracking_id: int) -> Optional[datetime.datetime]:
+        """Дата последней нотификации по отслеживанию из памяти. В БД идем один раз за жизнь отслеживания"""
+        if tracking_id not in self._last_notifications_at:
+            async with async_session_maker() as session:
+                tracking_notification_manager = TrackingNotificationManager(session=session)
+                last_notification = await tracking_notification_manager.get_last_notification_by_tracking_id(
+                    tracking_id=tracking_id
+                )
+            self._last_notifications_at[tracking_id] = last_notification.created_at if last_notification else None
+        return self._last_notifications_at[tracking_id]
 
-    async def _handle_tracking_with_exception_handling(
+    async def _load_last_notifications_at(self) -> None:
+        """Начальное заполнение дат последних нотификаций по всем активным отслеживаниям одним запросом"""
+        async with async_session_maker() as session:
+            tracking_notification_manager = TrackingNotificationManager(session=session)
+            last_notifications_at = await tracking_notification_manager.get_last_notification_dates_of_active_trackings()
+        self._last_notifications_at.update({
+            tracking.id: last_notifications_at.get(tracking.id)
+            for tracking in self._active_trackings_registry.get_all()
+        })
+
+    async def _handle_tracking(
             self,
-            queue_tracking_ids: Queue,
-            mapping_id_to_tracking: dict[int, TrackingModel]
-    ):
+            tracking: TrackingModel,
+            filtered_trains: list[TrainAvailability]
+    ) -> Optional[asyncio.Future]:
+        """
+        Постановка уведомления о найденных местах в окно объединения уведомлений пользователя.
+        Возвращает future отправки или None, если уведомление сейчас не отправляется
+        """
+        if len(filtered_trains) == 0:
+            return None
 
-        self._current_parallel_handlers += 1
-        try:
-            tracking = await self._get_tracking(
-                queue_tracking_ids=queue_tracking_ids,
-                mapping_id_to_tracking=mapping_id_to_tracking
+        # Проверка предыдущей нотификации.
+        #  Если в течение 5 минут уже была нотификация по этому отслеживанию, то не отправляем
+        with span('cooldown_lookup'):
+            last_notification_at = await self._get_last_notification_at(tracking_id=tracking.id)
+        notification_waited_flag = (
+                last_notification_at is None
+                or (datetime.datetime.utcnow() - self._notification_cooldown) > last_notification_at
+        )
+        if not notification_waited_flag:
+            metrics.NOTIFICATIONS_SUPPRESSED.labels(reason='cooldown').inc()
+            return None
+
+        notification_future = self._notification_aggregator.add(
+            user_id=tracking.user_id,
+            item=(tracking, filtered_trains)
+        )
+        logger.debug(f'#{tracking.id} handled')
+        return notification_future
+
+    async def _handle_route(self, route_key: RouteKey):
+        """Один запрос к РЖД на маршрут, результат раздается всем отслеживаниям этого маршрута"""
+        # Разбираем только те типы вагонов, которые нужны отслеживаниям маршрута
+        route_trackings = list(self._mapping_route_to_trackings.get(route_key, {}).values())
+        car_types: set[str] = set()
+        for tracking in route_trackings:
+            car_types |= get_car_types_by_tracking(
+                sw_enabled=tracking.sw_enabled,
+                sid_enabled=tracking.sid_enabled,
+                plaz_seats_plaz_down_enabled=tracking.plaz_seats_plaz_down_enabled,
+                plaz_seats_plaz_up_enabled=tracking.plaz_seats_plaz_up_enabled,
+                plaz_side_down_enabled=tracking.plaz_side_down_enabled,
+                plaz_side_up_enabled=tracking.plaz_side_up_enabled,
+                cupe_up_enabled=tracking.cupe_up_enabled,
+                cupe_down_enabled=tracking.cupe_down_enabled
             )
-        except TrackingFinishedException:
-            self._current_parallel_handlers -= 1
-            return
 
+        with span('get_trains'):
+            trains = await self._rzd_parser.get_trains(
+                from_city_id=route_key.from_city_id,
+                to_city_id=route_key.to_city_id,
+                date=route_key.date,
+                # Для истории нужны все типы вагонов
+                car_types=car_types if self._availability_history is None else None
+            )
+        if self._availability_history is not None:
+            try:
+                with span('history_append'):
+                    self._availability_history.append(route_key=route_key, trains=trains)
+            except Exception:
+                logger.error(f'Не удалось записать историю маршрута {route_key}:\n {traceback.format_exc()}')
+        self._route_scheduler.set_earliest_departure(
+            route_key=route_key,
+            departures=[train.departure_date for train in trains]
+        )
+
+        with span('availability_delta'):
+            changes = self._availability_delta.update_route(route_key=route_key, trains=trains)
+        seed_only = route_key in self._seed_route_keys
+        self._seed_route_keys.discard(route_key)
+        # Поезда проверяются сразу для всех отслеживаний маршрута
+        with span('filter_trains'):
+            filtered_trains_by_trackings = filter_trains_by_trackings(
+                trains=trains, trackings=route_trackings, min_seats=1
+            )
+
+        # Уведомления ставятся в окно объединения, отправки не ждем: окно не задерживает проверку маршрутов
+        for tracking, filtered_trains in zip(route_trackings, filtered_trains_by_trackings):
+            # Отслеживание могло завершиться, пока обрабатывались предыдущие
+            tracking = self._mapping_route_to_trackings.get(route_key, {}).get(tracking.id)
+            if tracking is None:
+                continue
+            if seed_only and tracking.first_notification_sent_at is not None:
+                # Об этих местах уже мог уведомить прошлый владелец маршрута
+                self._availability_delta.mark_notified(tracking_id=tracking.id)
+                if filtered_trains:
+                    metrics.NOTIFICATIONS_SUPPRESSED.labels(reason='shard_takeover').inc()
+                continue
+            if not self._availability_delta.should_notify(
+                    tracking=tracking,
+                    filtered_trains=filtered_trains,
+                    changes=changes
+            ):
+                if filtered_trains:
+                    # Места есть, но с прошлого уведомления не появились новые и не подешевели
+                    metrics.NOTIFICATIONS_SUPPRESSED.labels(reason='no_changes').inc()
+                continue
+            try:
+                notification_future = await self._handle_tracking(tracking=tracking, filtered_trains=filtered_trains)
+            except Exception:
+                notification_future = None
+                logger.error(f'Ошибка при обработке отслеживания #{tracking.id}:\n {traceback.format_exc()}')
+            if notification_future is None:
+                self._availability_delta.mark_pending(tracking_id=tracking.id)
+                continue
+            # Пока уведомление в окне, повторная проверка маршрута не ставит его снова
+            self._availability_delta.mark_notified(tracking_id=tracking.id)
+            notification_future.add_done_callback(functools.partial(self._on_notification_done, tracking.id))
+
+    def _on_notification_done(self, tracking_id: int, notification_future: asyncio.Future) -> None:
+        """Уведомление не отправилось - отслеживание получит его при следующей проверке маршрута"""
+        # Отмена - воркер останавливается
+        if not notification_future.cancelled():
+            exc = notification_future.exception()
+            if exc is None:
+                return
+            metrics.NOTIFICATIONS_SUPPRESSED.labels(reason='send_failed').inc()
+            logger.error(f'Ошибка при отправке уведомления #{tracking_id}:\n '
+                         f'{"".join(traceback.format_exception(type(exc), exc, exc.__traceback__))}')
+        # Завершенное за время отправки отслеживание уже забыто движком изменений
+        if self._active_trackings_registry.get(tracking_id) is not None:
+            self._availability_delta.mark_pending(tracking_id=tracking_id)
+
+    async def _handle_route_with_exception_handling(self, route_key: RouteKey) -> Optional[float]:
+        """
+        :return: через сколько секунд проверить маршрут снова. None - через обычный интервал опроса
+        """
+        started_at = time.monotonic()
         try:
-            await self._handle_tracking(tracking=tracking)
-            self._last_connection_statuses = self._last_connection_statuses[::-1][:self._length_of_last_connection_statuses] + [True]
-        except asyncio.exceptions.TimeoutError:
-            # Информацию о каждой ошибке подключения не присылаем
-            self._last_connection_statuses = self._last_connection_statuses[::-1][:self._length_of_last_connection_statuses] + [False]
-            if len(self._last_connection_statuses) == self._length_of_last_connection_statuses and not any(self._last_connection_statuses):
-                logger.error(f'Произошла ошибка подключения к серверу РЖД ({self._length_of_last_connection_statuses} подряд)')
-                self._last_connection_statuses = []
+            with self._tracer.trace('route', route=f'{route_key.from_city_id}-{route_key.to_city_id}-{route_key.date}'):
+                await self._handle_route(route_key=route_key)
+            metrics.CYCLE_DURATION.labels(cycle='route').observe(time.monotonic() - started_at)
+        except (asyncio.exceptions.TimeoutError, aiohttp.ClientConnectionError, RZDUnavailableException):
+            # Об ошибках подключения подряд сообщает circuit breaker
+            pass
+        except RZDCircuitOpenException:
+            # Запрос не отправлялся - маршрут проверим, как только РЖД снова станет доступен
+            return 0
+        except RZDRouteQuarantinedException as exc:
+            return max(exc.retry_after, self._route_scheduler.get_poll_interval(route_key))
+        except RZDInvalidResponseException:
+            # Ответ уже залогирован, повторяющиеся ошибки маршрута отправляют его в карантин
+            pass
+        except RZDResponseNotRecordedException as exc:
+            # Воспроизведение корпуса: маршрута нет в записи. Не ошибка воркера - в Telegram админу не уходит
+            logger.warning(str(exc))
         except JSONDecodeError as exc:
             logger.error(f'Ошибка декодирования ответа от сервера: \n{exc.doc}')
         except Exception:
             logger.error(f'Произошла неизвестная ошибка:\n {traceback.format_exc()}')
+        return None
 
+    async def _worker(self):
+        """Долгоживущий обработчик: берет маршруты, у которых подошло время проверки, пока его не отменят"""
+        while True:
+            # Пока запросы к РЖД приостановлены, маршруты не разбираются: все равно не будут проверены
+            await self._rzd_parser.wait_until_available()
+            route_key = await self._route_scheduler.get()
+            if route_key not in self._mapping_route_to_trackings:
+                continue
+            if not await self._acquire_route(route_key):
+                # Маршрут ещё обрабатывает прошлый владелец - попробуем позже
+                await self._put_route(route_key)
+                continue
+            task = asyncio.create_task(self._handle_route_with_exception_handling(route_key=route_key))
+            self._in_flight_route_tasks[route_key] = task
+            try:
+                # asyncio.wait не отменяет обработку маршрута вместе с ожидающим её обработчиком
+                await asyncio.wait([task])
+            except asyncio.CancelledError:
+                # Отменяют сам обработчик (остановка парсера) - отменяем и обработку маршрута
+                task.cancel()
+                raise
+            finally:
+                del self._in_flight_route_tasks[route_key]
+            if task.cancelled():
+                logger.info(f'Route {route_key} handling cancelled')
+            if route_key not in self._mapping_route_to_trackings:
+                await self._release_route(route_key)
+
+            if route_key in self._pending_first_checks:
+                # Пока маршрут обрабатывался, на нем появилось новое отслеживание - проверяем его сразу
+                self._pending_first_checks.discard(route_key)
+                await self._put_route(route_key, first=True)
+                continue
+            # Следующая проверка - через интервал, зависящий от близости отправления
+            await self._put_route(route_key, delay=None if task.cancelled() else task.result())
+
+    async def _acquire_route(self, route_key: RouteKey) -> bool:
+        if self._shard_coordinator is None:
+            return True
         try:
-            await self._put_tracking(
-                tracking=tracking,
-                queue_tracking_ids=queue_tracking_ids,
-                mapping_id_to_tracking=mapping_id_to_tracking
-            )
-        except TrackingFinishedException:
-            pass
+            return await self._shard_coordinator.acquire_route(route_key)
+        except Exception:
+            logger.warning(f'Не удалось взять аренду маршрута {route_key}: \n{traceback.format_exc()}')
+            return False
 
-        self._current_parallel_handlers -= 1
+    async def _release_route(self, route_key: RouteKey) -> None:
+        if self._shard_coordinator is None:
+            return
+        try:
+            await self._shard_coordinator.release_route(route_key)
+        except Exception:
+            logger.warning(f'Не удалось отдать аренду маршрута {route_key}: \n{traceback.format_exc()}')
 
-    async def one_cycle(
-            self,
-            queue_tracking_ids: Queue,
-            mapping_id_to_tracking: dict[int, TrackingModel]
-    ):
-        async with async_session_maker() as session:
-            tracking_manager = TrackingManager(session=session)
-            trackings = await tracking_manager.get_all_tracking(only_active=True)
+    def _forget_tracking(self, tracking_id: int) -> None:
+        """Очистка состояния отслеживания, которое больше не проверяется этим воркером"""
+        self._availability_delta.remove_tracking(tracking_id=tracking_id)
+        self._last_notifications_at.pop(tracking_id, None)
+
+    @staticmethod
+    def _is_tracking_checked(tracking: TrackingModel) -> bool:
+        """Отслеживание активно, пользователь не заблокирован и подписка не истекла"""
+        if tracking.is_finished:
+            return False
+        if tracking.user.is_banned:
+            return False
+        if datetime.datetime.utcnow() > tracking.user.subscription_expires_at:
+            return False
+        return True
+
+    @staticmethod
+    def _get_tracking_route_key(tracking: TrackingModel) -> RouteKey:
+        return get_route_key(
+            from_city_id=tracking.from_city_id,
+            to_city_id=tracking.to_city_id,
+            date=tracking.date
+        )
+
+    def _add_route(self, route_key: RouteKey) -> None:
+        logger.info(f'Route {route_key} added')
+        if self._shard_coordinator is not None and (
+                not self._trackings_refreshed or route_key in self._foreign_route_keys
+        ):
+            self._seed_route_keys.add(route_key)
+        self._mapping_route_to_trackings[route_key] = dict()
 
-        # Обновляем текущие трекинги + добавляем новые
+    async def _remove_route(self, route_key: RouteKey) -> None:
+        """Снятие маршрута с проверок и отмена его обработки. Аренду маршрута отдаем после завершения обработки"""
+        for tracking_id in self._mapping_route_to_trackings.pop(route_key, {}):
+            self._forget_tracking(tracking_id=tracking_id)
+        self._pending_first_checks.discard(route_key)
+        self._seed_route_keys.discard(route_key)
+        self._route_scheduler.remove(route_key)
+        self._availability_delta.remove_route(route_key)
+        self._rzd_parser.forget_route(route_key)
+        in_flight_task = self._in_flight_route_tasks.get(route_key)
+        if in_flight_task is not None:
+            in_flight_task.cancel()
+        else:
+            await self._release_route(route_key)
+
+    async def _refresh_trackings(self):
+        """Синхронизация активных отслеживаний с реестром"""
+        trackings = self._active_trackings_registry.get_all()
+
+        # Группируем активные отслеживания по маршрутам
+        actual_mapping: dict[RouteKey, dict[int, TrackingModel]] = dict()
+        foreign_route_keys: set[RouteKey] = set()
         for tracking in trackings:
-            if tracking.is_finished:
+            if not self._is_tracking_checked(tracking):
                 continue
-            if tracking.user.is_banned:
+            route_key = self._get_tracking_route_key(tracking)
+            # Маршрут принадлежит другому воркеру
+            if self._shard_coordinator is not None and not self._shard_coordinator.owns(route_key):
+                foreign_route_keys.add(route_key)
                 continue
-            if datetime.datetime.utcnow() > tracking.user.subscription_expires_at:
-                continue
-            # Если этого трекинга нет в обработке
-            if tracking.id not in mapping_id_to_tracking:
-                logger.info(f'Tracking #{tracking.id} added')
-                queue_tracking_ids.put(tracking.id)  # добавляем в конец очереди
-            # Обновляем/Создаем объект трекинга в маппинге для будущей обработки
-            mapping_id_to_tracking[tracking.id] = tracking
-
-        # Удаляем финишированные трекинги
-        tracking_ids_from_database = set(map(lambda tracking: tracking.id, trackings))
-        deleted_tracking_ids = list(filter(
-            lambda tracking_id: tracking_id not in tracking_ids_from_database,
-            mapping_id_to_tracking
-        ))
-        for deleted_tracking_id in deleted_tracking_ids:
-            del mapping_id_to_tracking[deleted_tracking_id]
-
-        # Проходимся по очереди отслеживаний
-        i = 0
-        while i < len(trackings):
-            if self._current_parallel_handlers < self._limit_of_parallel_handlers and not queue_tracking_ids.empty():
-                asyncio.create_task(self._handle_tracking_with_exception_handling(
-                    queue_tracking_ids=queue_tracking_ids,
-                    mapping_id_to_tracking=mapping_id_to_tracking
-                ))
-                i += 1
-            await asyncio.sleep(0.01)
+            actual_mapping.setdefault(route_key, dict())[tracking.id] = tracking
+
+        # Обновляем текущие маршруты + добавляем новые
+        for route_key, route_trackings in actual_mapping.items():
+            if route_key not in self._mapping_route_to_trackings:
+                self._add_route(route_key)
+            for tracking_id in route_trackings.keys() - self._mapping_route_to_trackings[route_key].keys():
+                logger.info(f'Tracking #{tracking_id} added')
+            for tracking_id in self._mapping_route_to_trackings[route_key].keys() - route_trackings.keys():
+                self._forget_tracking(tracking_id=tracking_id)
+            self._mapping_route_to_trackings[route_key] = route_trackings
+            # Новые маршруты проверяем сразу, уже запланированные остаются на своем времени
+            if route_key not in self._route_scheduler:
+                await self._put_route(route_key, delay=0)
+
+        # Удаляем маршруты, на которых не осталось активных отслеживаний (или перешедшие к другому воркеру)
+        for deleted_route_key in [
+            route_key for route_key in self._mapping_route_to_trackings if route_key not in actual_mapping
+        ]:
+            await self._remove_route(deleted_route_key)
+
+        self._foreign_route_keys = foreign_route_keys
+        self._trackings_refreshed = True
+
+    async def _apply_tracking(
+            self,
+            tracking_id: int,
+            previous_tracking: Optional[TrackingModel],
+            tracking: Optional[TrackingModel]
+    ) -> None:
+        """
+        Перенос одного измененного отслеживания между маршрутами без полной синхронизации с реестром.
+        Что здесь не учтено (например, отслеживание успело измениться ещё раз), исправит следующая синхронизация
+        """
+        previous_route_key = None
+        if previous_tracking is not None:
+            previous_route_key = self._get_tracking_route_key(previous_tracking)
+            self._mapping_route_to_trackings.get(previous_route_key, {}).pop(tracking_id, None)
+
+        if tracking is not None and self._is_tracking_checked(tracking):
+            route_key = self._get_tracking_route_key(tracking)
+            if self._shard_coordinator is None or self._shard_coordinator.owns(route_key):
+                if route_key not in self._mapping_route_to_trackings:
+                    self._add_route(route_key)
+                self._mapping_route_to_trackings[route_key][tracking_id] = tracking
+                if route_key not in self._route_scheduler:
+                    await self._put_route(route_key, delay=0)
+            else:
+                self._forget_tracking(tracking_id=tracking_id)
+        else:
+            self._forget_tracking(tracking_id=tracking_id)
+
+        if previous_route_key is not None and self._mapping_route_to_trackings.get(previous_route_key) == {}:
+            await self._remove_route(previous_route_key)
+
+    async def handle_tracking_event(self, event: TrackingEventSchema):
+        """Применение события об изменении отслеживания сразу, не дожидаясь следующего обновления"""
+        previous_tracking = self._active_trackings_registry.get(event.tracking_id)
+        tracking = await self._active_trackings_registry.apply_tracking_event(event)
+        # Измененное отслеживание (другие типы мест, цена) оцениваем заново, как новое
+        self._availability_delta.remove_tracking(tracking_id=event.tracking_id)
+        await self._apply_tracking(tracking_id=event.tracking_id, previous_tracking=previous_tracking, tracking=tracking)
+
+        # Новое отслеживание проверяем первым в очереди
+        if tracking is not None and event.event == 'created':
+            logger.info(f'Tracking #{tracking.id} created, checking it first')
+            await self._put_route(route_key=self._get_tracking_route_key(tracking), first=True)
 
     async def start(self):
         logger.info('Background TrackingParser started')
-        queue_tracking_ids: Queue = Queue()  # Очередь, которая используется для обработки отслеживаний
-        mapping_id_to_tracking: dict[int, TrackingModel] = dict()  # {12: TrackingModel()}
+        await self._active_trackings_registry.wait_until_loaded()
+        if self._shard_coordinator is not None:
+            await self._shard_coordinator.wait_until_ready()
+        try:
+            await self._load_last_notifications_at()
+        except Exception:
+            # Не загруженные даты подтянутся по одной при первой проверке отслеживаний
+            logger.error(f'Не удалось загрузить даты последних нотификаций: \n{traceback.format_exc()}')
+        self._background_tasks = [
+            asyncio.create_task(self._worker()) for _ in range(self._limit_of_parallel_handlers)
+        ]
+        self._background_tasks.append(asyncio.create_task(self._notifications_writer.start()))
 
-        while True:
-            #  logger.debug('Завершен круг очереди отслеживаний')
+        try:
+            while True:
+                started_at = time.monotonic()
+                try:
+                    await self._refresh_trackings()
+                    metrics.CYCLE_DURATION.labels(cycle='refresh_trackings').observe(time.monotonic() - started_at)
+                except Exception:
+                    logger.error(f'Global error in cycle of TrackingParser: \n'
+                                 f'{traceback.format_exc()}')
+                await asyncio.sleep(self._trackings_refresh_interval)
+        finally:
+            await self.stop()
 
-            try:
-                await self.one_cycle(
-                    queue_tracking_ids=queue_tracking_ids,
-                    mapping_id_to_tracking=mapping_id_to_tracking
-                )
-            except Exception:
-                logger.error(f'Global error in cycle of TrackingParser: \n'
-                             f'{traceback.format_exc()}')
+    async def stop(self):
+        """Остановка обработчиков и отмена незавершенной обработки маршрутов"""
+        for task in self._background_tasks:
+            task.cancel()
+        await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        self._background_tasks = []
+        await self._notification_aggregator.stop()
+        # Отправленные нотификации должны попасть в БД и при остановке
+        await self._notifications_writer.stop()
+        logger.info('Background TrackingParser stopped')
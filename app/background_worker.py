@@ -1,15 +1,38 @@
 import asyncio
+import multiprocessing
+import signal
 import sys
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from json import JSONDecodeError
+from typing import Optional
 
 from background.subscription_expiring_notifier import SubscriptionExpiringNotifier
+import aiohttp
+from aiogram import Bot
 from loguru import logger
+from redis.asyncio import Redis
 
 import models.users  # noqa
 from logger_handlers.telegram_handler import TelegramBotHandler
+from background.active_trackings_registry import ActiveTrackingsRegistry
+from background.metrics_server import MetricsServer
+from background.shard_coordinator import ShardCoordinator
 from background.tracking_closer import TrackingCloser
 from background.tracking_parser.tracking_parser import TrackingParser
 
 from config import Config
+from utils.availability_history import AvailabilityHistoryStore
+from utils import metrics
+from utils.circuit_breaker import CircuitBreaker
+from utils.concurrency_controller import AIMDConcurrencyController
+from utils.rzd_exceptions import RZDUnavailableException
+from utils.route_quarantine import RouteQuarantine
+from utils.tracing import LogTraceExporter, RingBufferTraceExporter, Tracer
+from utils.rzd_parser import RZDParser
+from utils.rzd_response_corpus import RZDResponseCorpus
+from utils.telegram_sender import TelegramSender
+from utils.trains_cache import TrainsCache
+from utils.tracking_events import PostgresTrackingEventsChannel
 
 async def main():
     loop = asyncio.get_event_loop()
@@ -28,16 +51,181 @@ async def main():
     logger.add(logger_tg_handler.notify, level='ERROR')
 
     config = Config()
-    tracking_parser = TrackingParser(aiogram_bot_token=config.tg_bot.token, limit_of_parallel_handlers=5)
-    tracking_closer = TrackingCloser(aiogram_bot_token=config.tg_bot.token, tg_bot_username=config.tg_bot.username)
-    subscription_handler = SubscriptionExpiringNotifier(aiogram_bot_token=config.tg_bot.token)
+    trains_cache_redis = None
+    if config.rzd.trains_cache_redis_db is not None:
+        trains_cache_redis = Redis(
+            host=config.redis.host,
+            port=config.redis.port,
+            db=config.rzd.trains_cache_redis_db,
+            password=config.redis.password
+        )
+    parse_executor: Optional[Executor] = None
+    if config.rzd.parse_executor == 'process':
+        # spawn: форк процесса с работающим event loop и потоками aiohttp небезопасен
+        parse_executor = ProcessPoolExecutor(
+            max_workers=config.rzd.parse_executor_workers,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    elif config.rzd.parse_executor == 'thread':
+        parse_executor = ThreadPoolExecutor(max_workers=config.rzd.parse_executor_workers)
+    response_corpus: Optional[RZDResponseCorpus] = None
+    if config.rzd.corpus_mode is not None:
+        response_corpus = RZDResponseCorpus(
+            path=config.rzd.corpus_path,
+            record_interval=config.rzd.corpus_record_interval
+        )
+    rzd_parser = RZDParser(
+        base_url=config.rzd.base_url,
+        record_corpus=response_corpus if config.rzd.corpus_mode == 'record' else None,
+        replay_corpus=response_corpus if config.rzd.corpus_mode == 'replay' else None,
+        trains_cache=TrainsCache(
+            ttl=config.rzd.trains_cache_ttl,
+            max_size=config.rzd.trains_cache_size,
+            redis=trains_cache_redis
+        ),
+        concurrency_controller=AIMDConcurrencyController(
+            min_limit=config.rzd.concurrency_min_limit,
+            max_limit=config.rzd.concurrency_max_limit,
+            initial_limit=config.rzd.concurrency_initial_limit,
+            latency_threshold=config.rzd.concurrency_latency_threshold,
+            congestion_exceptions=(asyncio.TimeoutError, RZDUnavailableException, JSONDecodeError)
+        ),
+        request_timeout=config.rzd.request_timeout,
+        connect_timeout=config.rzd.connect_timeout,
+        connections_limit=config.rzd.connections_limit,
+        connections_limit_per_host=config.rzd.connections_limit_per_host,
+        dns_cache_ttl=config.rzd.dns_cache_ttl,
+        keepalive_timeout=config.rzd.keepalive_timeout,
+        parse_executor=parse_executor,
+        parse_offload_threshold=config.rzd.parse_offload_threshold,
+        circuit_breaker=CircuitBreaker(
+            failure_threshold=config.rzd.circuit_breaker_failure_threshold,
+            recovery_timeout=config.rzd.circuit_breaker_recovery_timeout,
+            max_recovery_timeout=config.rzd.circuit_breaker_max_recovery_timeout,
+            failure_exceptions=(
+                asyncio.TimeoutError, aiohttp.ClientConnectionError, RZDUnavailableException, JSONDecodeError
+            )
+        ),
+        route_quarantine=RouteQuarantine(
+            failure_threshold=config.rzd.route_quarantine_threshold,
+            backoff=config.rzd.route_quarantine_backoff,
+            max_backoff=config.rzd.route_quarantine_max_backoff
+        )
+    )
+    availability_history = None
+    if config.worker.availability_history_dir is not None:
+        availability_history = AvailabilityHistoryStore(
+            directory=config.worker.availability_history_dir,
+            retention_days=config.worker.availability_history_retention_days
+        )
+    active_trackings_registry = ActiveTrackingsRegistry(
+        refresh_interval=config.worker.registry_refresh_interval,
+        full_reload_interval=config.worker.registry_full_reload_interval
+    )
+    telegram_sender = TelegramSender(
+        bot=Bot(token=config.tg_bot.token),
+        global_rate=config.worker.telegram_global_rate,
+        chat_rate=config.worker.telegram_chat_rate,
+        chat_burst=config.worker.telegram_chat_burst,
+        # Воспроизведение записанных ответов РЖД не должно слать пользователям уведомления о местах
+        dry_run=config.rzd.corpus_mode == 'replay'
+    )
+    shard_coordinator = None
+    if config.sharding.enabled:
+        shard_coordinator = ShardCoordinator(
+            redis=Redis(
+                host=config.redis.host,
+                port=config.redis.port,
+                db=config.sharding.redis_db,
+                password=config.redis.password
+            ),
+            lease_ttl=config.sharding.lease_ttl,
+            heartbeat_interval=config.sharding.heartbeat_interval,
+            member_ttl=config.sharding.member_ttl,
+            # Лимит Telegram общий на бота, а очередь отправки у каждого воркера своя
+            on_members_changed=lambda members: telegram_sender.set_global_rate(
+                config.worker.telegram_global_rate / max(len(members), 1)
+            )
+        )
+    trace_buffer = RingBufferTraceExporter(capacity=config.worker.tracing_buffer_size)
+    tracer = Tracer(
+        sample_rate=config.worker.tracing_sample_rate,
+        exporters=(trace_buffer, LogTraceExporter()) if config.worker.tracing_log else (trace_buffer,)
+    )
+    tracking_parser = TrackingParser(
+        telegram_sender=telegram_sender,
+        rzd_parser=rzd_parser,
+        active_trackings_registry=active_trackings_registry,
+        shard_coordinator=shard_coordinator,
+        # Реальное количество одновременных запросов к РЖД регулирует AIMDConcurrencyController
+        limit_of_parallel_handlers=config.rzd.concurrency_max_limit,
+        trackings_refresh_interval=config.worker.trackings_refresh_interval,
+        poll_interval_tiers=config.worker.poll_interval_tiers,
+        default_poll_interval=config.worker.default_poll_interval,
+        availability_history=availability_history,
+        notification_aggregation_window=config.worker.notification_aggregation_window,
+        notifications_flush_interval=config.worker.notifications_flush_interval,
+        notifications_flush_size=config.worker.notifications_flush_size,
+        tracer=tracer
+    )
+    tracking_closer = TrackingCloser(
+        telegram_sender=telegram_sender,
+        tg_bot_username=config.tg_bot.username,
+        active_trackings_registry=active_trackings_registry,
+        shard_coordinator=shard_coordinator
+    )
+    subscription_handler = SubscriptionExpiringNotifier(
+        telegram_sender=telegram_sender,
+        shard_coordinator=shard_coordinator
+    )
+
+    tracking_events_channel = PostgresTrackingEventsChannel(
+        user=config.database.user,
+        password=config.database.password,
+        host=config.database.host,
+        port=config.database.port,
+        database=config.database.name
+    )
 
+    metrics_server = None
+    if config.worker.metrics_port is not None:
+        metrics_server = MetricsServer(
+            registry=metrics.REGISTRY,
+            host=config.worker.metrics_host,
+            port=config.worker.metrics_port,
+            traces=trace_buffer
+        )
+        await metrics_server.start()
+
+    if shard_coordinator is not None:
+        loop.create_task(shard_coordinator.start())
+    loop.create_task(telegram_sender.start())
+    loop.create_task(active_trackings_registry.start())
+    loop.create_task(tracking_events_channel.listen(tracking_parser.handle_tracking_event))
     loop.create_task(tracking_closer.start())
-    loop.create_task(tracking_parser.start())
+    tracking_parser_task = loop.create_task(tracking_parser.start())
     loop.create_task(subscription_handler.start())
 
-    while True:
-        await asyncio.sleep(1)
+    # docker stop присылает SIGTERM: завершаемся так же, как по Ctrl+C, чтобы дописать буферы
+    loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+
+    try:
+        while True:
+            await asyncio.sleep(1)
+    finally:
+        # Остановка TrackingParser дописывает в БД накопленные нотификации
+        tracking_parser_task.cancel()
+        await asyncio.gather(tracking_parser_task, return_exceptions=True)
+        if metrics_server is not None:
+            await metrics_server.stop()
+        await rzd_parser.close()
+        await telegram_sender.bot.session.close()
+        if availability_history is not None:
+            availability_history.close()
+        if parse_executor is not None:
+            parse_executor.shutdown(wait=False, cancel_futures=True)
+        if trains_cache_redis is not None:
+            await trains_cache_redis.aclose()
 
 
 if __name__ == '__main__':
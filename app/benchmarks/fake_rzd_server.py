@@ -0,0 +1,205 @@
+"""
+Локальный имитатор API РЖД для бенчмарков: TrainPricing и suggests
+с настраиваемыми задержкой, размером ответа и долей ошибок.
+С --corpus TrainPricing отдает записанные ответы РЖД (см. RZDResponseCorpus), для остальных маршрутов - сгенерированные.
+
+Запуск отдельно (из папки app): python -m benchmarks.fake_rzd_server --port 8081 --latency 0.2
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import random
+from dataclasses import dataclass
+from typing import Optional
+
+from aiohttp import web
+
+from utils.route_key import get_route_key
+from utils.rzd_exceptions import RZDResponseNotRecordedException
+from utils.rzd_response_corpus import RZDResponseCorpus
+
+_CAR_TYPES = ('ПЛАЦ', 'КУПЕ', 'СВ', 'СИД')
+
+
+@dataclass
+class FakeRZDSettings:
+    # Задержка ответа: среднее и разброс (секунды)
+    latency: float = 0.1
+    latency_jitter: float = 0.05
+    # Размер ответа: поездов на маршрут и групп вагонов в поезде
+    trains_per_route: int = 10
+    car_groups_per_train: int = 8
+    # Вероятность, что в группе вагонов есть места
+    seats_probability: float = 0.3
+    # Доли ответов 503 и ответов без списка поездов
+    error_rate: float = 0.0
+    invalid_rate: float = 0.0
+    # Папка корпуса записанных ответов РЖД
+    corpus_path: Optional[str] = None
+
+
+def _generate_car_group(rnd: random.Random, seats_probability: float) -> dict:
+    has_seats = rnd.random() < seats_probability
+    places = (lambda: rnd.randint(1, 20) if has_seats else 0)
+    return {
+        'CarTypeName': rnd.choice(_CAR_TYPES),
+        'HasPlacesForDisabledPersons': rnd.random() < 0.05,
+        'LowerPlaceQuantity': places(),
+        'UpperPlaceQuantity': places(),
+        'LowerSidePlaceQuantity': places(),
+        'UpperSidePlaceQuantity': places(),
+        'TotalPlaceQuantity': places(),
+        'PlaceQuantity': places(),
+        'MinPrice': rnd.randint(1000, 15000),
+        # Поля реального ответа, которые парсер не использует, - для реалистичного размера
+        'CarType': 'Compartment',
+        'ServiceClasses': ['2Э', '2К'],
+        'Carriers': ['ФПК'],
+        'AvailabilityIndication': 'Available',
+    }
+
+
+def generate_trains_response(
+        origin: str,
+        destination: str,
+        date: datetime.date,
+        settings: FakeRZDSettings,
+        rnd: random.Random
+) -> dict:
+    trains = []
+    for i in range(settings.trains_per_route):
+        departure = datetime.datetime.combine(date, datetime.time()) + datetime.timedelta(
+            minutes=i * 24 * 60 // max(settings.trains_per_route, 1)
+        )
+        trains.append({
+            'DisplayTrainNumber': f'{100 + i:03d}А',
+            'DepartureDateTime': departure.isoformat(),
+            'ArrivalDateTime': (departure + datetime.timedelta(hours=rnd.randint(4, 30))).isoformat(),
+            'OriginStationCode': origin,
+            'OriginName': f'Станция {origin}',
+            'DestinationStationCode': destination,
+            'DestinationName': f'Станция {destination}',
+            'CarGroups': [
+                _generate_car_group(rnd, settings.seats_probability) for _ in range(settings.car_groups_per_train)
+            ],
+        })
+    return {'Trains': trains, 'OriginCode': origin, 'DestinationCode': destination}
+
+
+class FakeRZDServer:
+    def __init__(self, settings: FakeRZDSettings, host: str = '127.0.0.1', port: int = 8081, seed: int = 0):
+        self._settings = settings
+        self._host = host
+        self._port = port
+        self._random = random.Random(seed)
+        self._runner: Optional[web.AppRunner] = None
+        self._corpus: Optional[RZDResponseCorpus] = None
+        if settings.corpus_path is not None:
+            self._corpus = RZDResponseCorpus(path=settings.corpus_path)
+
+    @property
+    def base_url(self) -> str:
+        return f'http://{self._host}:{self._port}'
+
+    async def _sleep_latency(self) -> None:
+        latency = self._settings.latency + self._random.uniform(
+            -self._settings.latency_jitter, self._settings.latency_jitter
+        )
+        await asyncio.sleep(max(latency, 0))
+
+    async def _handle_train_pricing(self, request: web.Request) -> web.Response:
+        request_data = await request.json()
+        await self._sleep_latency()
+        if self._random.random() < self._settings.error_rate:
+            return web.Response(status=503, text='Service Unavailable')
+        if self._random.random() < self._settings.invalid_rate:
+            return web.json_response({'Code': 'InternalError', 'Message': 'Не удалось получить данные'})
+        date = datetime.date.fromisoformat(request_data['DepartureDate'][:10])
+        if self._corpus is not None:
+            try:
+                recorded_response = await self._corpus.get_response(get_route_key(
+                    from_city_id=request_data['Origin'], to_city_id=request_data['Destination'], date=date
+                ))
+            except RZDResponseNotRecordedException:
+                pass
+            else:
+                return web.Response(
+                    status=recorded_response.status, body=recorded_response.body, content_type='application/json'
+                )
+        return web.json_response(generate_trains_response(
+            origin=request_data['Origin'],
+            destination=request_data['Destination'],
+            date=date,
+            settings=self._settings,
+            rnd=self._random
+        ), dumps=lambda data: json.dumps(data, ensure_ascii=False))
+
+    async def _handle_suggests(self, request: web.Request) -> web.Response:
+        await self._sleep_latency()
+        query = request.query.get('Query', '')
+        return web.json_response({'city': [
+            {'name': f'{query} {i}', 'region': 'Регион', 'expressCode': str(2000000 + i), 'busCode': str(i)}
+            for i in range(5)
+        ]}, dumps=lambda data: json.dumps(data, ensure_ascii=False))
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post('/apib2b/p/Railway/V1/Search/TrainPricing', self._handle_train_pricing)
+        app.router.add_get('/api/v1/suggests', self._handle_suggests)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host=self._host, port=self._port).start()
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def serve(settings: FakeRZDSettings, host: str, port: int) -> None:
+    server = FakeRZDServer(settings=settings, host=host, port=port)
+    await server.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def run_server(settings: FakeRZDSettings, host: str, port: int) -> None:
+    """Точка входа процесса с имитатором (бенчмарк запускает его отдельно, чтобы не делить с ним CPU)"""
+    asyncio.run(serve(settings=settings, host=host, port=port))
+
+
+def add_settings_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = FakeRZDSettings()
+    parser.add_argument('--latency', type=float, default=defaults.latency)
+    parser.add_argument('--latency-jitter', type=float, default=defaults.latency_jitter)
+    parser.add_argument('--trains-per-route', type=int, default=defaults.trains_per_route)
+    parser.add_argument('--car-groups-per-train', type=int, default=defaults.car_groups_per_train)
+    parser.add_argument('--seats-probability', type=float, default=defaults.seats_probability)
+    parser.add_argument('--error-rate', type=float, default=defaults.error_rate)
+    parser.add_argument('--invalid-rate', type=float, default=defaults.invalid_rate)
+    parser.add_argument('--corpus', default=defaults.corpus_path, help='папка корпуса записанных ответов РЖД')
+
+
+def settings_from_arguments(args: argparse.Namespace) -> FakeRZDSettings:
+    return FakeRZDSettings(
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        trains_per_route=args.trains_per_route,
+        car_groups_per_train=args.car_groups_per_train,
+        seats_probability=args.seats_probability,
+        error_rate=args.error_rate,
+        invalid_rate=args.invalid_rate,
+        corpus_path=args.corpus
+    )
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Имитатор API РЖД')
+    arg_parser.add_argument('--host', default='127.0.0.1')
+    arg_parser.add_argument('--port', type=int, default=8081)
+    add_settings_arguments(arg_parser)
+    arguments = arg_parser.parse_args()
+    run_server(settings=settings_from_arguments(arguments), host=arguments.host, port=arguments.port)
@@ -0,0 +1,348 @@
+"""
+Бенчмарк TrackingParser на синтетических отслеживаниях против локального имитатора РЖД.
+
+Имитатор РЖД запускается отдельным процессом. TrackingParser работает как в воркере (RZDParser с AIMD-лимитом,
+планировщик маршрутов, фильтрация, уведомления), но без БД и Telegram: отслеживания берутся из памяти,
+уведомления и их запись в БД только считаются.
+
+Печатает проверенные отслеживания в секунду, p50/p99 времени проверки маршрута и отслеживания, CPU на проверку.
+Окно объединения уведомлений по умолчанию - как в воркере (WORKER__NOTIFICATION_AGGREGATION_WINDOW).
+
+С --corpus имитатор отдает записанные ответы РЖД, а отслеживания создаются на записанных маршрутах и датах
+(--routes - сколько из них взять) - прогон на реальных ответах повторяется один в один.
+
+Запуск (из папки app, с переменными окружения воркера - к БД бенчмарк не подключается):
+python -m benchmarks.tracking_parser_benchmark --trackings 5000 --routes 1500 --duration 60
+"""
+import argparse
+import asyncio
+import datetime
+import multiprocessing
+import random
+import resource
+import statistics
+import sys
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Optional
+
+import aiohttp
+from loguru import logger
+
+import models.users  # noqa
+from background.active_trackings_registry import ActiveTrackingsRegistry
+from background.tracking_parser.notifications_writer import NotificationsWriter
+from background.tracking_parser.tracking_parser import TrackingParser
+from benchmarks.fake_rzd_server import add_settings_arguments, run_server, settings_from_arguments
+from config import Config
+from models.trackings import TrackingModel
+from models.users import UserModel
+from utils.concurrency_controller import AIMDConcurrencyController
+from utils.route_key import RouteKey
+from utils.rzd_parser import RZDParser, parse_trains_response
+from utils.rzd_response_corpus import RZDResponseCorpus
+
+
+class SyntheticTrackingsRegistry(ActiveTrackingsRegistry):
+    """Реестр с отслеживаниями из памяти вместо БД"""
+
+    def __init__(self, trackings: list[TrackingModel]):
+        super().__init__()
+        self._synthetic_trackings = trackings
+
+    async def load(self) -> None:
+        self._trackings = {tracking.id: tracking for tracking in self._synthetic_trackings}
+        self._loaded.set()
+
+
+class CountingNotificationsWriter(NotificationsWriter):
+    """Вместо записи в БД только считает нотификации"""
+
+    def __init__(self):
+        super().__init__()
+        self.written = 0
+
+    async def flush(self) -> None:
+        self.written += len(self._notifications)
+        self._notifications = []
+
+
+class CountingTelegramSender:
+    """Вместо отправки в Telegram только считает сообщения"""
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send_message(self, chat_id: int, text: str, **kwargs) -> SimpleNamespace:
+        self.sent += 1
+        return SimpleNamespace(message_id=self.sent)
+
+
+class BenchmarkTrackingParser(TrackingParser):
+    """TrackingParser без БД, замеряющий каждую проверку маршрута"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._notifications_writer = CountingNotificationsWriter()
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        self.check_durations: list[float] = []
+        # Время проверки маршрута, деленное на количество его отслеживаний
+        self.tracking_check_durations: list[float] = []
+        self.checked_trackings = 0
+        self.failed_checks = 0
+
+    @property
+    def notifications_written(self) -> int:
+        return self._notifications_writer.written
+
+    async def _load_last_notifications_at(self) -> None:
+        # Нотификаций ещё не было - в БД за ними не идем
+        self._last_notifications_at = {tracking.id: None for tracking in self._active_trackings_registry.get_all()}
+
+    @staticmethod
+    async def _save_first_notification_dates(first_notification_dates: dict[int, datetime.datetime]) -> None:
+        # Даты первых нотификаций остаются только у отслеживаний в памяти
+        pass
+
+    async def _handle_route(self, route_key: RouteKey):
+        trackings_count = len(self._mapping_route_to_trackings.get(route_key, {}))
+        started_at = time.perf_counter()
+        try:
+            await super()._handle_route(route_key=route_key)
+        except Exception:
+            self.failed_checks += 1
+            raise
+        check_duration = time.perf_counter() - started_at
+        self.check_durations.append(check_duration)
+        if trackings_count:
+            self.tracking_check_durations.append(check_duration / trackings_count)
+        self.checked_trackings += trackings_count
+
+
+def generate_trackings(
+        trackings_count: int,
+        routes_count: int,
+        users_count: int,
+        seed: int,
+        routes: Optional[list[RouteKey]] = None
+) -> list[TrackingModel]:
+    """
+    :param routes: маршруты отслеживаний (например, записанные в корпусе). None - сгенерировать routes_count маршрутов
+    """
+    rnd = random.Random(seed)
+    today = datetime.date.today()
+    users = [
+        UserModel(
+            id=1_000_000 + i,
+            first_name=f'user{i}',
+            is_banned=False,
+            subscription_expires_at=datetime.datetime.utcnow() + datetime.timedelta(days=30)
+        )
+        for i in range(users_count)
+    ]
+    if routes is None:
+        routes = [
+            (str(2000000 + rnd.randint(0, 999)), str(2001000 + rnd.randint(0, 999)), today + datetime.timedelta(days=rnd.randint(0, 60)))
+            for _ in range(routes_count)
+        ]
+    routes_count = len(routes)
+
+    trackings = []
+    for i in range(trackings_count):
+        from_city_id, to_city_id, date = routes[i % routes_count] if i < routes_count else rnd.choice(routes)
+        user = rnd.choice(users)
+        trackings.append(TrackingModel(
+            id=i + 1,
+            user_id=user.id,
+            user=user,
+            from_city_name=f'Станция {from_city_id}',
+            from_city_id=from_city_id,
+            from_city_site_code=from_city_id,
+            to_city_name=f'Станция {to_city_id}',
+            to_city_id=to_city_id,
+            to_city_site_code=to_city_id,
+            date=date,
+            max_price=rnd.choice([None, 3000, 5000, 10000]),
+            sw_enabled=rnd.random() < 0.5,
+            sid_enabled=rnd.random() < 0.5,
+            plaz_seats_plaz_down_enabled=rnd.random() < 0.7,
+            plaz_seats_plaz_up_enabled=rnd.random() < 0.7,
+            plaz_side_down_enabled=rnd.random() < 0.5,
+            plaz_side_up_enabled=rnd.random() < 0.5,
+            cupe_up_enabled=rnd.random() < 0.7,
+            cupe_down_enabled=rnd.random() < 0.7,
+            first_notification_sent_at=None,
+            is_finished=False,
+            created_at=datetime.datetime.utcnow(),
+            updated_at=datetime.datetime.utcnow()
+        ))
+    return trackings
+
+
+async def wait_for_server(base_url: str, timeout: float = 15) -> None:
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                async with session.get(f'{base_url}/api/v1/suggests', params={'Query': 'ping'}) as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                if time.monotonic() > deadline:
+                    raise
+            await asyncio.sleep(0.1)
+
+
+def _get_percentile(values: list[float], percentile: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0
+    return statistics.quantiles(values, n=100)[percentile - 1]
+
+
+async def run_benchmark(args: argparse.Namespace) -> None:
+    base_url = f'http://127.0.0.1:{args.port}'
+    server_process = multiprocessing.get_context('spawn').Process(
+        target=run_server,
+        kwargs=dict(settings=settings_from_arguments(args), host='127.0.0.1', port=args.port),
+        daemon=True
+    )
+    server_process.start()
+
+    parse_executor: Optional[Executor] = None
+    if args.parse_executor == 'process':
+        parse_executor = ProcessPoolExecutor(
+            max_workers=args.parse_executor_workers,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    elif args.parse_executor == 'thread':
+        parse_executor = ThreadPoolExecutor(max_workers=args.parse_executor_workers)
+
+    rzd_parser = RZDParser(
+        base_url=base_url,
+        concurrency_controller=AIMDConcurrencyController(
+            max_limit=args.concurrency,
+            initial_limit=args.concurrency
+        ),
+        connections_limit_per_host=args.concurrency,
+        parse_executor=parse_executor
+    )
+    routes: Optional[list[RouteKey]] = None
+    if args.corpus is not None:
+        routes = RZDResponseCorpus(path=args.corpus).get_routes()[:args.routes]
+        if not routes:
+            raise SystemExit(f'В корпусе {args.corpus} нет записанных ответов')
+    trackings = generate_trackings(
+        trackings_count=args.trackings, routes_count=args.routes, users_count=args.users, seed=args.seed, routes=routes
+    )
+    registry = SyntheticTrackingsRegistry(trackings=trackings)
+    telegram_sender = CountingTelegramSender()
+    tracking_parser = BenchmarkTrackingParser(
+        telegram_sender=telegram_sender,
+        rzd_parser=rzd_parser,
+        active_trackings_registry=registry,
+        limit_of_parallel_handlers=args.concurrency,
+        poll_interval_tiers=[],
+        default_poll_interval=args.poll_interval,
+        notification_aggregation_window=args.aggregation_window
+    )
+
+    parser_task = None
+    try:
+        await wait_for_server(base_url)
+        if parse_executor is not None:
+            # Процессы пула стартуют долго: медленные первые разборы уменьшили бы AIMD-лимит до минимума
+            await asyncio.gather(*(
+                asyncio.get_running_loop().run_in_executor(parse_executor, parse_trains_response, b'{"Trains": []}')
+                for _ in range(args.parse_executor_workers)
+            ))
+        await registry.load()
+        parser_task = asyncio.create_task(tracking_parser.start())
+
+        await asyncio.sleep(args.warmup)
+        tracking_parser.reset_stats()
+        sent_at_start = telegram_sender.sent
+        written_at_start = tracking_parser.notifications_written
+        cpu_at_start = time.process_time()
+        started_at = time.perf_counter()
+
+        await asyncio.sleep(args.duration)
+
+        elapsed = time.perf_counter() - started_at
+        cpu_time = time.process_time() - cpu_at_start
+        check_durations = list(tracking_parser.check_durations)
+        tracking_check_durations = list(tracking_parser.tracking_check_durations)
+        checked_trackings = tracking_parser.checked_trackings
+        failed_checks = tracking_parser.failed_checks
+        sent = telegram_sender.sent - sent_at_start
+        written = tracking_parser.notifications_written - written_at_start
+    finally:
+        if parser_task is not None:
+            parser_task.cancel()
+            await asyncio.gather(parser_task, return_exceptions=True)
+        await rzd_parser.close()
+        if parse_executor is not None:
+            parse_executor.shutdown(wait=True)
+        # CPU процессов пула известен только после их завершения, имитатор РЖД ещё работает и не учитывается
+        children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        children_cpu_time = children_usage.ru_utime + children_usage.ru_stime
+        server_process.terminate()
+        server_process.join()
+
+    route_checks = len(check_durations)
+    print(
+        f'\nTrackingParser benchmark: {args.trackings} trackings, {len(routes) if routes else args.routes} routes, '
+        f'latency {args.latency * 1000:.0f}ms, '
+        + (f'corpus {args.corpus}, ' if args.corpus is not None else
+           f'{args.trains_per_route} trains x {args.car_groups_per_train} car groups, ')
+        + f'concurrency {args.concurrency}, parse executor {args.parse_executor}, '
+        f'aggregation window {args.aggregation_window:g}s\n'
+        f'  duration:                {elapsed:.1f}s (after {args.warmup:.0f}s warmup)\n'
+        f'  route checks:            {route_checks} ({route_checks / elapsed:.1f}/s), failed: {failed_checks}\n'
+        f'  trackings checked:       {checked_trackings} ({checked_trackings / elapsed:.1f}/s)\n'
+        f'  time per route check:    p50 {_get_percentile(check_durations, 50) * 1000:.1f}ms, '
+        f'p99 {_get_percentile(check_durations, 99) * 1000:.1f}ms\n'
+        f'  time per tracking check: p50 {_get_percentile(tracking_check_durations, 50) * 1000:.2f}ms, '
+        f'p99 {_get_percentile(tracking_check_durations, 99) * 1000:.2f}ms\n'
+        f'  CPU per route check:     {cpu_time / max(route_checks, 1) * 1000:.2f}ms '
+        f'(event loop process: {cpu_time / elapsed * 100:.0f}% of one core)\n'
+        f'  CPU per tracking check:  {cpu_time / max(checked_trackings, 1) * 1000:.3f}ms\n'
+        + (f'  parse pool CPU:          {children_cpu_time:.1f}s (whole run, including warmup)\n' if args.parse_executor == 'process' else '')
+        + f'  notifications sent:      {sent} messages, {written} trackings'
+    )
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Бенчмарк TrackingParser против локального имитатора РЖД')
+    arg_parser.add_argument('--trackings', type=int, default=5000)
+    arg_parser.add_argument('--routes', type=int, default=1500)
+    arg_parser.add_argument('--users', type=int, default=2000)
+    arg_parser.add_argument('--duration', type=float, default=30, help='длительность замера (секунды)')
+    arg_parser.add_argument('--warmup', type=float, default=5, help='прогрев перед замером (секунды)')
+    arg_parser.add_argument('--concurrency', type=int, default=30, help='параллельных проверок маршрутов')
+    arg_parser.add_argument(
+        '--poll-interval', type=float, default=0,
+        help='интервал опроса маршрута (секунды). 0 - маршруты проверяются без перерыва (предельная пропускная способность)'
+    )
+    arg_parser.add_argument(
+        '--aggregation-window', type=float, default=None,
+        help='окно объединения уведомлений (секунды). По умолчанию - из настроек воркера'
+    )
+    arg_parser.add_argument('--parse-executor', choices=('none', 'thread', 'process'), default='none')
+    arg_parser.add_argument('--parse-executor-workers', type=int, default=2)
+    arg_parser.add_argument('--port', type=int, default=8081, help='порт имитатора РЖД')
+    arg_parser.add_argument('--seed', type=int, default=0)
+    add_settings_arguments(arg_parser)
+    args = arg_parser.parse_args()
+    if args.aggregation_window is None:
+        args.aggregation_window = Config().worker.notification_aggregation_window
+
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+    asyncio.run(run_benchmark(args))
+
+
+if __name__ == '__main__':
+    main()
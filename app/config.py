@@ -1,5 +1,5 @@
 from functools import lru_cache
-from typing import Union
+from typing import Literal, Optional, Union
 
 from pydantic import BaseModel
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -36,6 +36,101 @@ class ServiceNotifications(BaseModel):
     chat_id: Union[int, str]
     project_name: str
 
+class RZD(BaseModel):
+    # Адрес API РЖД
+    base_url: str = 'https://ticket.rzd.ru'
+    # Пул соединений к РЖД (таймауты и время жизни в секундах)
+    request_timeout: float = 5
+    connect_timeout: float = 5
+    connections_limit: int = 100
+    connections_limit_per_host: int = 30
+    dns_cache_ttl: int = 300
+    keepalive_timeout: float = 30
+    # Адаптивный лимит параллельных запросов поездов в воркере (AIMD)
+    concurrency_min_limit: int = 1
+    concurrency_max_limit: int = 30
+    concurrency_initial_limit: int = 5
+    # Время ответа (секунды), начиная с которого лимит уменьшается
+    concurrency_latency_threshold: float = 3
+    # Кэш результатов поиска поездов (секунды свежести и количество маршрутов в памяти)
+    trains_cache_ttl: float = 20
+    trains_cache_size: int = 5000
+    # БД redis, через которую кэш разделяется между ботом и воркером. None - только кэш в памяти процесса.
+    # Не должна совпадать с БД FSM бота (5) и шардирования (см. README)
+    trains_cache_redis_db: Optional[int] = 6
+    # Разбор больших ответов с поездами вне event loop воркера: пул процессов/потоков или None - в event loop
+    parse_executor: Optional[Literal['process', 'thread']] = 'process'
+    parse_executor_workers: int = 2
+    # Размер ответа (байты), начиная с которого разбор уходит в пул
+    parse_offload_threshold: int = 64 * 1024
+    # Circuit breaker: ошибок доступности подряд до приостановки запросов и время до пробного запроса
+    # (секунды, удваивается после каждого неудачного пробного запроса до max)
+    circuit_breaker_failure_threshold: int = 10
+    circuit_breaker_recovery_timeout: float = 15
+    circuit_breaker_max_recovery_timeout: float = 300
+    # Карантин маршрута: неверных ответов подряд до карантина и его длительность (секунды, удваивается до max)
+    route_quarantine_threshold: int = 3
+    route_quarantine_backoff: float = 60
+    route_quarantine_max_backoff: float = 3600
+    # Ответы TrainPricing в воркере: запись в корпус на диске или воспроизведение из него без запросов к РЖД
+    # (None - выключено). При записи ответы одного маршрута сохраняются не чаще record_interval секунд.
+    # При воспроизведении сообщения в Telegram не отправляются, а только логируются
+    corpus_mode: Optional[Literal['record', 'replay']] = None
+    corpus_path: str = 'rzd_corpus'
+    corpus_record_interval: float = 600
+
+class Worker(BaseModel):
+    # Реестр активных отслеживаний: подгрузка изменений и полная перезагрузка (секунды).
+    # Изменения из бота приходят сразу через LISTEN/NOTIFY, подгрузка нужна для остальных изменений
+    registry_refresh_interval: float = 30
+    registry_full_reload_interval: float = 3600
+    # Как часто перечитывать активные отслеживания из БД (секунды)
+    trackings_refresh_interval: float = 10
+    # Уровни частоты опроса маршрута: (часов до ближайшего отправления, интервал опроса в секундах)
+    poll_interval_tiers: list[tuple[float, float]] = [
+        (12, 30),
+        (48, 60),
+        (24 * 7, 180),
+        (24 * 30, 420),
+    ]
+    # Интервал опроса маршрутов с отправлением дальше всех уровней (секунды)
+    default_poll_interval: float = 900
+    # Лимиты исходящих сообщений Telegram: в секунду на бота, в секунду на чат и всплеск в один чат.
+    # При шардировании лимит на бота делится поровну между живыми воркерами
+    telegram_global_rate: float = 25
+    telegram_chat_rate: float = 1
+    telegram_chat_burst: int = 3
+    # Сколько секунд собирать уведомления одному пользователю, чтобы отправить их одним сообщением
+    notification_aggregation_window: float = 2
+    # Папка истории наличия мест по всем опрошенным маршрутам. None - история не записывается
+    availability_history_dir: Optional[str] = None
+    # Сколько дней хранить историю
+    availability_history_retention_days: int = 30
+    # Отправленные нотификации пишутся в БД пачками: раз в столько секунд или при накоплении стольких нотификаций
+    notifications_flush_interval: float = 1
+    notifications_flush_size: int = 200
+    # HTTP-эндпоинт /metrics для Prometheus. None - не запускается.
+    # По умолчанию слушает только localhost: /traces и метрики не предназначены для внешней сети
+    metrics_host: str = '127.0.0.1'
+    metrics_port: Optional[int] = 9100
+    # Трассировка этапов обработки маршрута: доля трассируемых маршрутов (0 - выключено),
+    # вывод трасс в лог и сколько последних трасс держать в памяти (отдаются по /traces рядом с /metrics)
+    tracing_sample_rate: float = 0.01
+    tracing_log: bool = False
+    tracing_buffer_size: int = 1000
+
+class Sharding(BaseModel):
+    # Разделение маршрутов между несколькими воркерами через redis
+    enabled: bool = False
+    # Не должна совпадать с БД FSM бота (5) и кэша поездов (см. README)
+    redis_db: int = 7
+    # Время жизни аренды маршрута, интервал heartbeat и время, после которого воркер считается умершим (секунды).
+    # Аренды продлеваются с heartbeat и не истекают между опросами маршрута; lease_ttl - время, через которое
+    # маршруты умершего воркера освобождаются
+    lease_ttl: float = 120
+    heartbeat_interval: float = 5
+    member_ttl: float = 20
+
 class Config(BaseSettings):
     database: DataBase
     redis: Redis
@@ -43,6 +138,9 @@ class Config(BaseSettings):
     links: Links
     payment: Payment
     service_notifications: ServiceNotifications
+    rzd: RZD = RZD()
+    worker: Worker = Worker()
+    sharding: Sharding = Sharding()
 
     model_config = SettingsConfigDict(
         env_file=('.env', '../.env'),
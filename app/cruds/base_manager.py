@@ -30,6 +30,13 @@ class BaseManager(Generic[ModelType, CreateSchema, UpdateSchema]):
             objs.append(obj)
         return objs
 
+    async def insert_multi(self, objs_in: List[CreateSchema]) -> None:
+        """Один многострочный INSERT на все объекты (созданные объекты не возвращаются)"""
+        if not objs_in:
+            return
+        query = insert(self._model).values([obj_in.model_dump() for obj_in in objs_in])
+        await self._session.execute(query)
+
     async def get(
             self, obj_id: Union[int, str, UUID], relationships: List[relationship] = None
     ) -> Optional[ModelType]:
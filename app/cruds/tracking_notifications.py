@@ -1,10 +1,12 @@
+import datetime
 from typing import Optional
 
 from sqlalchemy.ext.asyncio.session import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, func, not_
 
 from cruds.base_manager import BaseManager
 from models.tracking_notifications import TrackingNotificationModel
+from models.trackings import TrackingModel
 from schemas.tracking_notifications import TrackingNotificationCreateSchema, TrackingNotificationUpdateSchema
 
 
@@ -20,5 +22,21 @@ class TrackingNotificationManager(
     async def get_last_notification_by_tracking_id(self, tracking_id: int) -> Optional[TrackingNotificationModel]:
         query = select(TrackingNotificationModel).where(
             TrackingNotificationModel.tracking_id == tracking_id
-        ).order_by(TrackingNotificationModel.created_at.desc())
+        ).order_by(TrackingNotificationModel.created_at.desc()).limit(1)
         return await self._session.scalar(query)
+
+    async def get_last_notification_dates_of_active_trackings(self) -> dict[int, datetime.datetime]:
+        """{id отслеживания: дата последней нотификации} по всем активным отслеживаниям"""
+        # Дата ищется по индексу отдельно для каждого активного отслеживания: при соединении с группировкой
+        # планировщик может выбрать чтение всех нотификаций, хотя активных отслеживаний - малая доля
+        last_notification_at = select(
+            func.max(TrackingNotificationModel.created_at)
+        ).where(
+            TrackingNotificationModel.tracking_id == TrackingModel.id
+        ).scalar_subquery()
+        query = select(TrackingModel.id, last_notification_at).where(not_(TrackingModel.is_finished))
+        return {
+            tracking_id: created_at
+            for tracking_id, created_at in (await self._session.execute(query)).all()
+            if created_at is not None
+        }
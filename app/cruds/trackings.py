@@ -1,9 +1,12 @@
+import datetime
+
 from sqlalchemy.ext.asyncio.session import AsyncSession
-from sqlalchemy import select, not_, update
+from sqlalchemy import select, not_, update, or_, and_, func, case
 from sqlalchemy.orm import selectinload
 
 from cruds.base_manager import BaseManager
 from models.trackings import TrackingModel
+from models.users import UserModel
 from schemas.trackings import TrackingCreateSchema, TrackingUpdateSchema
 
 
@@ -28,10 +31,34 @@ class TrackingManager(BaseManager[TrackingModel, TrackingCreateSchema, TrackingU
         query = query.order_by(TrackingModel.created_at.desc()).options(selectinload(TrackingModel.user))
         return (await self._session.scalars(query)).all()
 
+    async def get_trackings_changed_since(self, changed_since: datetime.datetime) -> list[TrackingModel]:
+        """
+        Отслеживания, изменившиеся после changed_since (в том числе завершенные),
+        и активные отслеживания пользователей, изменившихся после changed_since
+        """
+        changed_user_ids = select(UserModel.id).where(UserModel.updated_at > changed_since)
+        query = select(TrackingModel).where(or_(
+            TrackingModel.updated_at > changed_since,
+            and_(not_(TrackingModel.is_finished), TrackingModel.user_id.in_(changed_user_ids))
+        )).options(selectinload(TrackingModel.user))
+        return (await self._session.scalars(query)).all()
+
     async def clear_first_notification_date(self, tracking_id: int) -> None:
         query = update(TrackingModel).where(TrackingModel.id == tracking_id).values(first_notification_sent_at=None)
         await self._session.execute(query)
 
+    async def set_first_notification_dates_if_empty(self, sent_at_by_tracking_id: dict[int, datetime.datetime]) -> None:
+        """Проставляет даты первой нотификации отслеживаниям, у которых её ещё нет (одним UPDATE)"""
+        if not sent_at_by_tracking_id:
+            return
+        query = update(TrackingModel).where(TrackingModel.id.in_(sent_at_by_tracking_id)).values(
+            first_notification_sent_at=func.coalesce(
+                TrackingModel.first_notification_sent_at,
+                case(sent_at_by_tracking_id, value=TrackingModel.id)
+            )
+        )
+        await self._session.execute(query)
+
     async def get_user_trackings_with_not_answered_notification(self, user_id: int):
         filters = [
             TrackingModel.user_id == user_id,
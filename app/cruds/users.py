@@ -1,3 +1,6 @@
+import datetime
+
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio.session import AsyncSession
 
 from cruds.base_manager import BaseManager
@@ -11,3 +14,11 @@ class UserManager(BaseManager[UserModel, UserCreateSchema, UserUpdateSchema]):
         super().__init__(
             session=session
         )
+
+    async def get_users_with_subscription_expiring_between(
+            self,
+            since: datetime.datetime,
+            until: datetime.datetime
+    ) -> list[UserModel]:
+        query = select(UserModel).where(UserModel.subscription_expires_at.between(since, until))
+        return (await self._session.scalars(query)).all()
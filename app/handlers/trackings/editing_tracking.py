@@ -13,12 +13,14 @@ from keyboards.start import return_to_start_keyboard
 from keyboards.trackings import start_create_tracking_from_scratch_kb, skip_max_price_kb, edit_tracking_kb, \
     back_to_tracking_kb, edit_max_price_kb, seats_found_kb, edit_seats_types_kb
 from models.users import UserModel
+from schemas.tracking_events import TrackingEventSchema
 from schemas.trackings import TrackingCreateSchema, TrackingUpdateSchema
 from states.editing_tracking import EditingTracking
 from utils.add_messages_in_state_to_delete import add_messages_in_state_to_delete
 from utils.filter_trains import filter_trains_by_tracking
 from utils.rzd_links_generator import create_url_to_trains
 from utils.rzd_parser import RZDParser
+from utils.tracking_events import TrackingEventsChannel
 
 router = Router()
 
@@ -548,7 +550,8 @@ async def save_tracking(
         state: FSMContext,
         config: Config,
         session: AsyncSession,
-        rzd_parser: RZDParser
+        rzd_parser: RZDParser,
+        tracking_events_channel: TrackingEventsChannel
 ):
     tracking_data = (await state.get_data())['tracking_data']
     if tracking_data['date'] is None:
@@ -688,6 +691,7 @@ async def save_tracking(
         ))
         tracking_data['tracking_id'] = tracking.id
         saved_text = '<b>✅ Отслеживание успешно создано</b>'
+        tracking_event = TrackingEventSchema(event='created', tracking_id=tracking.id)
 
     else:
         # проверка на то, что отслеживание принадлежит этому юзеру
@@ -720,7 +724,10 @@ async def save_tracking(
             )
         )
         saved_text = '<b>✅ Отслеживание обновлено</b>'
+        tracking_event = TrackingEventSchema(event='updated', tracking_id=tracking_data['tracking_id'])
 
+    # Воркер получит событие после коммита
+    await tracking_events_channel.publish(session=session, event=tracking_event)
     await session.commit()
     tracking_data['not_saved_flag'] = False
 
@@ -746,7 +753,8 @@ async def finish_tracking(
         callback: CallbackQuery,
         current_user: UserModel,
         state: FSMContext,
-        session: AsyncSession
+        session: AsyncSession,
+        tracking_events_channel: TrackingEventsChannel
 ):
     tracking_manager = TrackingManager(session=session)
     tracking_data = (await state.get_data())['tracking_data']
@@ -759,6 +767,10 @@ async def finish_tracking(
         obj_id=tracking_data['tracking_id'],
         obj_in=TrackingUpdateSchema(is_finished=True)
     )
+    await tracking_events_channel.publish(
+        session=session,
+        event=TrackingEventSchema(event='finished', tracking_id=this_tracking.id)
+    )
     await session.commit()
 
     text = f'📕 Отслеживание #{this_tracking.id} успешно удалено'
@@ -1,14 +1,16 @@
 import aiogram.exceptions
 from aiogram import Router, F
 from aiogram.fsm.context import FSMContext
-from aiogram.types import CallbackQuery, Message
+from aiogram.types import CallbackQuery, InlineKeyboardMarkup, Message
 from sqlalchemy.ext.asyncio.session import AsyncSession
 
 from cruds.trackings import TrackingManager
 from keyboards.start import return_to_start_keyboard
 from models.users import UserModel
+from schemas.tracking_events import TrackingEventSchema
 from schemas.trackings import TrackingUpdateSchema
 from utils.add_messages_in_state_to_delete import add_messages_in_state_to_delete
+from utils.tracking_events import TrackingEventsChannel
 
 
 router = Router()
@@ -19,7 +21,8 @@ async def on_click_success_notification_button(
         callback: CallbackQuery,
         current_user: UserModel,
         state: FSMContext,
-        session: AsyncSession
+        session: AsyncSession,
+        tracking_events_channel: TrackingEventsChannel
 ):
     await callback.answer()
     tracking_manager = TrackingManager(session=session)
@@ -45,17 +48,42 @@ async def on_click_success_notification_button(
     await tracking_manager.clear_first_notification_date(tracking_id=tracking_id)
     if callback.data.startswith('success_notification_'):
         await tracking_manager.update(obj_id=tracking_id, obj_in=TrackingUpdateSchema(is_finished=True))
+        tracking_event = TrackingEventSchema(event='finished', tracking_id=tracking_id)
         text = (
             f'<b>💫 Отслеживание #{tracking_id} помечено как успешное</b>\n\n'
             'Мы рады что помогли вам взять билет. Спасибо за пользование сервисом!'
         )
     else:
+        tracking_event = TrackingEventSchema(event='updated', tracking_id=tracking_id)
         text = (
             f'<b>📗 Отслеживание #{tracking_id} оставлено активным</b>\n\n'
             '<b>ℹ️ Совет:</b> чтобы успеть взять билет, включите оповещения в боте и действуйте быстро'
         )
+    await tracking_events_channel.publish(session=session, event=tracking_event)
     await session.commit()
 
+    # В сводном уведомлении несколько отслеживаний: убираем кнопки только этого, остальные остаются
+    other_trackings_rows = [
+        row for row in (callback.message.reply_markup.inline_keyboard if callback.message.reply_markup else [])
+        if not any(
+            button.callback_data and button.callback_data.endswith(f'_notification_{tracking_id}') for button in row
+        )
+    ]
+    if other_trackings_rows:
+        try:
+            await callback.message.edit_reply_markup(
+                reply_markup=InlineKeyboardMarkup(inline_keyboard=other_trackings_rows)
+            )
+        except aiogram.exceptions.TelegramBadRequest:
+            pass
+        await callback.bot.send_message(
+            chat_id=callback.from_user.id,
+            text=text,
+            parse_mode='HTML',
+            reply_to_message_id=callback.message.message_id
+        )
+        return
+
     try:
         await callback.message.edit_text(
             text=callback.message.html_text.split('------')[0] + '------\n' + text,
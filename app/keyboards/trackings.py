@@ -96,9 +96,16 @@ def seats_found_kb(rzd_url: str):
     ])
 
 def found_seats_notification_kb(
-        tracking_id: int
+        tracking_ids: list[int]
 ):
+    # Если в уведомлении несколько отслеживаний - по строке кнопок на каждое
+    if len(tracking_ids) == 1:
+        return InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text='🟢 Успешно', callback_data=f'success_notification_{tracking_ids[0]}'),
+            InlineKeyboardButton(text='❌ Не успел', callback_data=f'failed_notification_{tracking_ids[0]}')]
+        ])
     return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text='🟢 Успешно', callback_data=f'success_notification_{tracking_id}'),
-        InlineKeyboardButton(text='❌ Не успел', callback_data=f'failed_notification_{tracking_id}')]
+        [InlineKeyboardButton(text=f'🟢 #{tracking_id} Успешно', callback_data=f'success_notification_{tracking_id}'),
+        InlineKeyboardButton(text=f'❌ #{tracking_id} Не успел', callback_data=f'failed_notification_{tracking_id}')]
+        for tracking_id in tracking_ids
     ])
@@ -14,6 +14,8 @@ from middlewares.session_middleware import SQLAlchemySessionMiddleware
 from middlewares.user_middleware import UserMiddleware
 from utils.paginator.paginator import router as paginator_router
 from utils.rzd_parser import RZDParser
+from utils.trains_cache import TrainsCache
+from utils.tracking_events import PostgresTrackingEventsChannel
 
 
 def setup_middlewares(dp: Dispatcher):
@@ -55,15 +57,52 @@ async def main():
     dp = Dispatcher(storage=storage)
 
     # TODO: # Добавить мидлварь ржд парсера
-    rzd_parser = RZDParser()
+    trains_cache_redis = None
+    if config.rzd.trains_cache_redis_db is not None:
+        trains_cache_redis = Redis(
+            host=config.redis.host,
+            port=config.redis.port,
+            db=config.rzd.trains_cache_redis_db,
+            password=config.redis.password
+        )
+    rzd_parser = RZDParser(
+        base_url=config.rzd.base_url,
+        trains_cache=TrainsCache(
+            ttl=config.rzd.trains_cache_ttl,
+            max_size=config.rzd.trains_cache_size,
+            redis=trains_cache_redis
+        ),
+        request_timeout=config.rzd.request_timeout,
+        connect_timeout=config.rzd.connect_timeout,
+        connections_limit=config.rzd.connections_limit,
+        connections_limit_per_host=config.rzd.connections_limit_per_host,
+        dns_cache_ttl=config.rzd.dns_cache_ttl,
+        keepalive_timeout=config.rzd.keepalive_timeout
+    )
+
+    tracking_events_channel = PostgresTrackingEventsChannel(
+        user=config.database.user,
+        password=config.database.password,
+        host=config.database.host,
+        port=config.database.port,
+        database=config.database.name
+    )
 
     setup_middlewares(dp)
     setup_routers(dp)
     setup_error_handlers(dp)
 
     try:
-        await dp.start_polling(bot, config=config, rzd_parser=rzd_parser)
+        await dp.start_polling(
+            bot,
+            config=config,
+            rzd_parser=rzd_parser,
+            tracking_events_channel=tracking_events_channel
+        )
     finally:
+        await rzd_parser.close()
+        if trains_cache_redis is not None:
+            await trains_cache_redis.aclose()
         await logger.complete()
 
 
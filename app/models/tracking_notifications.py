@@ -1,7 +1,7 @@
 import datetime
 from typing import Optional, TYPE_CHECKING
 
-from sqlalchemy import BigInteger, ForeignKey
+from sqlalchemy import BigInteger, ForeignKey, Index, text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from database import Base
@@ -13,6 +13,10 @@ if TYPE_CHECKING:
 
 class TrackingNotificationModel(Base):
     __tablename__ = 'tracking_notifications'
+    __table_args__ = (
+        # Последняя нотификация по отслеживанию
+        Index('ix_tracking_notifications_tracking_id_created_at', 'tracking_id', text('created_at DESC')),
+    )
 
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)  # tg id
 
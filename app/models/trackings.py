@@ -2,7 +2,7 @@ import datetime
 from typing import Optional, TYPE_CHECKING
 
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import BigInteger, ForeignKey, DECIMAL
+from sqlalchemy import BigInteger, ForeignKey, DECIMAL, Index, text
 
 from database import Base
 
@@ -12,6 +12,11 @@ if TYPE_CHECKING:
 
 class TrackingModel(Base):
     __tablename__ = 'trackings'
+    __table_args__ = (
+        # Активные отслеживания (воркер) и отслеживания пользователя (бот), новые сверху
+        Index('ix_trackings_active_created_at', text('created_at DESC'), postgresql_where=text('NOT is_finished')),
+        Index('ix_trackings_user_id_created_at', 'user_id', text('created_at DESC')),
+    )
 
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)  # tg id
     user_id = mapped_column(BigInteger, ForeignKey('users.id', ondelete='CASCADE'))
@@ -47,5 +52,9 @@ class TrackingModel(Base):
     finished_at: Mapped[Optional[datetime.datetime]] = mapped_column()
 
     created_at: Mapped[datetime.datetime] = mapped_column(default=datetime.datetime.utcnow)
+    # Время последнего изменения, по нему воркер подгружает только изменившиеся записи
+    updated_at: Mapped[datetime.datetime] = mapped_column(
+        default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow, index=True
+    )
 
     user: Mapped['UserModel'] = relationship()
@@ -17,8 +17,12 @@ class UserModel(Base):
     username: Mapped[Optional[str]] = mapped_column()  # username в тг
     is_banned: Mapped[bool] = mapped_column(default=False)  # забанен ли в боте
 
-    subscription_expires_at: Mapped[Optional[datetime.datetime]] = mapped_column()  # Когда истекает подписка
+    subscription_expires_at: Mapped[Optional[datetime.datetime]] = mapped_column(index=True)  # Когда истекает подписка
     # Дата последней нотификаций об истечении подписки
     last_expire_notification_sent_at: Mapped[Optional[datetime.datetime]] = mapped_column()
 
     created_at: Mapped[datetime.datetime] = mapped_column(default=datetime.datetime.utcnow)
+    # Время последнего изменения, по нему воркер подгружает только изменившиеся записи
+    updated_at: Mapped[datetime.datetime] = mapped_column(
+        default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow, index=True
+    )
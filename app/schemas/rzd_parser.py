@@ -10,39 +10,78 @@ class City(BaseModel):
     site_code: str = Field(alias='busCode')
 
 
-class Train(BaseModel):
-    train_number: str = Field(alias='DisplayTrainNumber')
-    departure_date: datetime.datetime = Field(alias='DepartureDateTime')
-    arrival_date: datetime.datetime = Field(alias='ArrivalDateTime')
-
-    from_city_id: str = Field(alias='OriginStationCode')
-    from_city_name: str = Field(alias='OriginName')
-
-    to_city_id: str = Field(alias='DestinationStationCode')
-    to_city_name: str = Field(alias='DestinationName')
-
-    # СВ
-    sw_seats: int
-    sw_min_price: float
-
-    # Сидячие места
-    sid_seats: int
-    sid_min_price: float
-
-    # Плацкарт
-    plaz_min_price: float = 9999999999999999
-    # [Плац] плацкарт нижнее:
-    plaz_seats_plaz_down_seats: int
-    # [Плац] плацкарт верхнее:
-    plaz_seats_plaz_up_seats: int
-    # [Плац] Боковое верхнее:
-    plaz_side_down_seats: int
-    # [Плац] Боковое нижнее:
-    plaz_side_up_seats: int
-
-    # Купе
-    cupe_min_price: float = 9999999999999999
-    # [Купе] Верхнее:
-    cupe_up_seats: int
-    # [Купе] Нижнее:
-    cupe_down_seats: int
+class TrainAvailability:
+    """Поезд с количеством мест и минимальными ценами. Без валидации и с __slots__ - создается на горячем пути"""
+
+    __slots__ = (
+        'train_number', 'departure_date', 'arrival_date',
+        'from_city_id', 'from_city_name', 'to_city_id', 'to_city_name',
+        # СВ
+        'sw_seats', 'sw_min_price',
+        # Сидячие места
+        'sid_seats', 'sid_min_price',
+        # Плацкарт: нижнее, верхнее, боковое нижнее, боковое верхнее
+        'plaz_min_price', 'plaz_seats_plaz_down_seats', 'plaz_seats_plaz_up_seats',
+        'plaz_side_down_seats', 'plaz_side_up_seats',
+        # Купе: верхнее, нижнее
+        'cupe_min_price', 'cupe_up_seats', 'cupe_down_seats',
+    )
+
+    def __init__(
+            self,
+            train_number: str,
+            departure_date: datetime.datetime,
+            arrival_date: datetime.datetime,
+            from_city_id: str,
+            from_city_name: str,
+            to_city_id: str,
+            to_city_name: str,
+            sw_seats: int,
+            sw_min_price: float,
+            sid_seats: int,
+            sid_min_price: float,
+            plaz_min_price: float,
+            plaz_seats_plaz_down_seats: int,
+            plaz_seats_plaz_up_seats: int,
+            plaz_side_down_seats: int,
+            plaz_side_up_seats: int,
+            cupe_min_price: float,
+            cupe_up_seats: int,
+            cupe_down_seats: int
+    ):
+        self.train_number = train_number
+        self.departure_date = departure_date
+        self.arrival_date = arrival_date
+        self.from_city_id = from_city_id
+        self.from_city_name = from_city_name
+        self.to_city_id = to_city_id
+        self.to_city_name = to_city_name
+        self.sw_seats = sw_seats
+        self.sw_min_price = sw_min_price
+        self.sid_seats = sid_seats
+        self.sid_min_price = sid_min_price
+        self.plaz_min_price = plaz_min_price
+        self.plaz_seats_plaz_down_seats = plaz_seats_plaz_down_seats
+        self.plaz_seats_plaz_up_seats = plaz_seats_plaz_up_seats
+        self.plaz_side_down_seats = plaz_side_down_seats
+        self.plaz_side_up_seats = plaz_side_up_seats
+        self.cupe_min_price = cupe_min_price
+        self.cupe_up_seats = cupe_up_seats
+        self.cupe_down_seats = cupe_down_seats
+
+    def __repr__(self) -> str:
+        return f'TrainAvailability({", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)})'
+
+    def to_row(self) -> list:
+        """Строка для JSON (даты - в isoformat)"""
+        return [
+            value.isoformat() if isinstance(value, datetime.datetime) else value
+            for value in (getattr(self, name) for name in self.__slots__)
+        ]
+
+    @classmethod
+    def from_row(cls, row: list) -> 'TrainAvailability':
+        train = cls(*row)
+        train.departure_date = datetime.datetime.fromisoformat(train.departure_date)
+        train.arrival_date = datetime.datetime.fromisoformat(train.arrival_date)
+        return train
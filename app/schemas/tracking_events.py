@@ -0,0 +1,8 @@
+from typing import Literal
+
+from pydantic import BaseModel
+
+
+class TrackingEventSchema(BaseModel):
+    event: Literal['created', 'updated', 'finished']
+    tracking_id: int
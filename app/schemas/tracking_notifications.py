@@ -1,4 +1,6 @@
-from pydantic import BaseModel
+import datetime
+
+from pydantic import BaseModel, Field
 
 from typing import Optional
 
@@ -8,6 +10,7 @@ class TrackingNotificationCreateSchema(BaseModel):
     user_id: int
     train_number: Optional[str] = None
     telegram_message_id: int
+    created_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
 
 
 class TrackingNotificationUpdateSchema(BaseModel):
@@ -0,0 +1,129 @@
+import datetime
+from types import SimpleNamespace
+
+from background.tracking_parser.availability_delta import AvailabilityChange, AvailabilityDeltaEngine
+from schemas.rzd_parser import TrainAvailability
+from utils.filter_trains import SEAT_TYPES
+from utils.route_key import get_route_key
+
+# Цена группы вагонов без мест (см. parse_trains_response)
+NO_PRICE = 9999999999999999
+ROUTE = get_route_key(from_city_id='2000000', to_city_id='2004000', date=datetime.date(2026, 11, 1))
+CUPE_UP = [flag_name for flag_name, _, _ in SEAT_TYPES].index('cupe_up_enabled')
+CUPE_DOWN = [flag_name for flag_name, _, _ in SEAT_TYPES].index('cupe_down_enabled')
+SW = [flag_name for flag_name, _, _ in SEAT_TYPES].index('sw_enabled')
+
+
+def _train(number: str = '001А', **seats) -> TrainAvailability:
+    departure_date = datetime.datetime(2026, 11, 1, 10)
+    fields = dict(
+        sw_seats=0,
+        sw_min_price=NO_PRICE,
+        sid_seats=0,
+        sid_min_price=NO_PRICE,
+        plaz_min_price=NO_PRICE,
+        plaz_seats_plaz_down_seats=0,
+        plaz_seats_plaz_up_seats=0,
+        plaz_side_down_seats=0,
+        plaz_side_up_seats=0,
+        cupe_min_price=NO_PRICE,
+        cupe_up_seats=0,
+        cupe_down_seats=0
+    )
+    fields.update(seats)
+    return TrainAvailability(
+        train_number=number,
+        departure_date=departure_date,
+        arrival_date=departure_date + datetime.timedelta(hours=8),
+        from_city_id='2000000',
+        from_city_name='Москва',
+        to_city_id='2004000',
+        to_city_name='Санкт-Петербург',
+        **fields
+    )
+
+
+def _tracking(tracking_id: int = 1, max_price=None, **enabled) -> SimpleNamespace:
+    flags = {flag_name: False for flag_name, _, _ in SEAT_TYPES}
+    flags.update(enabled)
+    return SimpleNamespace(id=tracking_id, max_price=max_price, **flags)
+
+
+def test_first_snapshot_reports_all_seats_as_appeared():
+    engine = AvailabilityDeltaEngine()
+    train = _train(cupe_up_seats=2, cupe_min_price=4500.0)
+    changes = engine.update_route(ROUTE, [train, _train('002А')])
+    assert changes == {
+        engine.get_train_key(train): [AvailabilityChange(kind='appeared', seat_type=CUPE_UP, seats=2, min_price=4500.0)]
+    }
+
+
+def test_increased_price_dropped_and_unchanged():
+    engine = AvailabilityDeltaEngine()
+    engine.update_route(ROUTE, [
+        _train(cupe_up_seats=2, cupe_down_seats=1, sw_seats=1, cupe_min_price=4500.0, sw_min_price=9000.0)
+    ])
+
+    train = _train(cupe_up_seats=3, cupe_down_seats=1, sw_seats=1, cupe_min_price=4000.0, sw_min_price=9000.0)
+    changes = engine.update_route(ROUTE, [train])
+    assert changes == {engine.get_train_key(train): [
+        AvailabilityChange(kind='increased', seat_type=CUPE_UP, seats=3, min_price=4000.0),
+        AvailabilityChange(kind='price_dropped', seat_type=CUPE_DOWN, seats=1, min_price=4000.0),
+    ]}
+
+    # Тот же снимок - изменений нет; места закончились - тоже не изменение
+    assert engine.update_route(ROUTE, [train]) == {}
+    assert engine.update_route(ROUTE, [_train()]) == {}
+    # После того как места закончились, снова появившиеся места - appeared
+    changes = engine.update_route(ROUTE, [_train(sw_seats=1, sw_min_price=9000.0)])
+    assert [change.kind for change in changes[engine.get_train_key(train)]] == ['appeared']
+
+
+def test_new_and_pending_trackings_are_notified_about_any_seats():
+    engine = AvailabilityDeltaEngine()
+    train = _train(cupe_up_seats=2, cupe_min_price=4500.0)
+    engine.update_route(ROUTE, [train])
+    tracking = _tracking(cupe_up_enabled=True)
+
+    # Новое отслеживание - уведомляем о любых подходящих местах, даже без изменений
+    changes = engine.update_route(ROUTE, [train])
+    assert engine.should_notify(tracking, [train], changes)
+    engine.mark_notified(tracking.id)
+    assert not engine.should_notify(tracking, [train], changes)
+
+    # Уведомление не отправилось - повторяем без изменений
+    engine.mark_pending(tracking.id)
+    assert engine.should_notify(tracking, [train], changes)
+
+    # Подходящих мест не осталось - ожидание снимается
+    assert not engine.should_notify(tracking, [], changes)
+    assert not engine.should_notify(tracking, [train], changes)
+
+
+def test_changes_are_filtered_by_tracking():
+    engine = AvailabilityDeltaEngine()
+    engine.update_route(ROUTE, [_train(cupe_up_seats=2, sw_seats=1, cupe_min_price=4500.0, sw_min_price=9000.0)])
+    train = _train(cupe_up_seats=2, sw_seats=3, cupe_min_price=4500.0, sw_min_price=9000.0)
+    changes = engine.update_route(ROUTE, [train])
+
+    cupe_tracking = _tracking(tracking_id=1, cupe_up_enabled=True)
+    sw_tracking = _tracking(tracking_id=2, sw_enabled=True)
+    cheap_sw_tracking = _tracking(tracking_id=3, max_price=5000, sw_enabled=True)
+    for tracking in (cupe_tracking, sw_tracking, cheap_sw_tracking):
+        engine.mark_notified(tracking.id)
+
+    # Места прибавились только в СВ
+    assert not engine.should_notify(cupe_tracking, [train], changes)
+    assert engine.should_notify(sw_tracking, [train], changes)
+    assert not engine.should_notify(cheap_sw_tracking, [train], changes)
+    assert not engine.should_notify(sw_tracking, [train], changes, min_seats=4)
+
+
+def test_removed_route_starts_from_empty_snapshot():
+    engine = AvailabilityDeltaEngine()
+    train = _train(sw_seats=1, sw_min_price=9000.0)
+    engine.update_route(ROUTE, [train])
+    engine.remove_route(ROUTE)
+    assert engine.update_route(ROUTE, [train]) == {
+        engine.get_train_key(train): [AvailabilityChange(kind='appeared', seat_type=SW, seats=1, min_price=9000.0)]
+    }
@@ -0,0 +1,122 @@
+import datetime
+import os
+
+from schemas.rzd_parser import TrainAvailability
+from utils.availability_history import NO_PRICE, AvailabilityHistoryStore
+from utils.route_key import get_route_key
+
+ROUTE = get_route_key(from_city_id='2000000', to_city_id='2004000', date=datetime.date(2026, 11, 1))
+OTHER_ROUTE = get_route_key(from_city_id='2000000', to_city_id='2004000', date=datetime.date(2026, 11, 2))
+POLLED_AT = datetime.datetime(2026, 10, 18, 12)
+
+
+def _timestamp(value: datetime.datetime) -> float:
+    return value.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def _train(number: str = '001А', cupe_up_seats: int = 2, cupe_min_price: float = 4500.5) -> TrainAvailability:
+    departure_date = datetime.datetime(2026, 11, 1, 10, 15)
+    return TrainAvailability(
+        train_number=number,
+        departure_date=departure_date,
+        arrival_date=departure_date + datetime.timedelta(hours=8),
+        from_city_id='2000000',
+        from_city_name='Москва',
+        to_city_id='2004000',
+        to_city_name='Санкт-Петербург',
+        sw_seats=0,
+        sw_min_price=NO_PRICE,
+        sid_seats=0,
+        sid_min_price=NO_PRICE,
+        plaz_min_price=NO_PRICE,
+        plaz_seats_plaz_down_seats=0,
+        plaz_seats_plaz_up_seats=0,
+        plaz_side_down_seats=0,
+        plaz_side_up_seats=0,
+        cupe_min_price=cupe_min_price,
+        cupe_up_seats=cupe_up_seats,
+        cupe_down_seats=1
+    )
+
+
+def test_round_trip(tmp_path):
+    store = AvailabilityHistoryStore(str(tmp_path))
+    store.append(ROUTE, [_train(), _train('002А', cupe_up_seats=100_000)], polled_at=_timestamp(POLLED_AT))
+    store.append(OTHER_ROUTE, [_train('003А')], polled_at=_timestamp(POLLED_AT))
+
+    records = list(store.scan(ROUTE, since=POLLED_AT - datetime.timedelta(hours=1), until=POLLED_AT))
+    assert [record.train_number for record in records] == ['001А', '002А']
+    record = records[0]
+    assert record.polled_at == _timestamp(POLLED_AT)
+    assert record.route_key == ROUTE
+    assert record.departure_date == datetime.datetime(2026, 11, 1, 10, 15)
+    assert record.seats == (0, 0, 2, 1, 0, 0, 0, 0)
+    assert record.min_prices == (NO_PRICE, NO_PRICE, 4500.5, 4500.5, NO_PRICE, NO_PRICE, NO_PRICE, NO_PRICE)
+    # Места сверх размера поля записи обрезаются
+    assert records[1].seats[2] == 0xFFFF
+    store.close()
+
+
+def test_scan_filters_by_period(tmp_path):
+    store = AvailabilityHistoryStore(str(tmp_path))
+    for hours in range(3):
+        store.append(ROUTE, [_train()], polled_at=_timestamp(POLLED_AT + datetime.timedelta(hours=hours)))
+    # Опрос следующего дня - в другом сегменте
+    store.append(ROUTE, [_train()], polled_at=_timestamp(POLLED_AT + datetime.timedelta(days=1)))
+
+    records = store.scan(
+        ROUTE, since=POLLED_AT + datetime.timedelta(hours=1), until=POLLED_AT + datetime.timedelta(hours=2)
+    )
+    assert [record.polled_at for record in records] == [
+        _timestamp(POLLED_AT + datetime.timedelta(hours=1)),
+        _timestamp(POLLED_AT + datetime.timedelta(hours=2)),
+    ]
+    records = store.scan(ROUTE, since=POLLED_AT, until=POLLED_AT + datetime.timedelta(days=2))
+    assert len(list(records)) == 4
+    store.close()
+
+
+def test_reopen_and_segment_growth(tmp_path):
+    store = AvailabilityHistoryStore(str(tmp_path), initial_segment_capacity=2)
+    for i in range(5):
+        store.append(ROUTE, [_train(f'{i:03d}А'), _train(f'{i:03d}Б')], polled_at=_timestamp(POLLED_AT) + i)
+    store.close()
+
+    store = AvailabilityHistoryStore(str(tmp_path), initial_segment_capacity=2)
+    records = list(store.scan(ROUTE, since=POLLED_AT, until=POLLED_AT + datetime.timedelta(minutes=1)))
+    assert len(records) == 10
+    assert records[-1].train_number == '004Б'
+
+    # Дописанное после переоткрытия не затирает старые записи
+    store.append(ROUTE, [_train('005А')], polled_at=_timestamp(POLLED_AT) + 5)
+    records = list(store.scan(ROUTE, since=POLLED_AT, until=POLLED_AT + datetime.timedelta(minutes=1)))
+    assert len(records) == 11
+    assert records[0].train_number == '000А'
+    store.close()
+
+
+def test_index_flushed_before_crash_is_read(tmp_path):
+    store = AvailabilityHistoryStore(str(tmp_path), index_flush_interval=0)
+    store.append(ROUTE, [_train()], polled_at=_timestamp(POLLED_AT))
+    # Процесс "упал": хранилище не закрыто, но индекс уже дописан в файл
+    reopened_store = AvailabilityHistoryStore(str(tmp_path))
+    records = list(reopened_store.scan(ROUTE, since=POLLED_AT, until=POLLED_AT))
+    assert [record.train_number for record in records] == ['001А']
+    reopened_store.close()
+    store.close()
+
+
+def test_retention_removes_old_segments(tmp_path):
+    store = AvailabilityHistoryStore(str(tmp_path), retention_days=2)
+    old_polled_at = POLLED_AT - datetime.timedelta(days=3)
+    store.append(ROUTE, [_train()], polled_at=_timestamp(old_polled_at))
+    store.append(ROUTE, [_train()], polled_at=_timestamp(POLLED_AT - datetime.timedelta(days=1)))
+    assert len(os.listdir(tmp_path)) == 4
+
+    # Первая запись нового дня удаляет сегменты старше retention_days
+    store.append(ROUTE, [_train()], polled_at=_timestamp(POLLED_AT))
+    assert sorted(os.listdir(tmp_path)) == [
+        '2026-10-17.bin', '2026-10-17.idx', '2026-10-18.bin', '2026-10-18.idx'
+    ]
+    assert list(store.scan(ROUTE, since=old_polled_at, until=old_polled_at)) == []
+    store.close()
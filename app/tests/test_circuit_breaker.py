@@ -0,0 +1,110 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from utils import circuit_breaker
+from utils.circuit_breaker import CircuitBreaker, CircuitState
+from utils.rzd_exceptions import RZDCircuitOpenException
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(circuit_breaker, 'time', SimpleNamespace(monotonic=lambda: now.value))
+    return now
+
+
+async def _request(breaker: CircuitBreaker, exception: Exception = None) -> None:
+    async with breaker.request():
+        if exception is not None:
+            raise exception
+
+
+async def _fail(breaker: CircuitBreaker) -> None:
+    with pytest.raises(asyncio.TimeoutError):
+        await _request(breaker, asyncio.TimeoutError())
+
+
+def test_opens_after_consecutive_failures(clock):
+    async def main():
+        breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=15)
+        await _fail(breaker)
+        await _fail(breaker)
+        # Успех обнуляет счетчик ошибок подряд
+        await _request(breaker)
+        await _fail(breaker)
+        await _fail(breaker)
+        assert breaker.state == CircuitState.CLOSED
+
+        await _fail(breaker)
+        assert breaker.state == CircuitState.OPEN
+        with pytest.raises(RZDCircuitOpenException) as exc_info:
+            await _request(breaker)
+        assert exc_info.value.retry_after == pytest.approx(15)
+
+    asyncio.run(main())
+
+
+def test_server_error_response_counts_as_available(clock):
+    async def main():
+        breaker = CircuitBreaker(failure_threshold=2)
+        await _fail(breaker)
+        with pytest.raises(ValueError):
+            await _request(breaker, ValueError())
+        await _fail(breaker)
+        assert breaker.state == CircuitState.CLOSED
+
+    asyncio.run(main())
+
+
+def test_half_open_lets_one_probe_through(clock):
+    async def main():
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=15)
+        await _fail(breaker)
+        clock.value += 15
+        assert breaker.state == CircuitState.HALF_OPEN
+
+        release = asyncio.Event()
+
+        async def probe():
+            async with breaker.request():
+                await release.wait()
+
+        probe_task = asyncio.create_task(probe())
+        await asyncio.sleep(0)
+        # Пока идет пробный запрос, остальные не отправляются
+        with pytest.raises(RZDCircuitOpenException):
+            await _request(breaker)
+        waiter = asyncio.create_task(breaker.wait_until_available())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+
+        release.set()
+        await probe_task
+        await asyncio.wait_for(waiter, timeout=1)
+        assert breaker.state == CircuitState.CLOSED
+
+    asyncio.run(main())
+
+
+def test_failed_probe_doubles_recovery_timeout_up_to_max(clock):
+    async def main():
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=10, max_recovery_timeout=25)
+        await _fail(breaker)
+        for expected_timeout in (20, 25, 25):
+            clock.value += 100
+            await _fail(breaker)
+            with pytest.raises(RZDCircuitOpenException) as exc_info:
+                await _request(breaker)
+            assert exc_info.value.retry_after == pytest.approx(expected_timeout)
+
+        # Удачный пробный запрос сбрасывает рост времени
+        clock.value += 100
+        await _request(breaker)
+        await _fail(breaker)
+        with pytest.raises(RZDCircuitOpenException) as exc_info:
+            await _request(breaker)
+        assert exc_info.value.retry_after == pytest.approx(10)
+
+    asyncio.run(main())
@@ -0,0 +1,137 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from utils import concurrency_controller
+from utils.concurrency_controller import AIMDConcurrencyController
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(concurrency_controller, 'time', SimpleNamespace(monotonic=lambda: now.value))
+    return now
+
+
+async def _request(controller: AIMDConcurrencyController, clock=None, duration: float = 0, exception=None):
+    async with controller.request():
+        if clock is not None:
+            clock.value += duration
+        if exception is not None:
+            raise exception
+
+
+def test_limit_grows_by_additive_increase_per_round():
+    async def main():
+        controller = AIMDConcurrencyController(initial_limit=4, max_limit=30, additive_increase=1)
+        # Круг из limit успешных запросов добавляет около additive_increase
+        for _ in range(4):
+            await _request(controller)
+        assert controller.limit == 4
+        for _ in range(2):
+            await _request(controller)
+        assert controller.limit == 5
+
+    asyncio.run(main())
+
+
+def test_limit_does_not_exceed_max_limit():
+    async def main():
+        controller = AIMDConcurrencyController(initial_limit=2, max_limit=3)
+        for _ in range(100):
+            await _request(controller)
+        assert controller.limit == 3
+
+    asyncio.run(main())
+
+
+def test_congestion_exception_halves_limit_but_not_below_min(clock):
+    async def main():
+        controller = AIMDConcurrencyController(min_limit=2, initial_limit=16, multiplicative_decrease=0.5)
+        with pytest.raises(asyncio.TimeoutError):
+            await _request(controller, clock=clock, duration=1, exception=asyncio.TimeoutError())
+        assert controller.limit == 8
+
+        for _ in range(5):
+            clock.value += 1
+            with pytest.raises(asyncio.TimeoutError):
+                await _request(controller, clock=clock, duration=1, exception=asyncio.TimeoutError())
+        assert controller.limit == 2
+
+    asyncio.run(main())
+
+
+def test_other_exceptions_do_not_change_limit():
+    async def main():
+        controller = AIMDConcurrencyController(initial_limit=1, max_limit=5)
+        with pytest.raises(ValueError):
+            await _request(controller, exception=ValueError())
+        assert controller.limit == 1
+        assert controller.in_flight == 0
+
+    asyncio.run(main())
+
+
+def test_slow_response_decreases_limit(clock):
+    async def main():
+        controller = AIMDConcurrencyController(initial_limit=10, latency_threshold=3)
+        await _request(controller, clock=clock, duration=2.9)
+        assert controller.limit == 10
+        await _request(controller, clock=clock, duration=3.5)
+        assert controller.limit == 5
+
+    asyncio.run(main())
+
+
+def test_burst_of_errors_sent_before_decrease_decreases_once(clock):
+    async def main():
+        controller = AIMDConcurrencyController(initial_limit=16)
+
+        # Все запросы ушли до первого уменьшения и падают вместе
+        release = asyncio.Event()
+
+        async def failing_request():
+            async with controller.request():
+                await release.wait()
+                raise asyncio.TimeoutError()
+
+        requests = [asyncio.create_task(failing_request()) for _ in range(6)]
+        await asyncio.sleep(0)
+        clock.value += 5
+        release.set()
+        await asyncio.gather(*requests, return_exceptions=True)
+        assert controller.limit == 8
+
+        # Запрос, отправленный после уменьшения, уменьшает лимит снова
+        clock.value += 1
+        with pytest.raises(asyncio.TimeoutError):
+            await _request(controller, clock=clock, duration=1, exception=asyncio.TimeoutError())
+        assert controller.limit == 4
+
+    asyncio.run(main())
+
+
+def test_requests_over_limit_wait_for_free_slot():
+    async def main():
+        controller = AIMDConcurrencyController(initial_limit=2, max_limit=2)
+        release = asyncio.Event()
+        started = []
+
+        async def request(i):
+            async with controller.request():
+                started.append(i)
+                await release.wait()
+
+        requests = [asyncio.create_task(request(i)) for i in range(5)]
+        for _ in range(10):
+            await asyncio.sleep(0)
+        assert started == [0, 1]
+        assert controller.in_flight == 2
+
+        release.set()
+        await asyncio.gather(*requests)
+        assert sorted(started) == [0, 1, 2, 3, 4]
+        assert controller.in_flight == 0
+
+    asyncio.run(main())
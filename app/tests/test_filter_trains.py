@@ -0,0 +1,108 @@
+import datetime
+import random
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+
+from schemas.rzd_parser import TrainAvailability
+from utils import filter_trains
+from utils.filter_trains import SEAT_TYPES, filter_trains_by_tracking, filter_trains_by_trackings
+
+# Цена группы вагонов без мест (см. parse_trains_response)
+NO_PRICE = 9999999999999999
+
+
+def _generate_train(rnd: random.Random, number: int) -> TrainAvailability:
+    departure_date = datetime.datetime(2026, 11, 1) + datetime.timedelta(hours=number)
+
+    def seats() -> int:
+        return rnd.choice([0, 0, 1, 2, rnd.randint(3, 40)])
+
+    def price() -> float:
+        return rnd.choice([NO_PRICE, float(rnd.randint(500, 20000)), rnd.randint(500, 20000) + 0.5])
+
+    return TrainAvailability(
+        train_number=f'{number:03d}А',
+        departure_date=departure_date,
+        arrival_date=departure_date + datetime.timedelta(hours=12),
+        from_city_id='2000000',
+        from_city_name='Москва',
+        to_city_id='2004000',
+        to_city_name='Санкт-Петербург',
+        sw_seats=seats(),
+        sw_min_price=price(),
+        sid_seats=seats(),
+        sid_min_price=price(),
+        plaz_min_price=price(),
+        plaz_seats_plaz_down_seats=seats(),
+        plaz_seats_plaz_up_seats=seats(),
+        plaz_side_down_seats=seats(),
+        plaz_side_up_seats=seats(),
+        cupe_min_price=price(),
+        cupe_up_seats=seats(),
+        cupe_down_seats=seats()
+    )
+
+
+def _generate_tracking(rnd: random.Random) -> SimpleNamespace:
+    # max_price в БД - DECIMAL: приходит Decimal или None
+    max_price = rnd.choice([None, Decimal(rnd.randint(500, 20000)), Decimal(f'{rnd.randint(500, 20000)}.50')])
+    return SimpleNamespace(
+        max_price=max_price,
+        **{flag_name: rnd.random() < 0.4 for flag_name, _, _ in SEAT_TYPES}
+    )
+
+
+def _filter_by_each_tracking(trains: list[TrainAvailability], trackings: list, min_seats: int):
+    return [
+        filter_trains_by_tracking(
+            trains=trains,
+            max_price=tracking.max_price,
+            min_seats=min_seats,
+            **{flag_name: getattr(tracking, flag_name) for flag_name, _, _ in SEAT_TYPES}
+        )
+        for tracking in trackings
+    ]
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+@pytest.mark.parametrize('min_seats', [1, 2, 5])
+def test_filter_trains_by_trackings_matches_filter_trains_by_tracking(monkeypatch, use_numpy, min_seats):
+    if use_numpy and filter_trains.np is None:
+        pytest.skip('numpy не установлен')
+    if not use_numpy:
+        monkeypatch.setattr(filter_trains, 'np', None)
+
+    rnd = random.Random(min_seats)
+    for _ in range(200):
+        trains = [_generate_train(rnd, number) for number in range(rnd.randint(0, 30))]
+        trackings = [_generate_tracking(rnd) for _ in range(rnd.randint(1, 20))]
+
+        assert filter_trains_by_trackings(trains=trains, trackings=trackings, min_seats=min_seats) == \
+            _filter_by_each_tracking(trains=trains, trackings=trackings, min_seats=min_seats)
+
+
+def test_filter_trains_by_trackings_price_edges():
+    rnd = random.Random(0)
+    train = _generate_train(rnd, 0)
+    for _, seats_name, price_name in SEAT_TYPES:
+        setattr(train, seats_name, 0)
+        setattr(train, price_name, NO_PRICE)
+    train.cupe_up_seats = 3
+    train.cupe_min_price = 5000.5
+
+    def tracking(max_price):
+        return SimpleNamespace(
+            max_price=max_price,
+            **{flag_name: flag_name == 'cupe_up_enabled' for flag_name, _, _ in SEAT_TYPES}
+        )
+
+    trackings = [
+        tracking(None),
+        tracking(Decimal('5000.50')),
+        tracking(Decimal('5000.49')),
+        tracking(Decimal(5000))
+    ]
+    assert filter_trains_by_trackings(trains=[train], trackings=trackings, min_seats=3) == [[train], [train], [], []]
+    assert filter_trains_by_trackings(trains=[train], trackings=trackings, min_seats=4) == [[], [], [], []]
@@ -0,0 +1,38 @@
+import asyncio
+import socket
+
+import aiohttp
+from prometheus_client import CollectorRegistry, Counter
+
+from background.metrics_server import MetricsServer
+
+
+def _get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_metrics_are_served_in_prometheus_format():
+    async def main():
+        registry = CollectorRegistry()
+        counter = Counter('checked_routes', 'Проверенных маршрутов', ('result',), registry=registry)
+        counter.labels(result='ok').inc(3)
+
+        port = _get_free_port()
+        server = MetricsServer(registry=registry, port=port)
+        await server.start()
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f'http://127.0.0.1:{port}/metrics') as response:
+                    assert response.status == 200
+                    assert response.content_type == 'text/plain'
+                    body = await response.text()
+                async with session.get(f'http://127.0.0.1:{port}/traces') as response:
+                    assert await response.json() == []
+        finally:
+            await server.stop()
+
+        assert 'checked_routes_total{result="ok"} 3.0' in body
+
+    asyncio.run(main())
@@ -0,0 +1,141 @@
+import asyncio
+import functools
+from types import SimpleNamespace
+
+from background.tracking_parser.availability_delta import AvailabilityDeltaEngine
+from background.tracking_parser.notification_aggregator import NotificationAggregator
+from background.tracking_parser.tracking_parser import TrackingParser
+from utils.tracing import RingBufferTraceExporter, Tracer, span
+
+WINDOW = 0.05
+
+
+class _Sender:
+    def __init__(self, exception: Exception = None):
+        self.batches: list[tuple[int, list]] = []
+        self._exception = exception
+
+    async def __call__(self, user_id: int, items: list) -> None:
+        self.batches.append((user_id, items))
+        if self._exception is not None:
+            raise self._exception
+
+
+def test_window_collects_items_of_one_user():
+    async def main():
+        sender = _Sender()
+        aggregator = NotificationAggregator(send_batch=sender, window=WINDOW)
+        futures = [aggregator.add(user_id=1, item='a'), aggregator.add(user_id=2, item='b')]
+        await asyncio.sleep(WINDOW / 2)
+        futures.append(aggregator.add(user_id=1, item='c'))
+        assert sender.batches == []
+        assert not any(future.done() for future in futures)
+
+        await asyncio.wait_for(asyncio.gather(*futures), timeout=1)
+        assert sorted(sender.batches) == [(1, ['a', 'c']), (2, ['b'])]
+
+    asyncio.run(main())
+
+
+def test_item_after_flush_opens_new_window():
+    async def main():
+        sender = _Sender()
+        aggregator = NotificationAggregator(send_batch=sender, window=WINDOW)
+        await aggregator.add(user_id=1, item='a')
+        await aggregator.add(user_id=1, item='b')
+        assert sender.batches == [(1, ['a']), (1, ['b'])]
+
+    asyncio.run(main())
+
+
+def test_send_error_is_set_on_all_futures_of_batch():
+    async def main():
+        sender = _Sender(exception=RuntimeError('Telegram недоступен'))
+        aggregator = NotificationAggregator(send_batch=sender, window=WINDOW)
+        futures = [aggregator.add(user_id=1, item=item) for item in 'ab']
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert len(sender.batches) == 1
+
+    asyncio.run(main())
+
+
+def test_stop_cancels_unsent_items():
+    async def main():
+        sender = _Sender()
+        aggregator = NotificationAggregator(send_batch=sender, window=60)
+        futures = [aggregator.add(user_id=user_id, item='a') for user_id in (1, 2)]
+        await asyncio.sleep(0)
+        await aggregator.stop()
+        assert all(future.cancelled() for future in futures)
+        assert sender.batches == []
+
+    asyncio.run(main())
+
+
+def test_batch_is_sent_in_own_trace_linked_to_route_traces():
+    async def main():
+        exporter = RingBufferTraceExporter()
+        tracer = Tracer(sample_rate=1, exporters=(exporter,))
+
+        async def send_batch(user_id: int, items: list) -> None:
+            with span('send_message'):
+                pass
+
+        aggregator = NotificationAggregator(send_batch=send_batch, window=WINDOW, tracer=tracer)
+        futures = []
+        route_traces = []
+        for item in 'ab':
+            with tracer.trace('route') as route_trace:
+                futures.append(aggregator.add(user_id=1, item=item))
+                route_traces.append(route_trace)
+        await asyncio.wait_for(asyncio.gather(*futures), timeout=1)
+
+        traces = {trace['name']: trace for trace in exporter.dump()}
+        assert traces['route']['spans'] == []
+        batch_trace = traces['notifications_batch']
+        assert [span_['name'] for span_ in batch_trace['spans']] == ['send_message']
+        assert batch_trace['links'] == [route_trace.trace_id for route_trace in route_traces]
+        assert batch_trace['attributes'] == {'user_id': '1', 'size': '2'}
+
+    asyncio.run(main())
+
+
+def test_batch_of_sampled_route_is_traced_without_sampling():
+    async def main():
+        exporter = RingBufferTraceExporter()
+        aggregator = NotificationAggregator(
+            send_batch=_Sender(), window=WINDOW, tracer=Tracer(sample_rate=0, exporters=(exporter,))
+        )
+        await aggregator.add(user_id=1, item='a')
+        assert len(exporter) == 0
+
+        # Маршрут выбран другим трассировщиком - пачка со ссылкой на него трассируется всегда
+        with Tracer(sample_rate=1, exporters=(exporter,)).trace('route') as route_trace:
+            future = aggregator.add(user_id=1, item='b')
+        await future
+        assert [trace['links'] for trace in exporter.dump()] == [[], [route_trace.trace_id]]
+
+    asyncio.run(main())
+
+
+def test_failed_notification_is_retried_on_next_route_check():
+    async def main():
+        engine = AvailabilityDeltaEngine()
+        registry = SimpleNamespace(get=lambda tracking_id: SimpleNamespace(id=tracking_id))
+        parser = SimpleNamespace(_availability_delta=engine, _active_trackings_registry=registry)
+        aggregator = NotificationAggregator(send_batch=_Sender(exception=RuntimeError()), window=WINDOW)
+
+        # Маршрут не ждет отправки: отслеживание сразу считается уведомленным, а после ошибки - ожидающим
+        future = aggregator.add(user_id=1, item='a')
+        engine.mark_notified(tracking_id=7)
+        future.add_done_callback(functools.partial(TrackingParser._on_notification_done, parser, 7))
+        tracking = SimpleNamespace(id=7)
+        train = SimpleNamespace(train_number='001А', departure_date=None)
+        assert not engine.should_notify(tracking, filtered_trains=[train], changes={})
+
+        await asyncio.wait([future])
+        await asyncio.sleep(0)
+        assert engine.should_notify(tracking, filtered_trains=[train], changes={})
+
+    asyncio.run(main())
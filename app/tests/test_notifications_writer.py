@@ -0,0 +1,148 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+from background.tracking_parser import notifications_writer
+from background.tracking_parser.notifications_writer import NotificationsWriter
+from schemas.tracking_notifications import TrackingNotificationCreateSchema
+from utils.tracing import RingBufferTraceExporter, Tracer
+
+
+class _Database:
+    """Вместо БД: записанные пачки нотификаций, первые fail_count записей падают"""
+
+    def __init__(self, fail_count: int = 0):
+        self.batches: list[list[int]] = []
+        self.fail_count = fail_count
+        # Запись, которая сейчас идет, ждет release
+        self.release = asyncio.Event()
+        self.release.set()
+
+    def session_maker(self):
+        @asynccontextmanager
+        async def session():
+            yield _Session()
+        return session()
+
+    def manager(self, session):
+        database = self
+
+        class _Manager:
+            async def insert_multi(self, notifications):
+                await database.release.wait()
+                if database.fail_count > 0:
+                    database.fail_count -= 1
+                    raise ConnectionError('БД недоступна')
+                database.batches.append([notification.tracking_id for notification in notifications])
+
+        return _Manager()
+
+
+class _Session:
+    async def commit(self):
+        pass
+
+
+@pytest.fixture
+def database(monkeypatch):
+    database = _Database()
+    monkeypatch.setattr(notifications_writer, 'async_session_maker', database.session_maker)
+    monkeypatch.setattr(notifications_writer, 'TrackingNotificationManager', lambda session: database.manager(session))
+    return database
+
+
+def _notification(tracking_id: int) -> TrackingNotificationCreateSchema:
+    return TrackingNotificationCreateSchema(tracking_id=tracking_id, user_id=1, telegram_message_id=tracking_id)
+
+
+def test_flush_writes_buffer_in_one_batch(database):
+    async def main():
+        writer = NotificationsWriter()
+        for tracking_id in range(3):
+            writer.add_notification(_notification(tracking_id))
+        await writer.flush()
+        assert database.batches == [[0, 1, 2]]
+        assert len(writer) == 0
+
+        # Пустой буфер в БД не пишется
+        await writer.flush()
+        assert database.batches == [[0, 1, 2]]
+
+    asyncio.run(main())
+
+
+def test_failed_batch_returns_to_buffer_before_new_notifications(database):
+    async def main():
+        database.fail_count = 1
+        database.release.clear()
+        writer = NotificationsWriter()
+        writer.add_notification(_notification(1))
+        writer.add_notification(_notification(2))
+        flush = asyncio.create_task(writer.flush())
+        await asyncio.sleep(0)
+
+        # Нотификация, добавленная во время записи, идет после неудачной пачки
+        writer.add_notification(_notification(3))
+        database.release.set()
+        with pytest.raises(ConnectionError):
+            await flush
+        assert len(writer) == 3
+
+        await writer.flush()
+        assert database.batches == [[1, 2, 3]]
+        assert len(writer) == 0
+
+    asyncio.run(main())
+
+
+def test_cancelled_flush_returns_batch_to_buffer(database):
+    async def main():
+        database.release.clear()
+        writer = NotificationsWriter()
+        writer.add_notification(_notification(1))
+        flush = asyncio.create_task(writer.flush())
+        await asyncio.sleep(0)
+        flush.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await flush
+        assert len(writer) == 1
+
+        database.release.set()
+        await writer.stop()
+        assert database.batches == [[1]]
+
+    asyncio.run(main())
+
+
+def test_full_batch_is_written_without_waiting_for_interval(database):
+    async def main():
+        writer = NotificationsWriter(flush_interval=60, max_batch_size=2)
+        writer_task = asyncio.create_task(writer.start())
+        writer.add_notification(_notification(1))
+        writer.add_notification(_notification(2))
+        for _ in range(10):
+            await asyncio.sleep(0)
+        assert database.batches == [[1, 2]]
+        writer_task.cancel()
+        await asyncio.gather(writer_task, return_exceptions=True)
+
+    asyncio.run(main())
+
+
+def test_background_flush_is_traced(database):
+    async def main():
+        exporter = RingBufferTraceExporter()
+        writer = NotificationsWriter(flush_interval=0.01, tracer=Tracer(sample_rate=1, exporters=(exporter,)))
+        writer_task = asyncio.create_task(writer.start())
+        writer.add_notification(_notification(1))
+        await asyncio.sleep(0.05)
+        writer_task.cancel()
+        await asyncio.gather(writer_task, return_exceptions=True)
+
+        # Пустой буфер не трассируется
+        [trace] = exporter.dump()
+        assert trace['name'] == 'notifications_writer'
+        assert [span['name'] for span in trace['spans']] == ['notifications_flush']
+
+    asyncio.run(main())
@@ -0,0 +1,186 @@
+"""
+Проверка планов горячих запросов фонового воркера и бота.
+
+Внутри одной транзакции наполняет БД синтетическими данными, выполняет запросы из cruds, для каждого
+выполненного SQL получает EXPLAIN и падает, если запрос читает большую таблицу последовательным сканированием.
+Транзакция откатывается - данные БД не меняются.
+
+Нужна PostgreSQL с примененными миграциями (переменные окружения - как у бота). Если БД недоступна,
+тест пропускается
+"""
+import asyncio
+import datetime
+import json
+
+import pytest
+from loguru import logger
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+import models.users  # noqa
+import models.invoices  # noqa
+from cruds.tracking_notifications import TrackingNotificationManager
+from cruds.trackings import TrackingManager
+from cruds.users import UserManager
+from database import engine
+
+# Таблицы, которые не должны читаться целиком
+CHECKED_TABLES = ('users', 'trackings', 'tracking_notifications')
+
+# id синтетических пользователей - заведомо больше id пользователей Telegram
+SEED_USER_ID_OFFSET = 9_000_000_000_000
+SEED_USERS = 50_000
+SEED_TRACKINGS_PER_USER = 4
+SEED_NOTIFICATIONS_PER_TRACKING = 10
+# Доля активных отслеживаний (в реальной БД почти все отслеживания завершены)
+SEED_ACTIVE_TRACKINGS_SHARE = 0.05
+
+_SEED_QUERIES = (
+    f'''
+    INSERT INTO users (id, first_name, is_banned, subscription_expires_at, created_at, updated_at)
+    SELECT {SEED_USER_ID_OFFSET} + g, 'seed', FALSE,
+           timezone('utc', now()) + (random() * 730 - 365) * interval '1 day',
+           timezone('utc', now()) - interval '365 days',
+           timezone('utc', now()) - random() * interval '365 days'
+    FROM generate_series(1, {SEED_USERS}) AS g
+    ''',
+    f'''
+    INSERT INTO trackings (
+        user_id, from_city_name, from_city_id, from_city_site_code, to_city_name, to_city_id, to_city_site_code,
+        date, is_finished, created_at, updated_at
+    )
+    SELECT {SEED_USER_ID_OFFSET} + u, 'seed', '2000000', 'seed', 'seed', '2004000', 'seed',
+           current_date + (g % 60), random() > {SEED_ACTIVE_TRACKINGS_SHARE},
+           timezone('utc', now()) - random() * interval '365 days',
+           timezone('utc', now()) - random() * interval '365 days'
+    FROM generate_series(1, {SEED_USERS}) AS u, generate_series(1, {SEED_TRACKINGS_PER_USER}) AS g
+    ''',
+    f'''
+    INSERT INTO tracking_notifications (tracking_id, user_id, telegram_message_id, created_at)
+    SELECT t.id, t.user_id, g, t.created_at + g * interval '1 hour'
+    FROM trackings AS t, generate_series(1, {SEED_NOTIFICATIONS_PER_TRACKING}) AS g
+    WHERE t.user_id > {SEED_USER_ID_OFFSET}
+    ''',
+    'ANALYZE users, trackings, tracking_notifications',
+)
+
+
+def _find_seq_scans(plan: dict) -> list[str]:
+    """Таблицы из CHECKED_TABLES, которые план читает последовательным сканированием"""
+    tables = []
+    if plan.get('Node Type') == 'Seq Scan' and plan.get('Relation Name') in CHECKED_TABLES:
+        tables.append(plan['Relation Name'])
+    for child_plan in plan.get('Plans', []):
+        tables.extend(_find_seq_scans(child_plan))
+    return tables
+
+
+def _describe_scans(plan: dict) -> list[str]:
+    """Чтения таблиц в плане: вид сканирования, индекс и таблица"""
+    scans = []
+    if 'Relation Name' in plan or 'Index Name' in plan:
+        index_name = f' using {plan["Index Name"]}' if 'Index Name' in plan else ''
+        relation_name = f' on {plan["Relation Name"]}' if 'Relation Name' in plan else ''
+        scans.append(f'{plan["Node Type"]}{index_name}{relation_name}')
+    for child_plan in plan.get('Plans', []):
+        scans.extend(_describe_scans(child_plan))
+    return scans
+
+
+async def _check_queries(connection: AsyncConnection) -> list[str]:
+    """Запросы, план которых читает таблицу целиком"""
+    session = AsyncSession(bind=connection)
+    seed_user_id = SEED_USER_ID_OFFSET + 1
+    seed_tracking_id = await session.scalar(text(
+        f'SELECT id FROM trackings WHERE user_id = {seed_user_id} ORDER BY id LIMIT 1'
+    ))
+    now = datetime.datetime.utcnow()
+
+    tracking_manager = TrackingManager(session=session)
+    tracking_notification_manager = TrackingNotificationManager(session=session)
+    user_manager = UserManager(session=session)
+    checked_queries = {
+        'TrackingNotificationManager.get_last_notification_by_tracking_id':
+            lambda: tracking_notification_manager.get_last_notification_by_tracking_id(seed_tracking_id),
+        'TrackingNotificationManager.get_last_notification_dates_of_active_trackings':
+            lambda: tracking_notification_manager.get_last_notification_dates_of_active_trackings(),
+        'TrackingManager.get_user_trackings':
+            lambda: tracking_manager.get_user_trackings(seed_user_id),
+        'TrackingManager.get_user_trackings(only_active=False)':
+            lambda: tracking_manager.get_user_trackings(seed_user_id, only_active=False),
+        'TrackingManager.get_user_trackings_with_not_answered_notification':
+            lambda: tracking_manager.get_user_trackings_with_not_answered_notification(seed_user_id),
+        'TrackingManager.get_all_tracking':
+            lambda: tracking_manager.get_all_tracking(),
+        # Подгрузка изменений реестром активных отслеживаний (раз в несколько секунд)
+        'TrackingManager.get_trackings_changed_since':
+            lambda: tracking_manager.get_trackings_changed_since(now - datetime.timedelta(minutes=1)),
+        'UserManager.get_users_with_subscription_expiring_between':
+            lambda: user_manager.get_users_with_subscription_expiring_between(
+                since=now - datetime.timedelta(hours=1),
+                until=now + datetime.timedelta(days=3)
+            ),
+    }
+
+    # Запоминаем SQL, который выполняют методы cruds, чтобы получить план именно этих запросов
+    executed_statements: list[tuple[str, tuple]] = []
+
+    def remember_statement(conn, cursor, statement, parameters, context, executemany):
+        executed_statements.append((statement, parameters))
+
+    failed_queries = []
+    sync_engine = connection.sync_engine
+    for name, run_query in checked_queries.items():
+        executed_statements.clear()
+        event.listen(sync_engine, 'before_cursor_execute', remember_statement)
+        try:
+            await run_query()
+        finally:
+            event.remove(sync_engine, 'before_cursor_execute', remember_statement)
+
+        # Проверяется основной запрос метода; догрузка связей (selectinload) идет по первичным ключам
+        for statement, parameters in executed_statements[:1]:
+            raw_plan = (await connection.exec_driver_sql(f'EXPLAIN (FORMAT JSON) {statement}', parameters)).scalar()
+            plan = (json.loads(raw_plan) if isinstance(raw_plan, str) else raw_plan)[0]['Plan']
+            seq_scans = _find_seq_scans(plan)
+            if seq_scans:
+                failed_queries.append(name)
+                logger.error(f'{name}: Seq Scan on {", ".join(seq_scans)}\n{statement}\n{json.dumps(plan, indent=2)}')
+            else:
+                logger.info(f'{name}: OK ({"; ".join(_describe_scans(plan))}, cost {plan["Total Cost"]})')
+    return failed_queries
+
+
+async def _check_query_plans() -> list[str]:
+    try:
+        async with engine.connect() as connection:
+            transaction = await connection.begin()
+            try:
+                for query in _SEED_QUERIES:
+                    await connection.execute(text(query))
+                return await _check_queries(connection)
+            finally:
+                await transaction.rollback()
+    finally:
+        await engine.dispose()
+
+
+def _is_database_available() -> bool:
+    async def connect():
+        try:
+            async with engine.connect() as connection:
+                await connection.execute(text('SELECT 1 FROM tracking_notifications LIMIT 1'))
+        finally:
+            await engine.dispose()
+
+    try:
+        asyncio.run(asyncio.wait_for(connect(), timeout=5))
+    except Exception as exc:
+        logger.info(f'БД для проверки планов запросов недоступна: {exc!r}')
+        return False
+    return True
+
+
+@pytest.mark.skipif(not _is_database_available(), reason='нет PostgreSQL с примененными миграциями')
+def test_hot_queries_do_not_read_whole_tables():
+    assert asyncio.run(_check_query_plans()) == []
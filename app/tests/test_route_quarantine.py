@@ -0,0 +1,68 @@
+import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from utils import route_quarantine
+from utils.route_key import get_route_key
+from utils.route_quarantine import RouteQuarantine
+from utils.rzd_exceptions import RZDRouteQuarantinedException
+
+ROUTE = get_route_key(from_city_id='2000000', to_city_id='2004000', date=datetime.date(2026, 11, 1))
+OTHER_ROUTE = get_route_key(from_city_id='2000000', to_city_id='2004000', date=datetime.date(2026, 11, 2))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(route_quarantine, 'time', SimpleNamespace(monotonic=lambda: now.value))
+    return now
+
+
+def _get_retry_after(quarantine: RouteQuarantine, route_key=ROUTE) -> float:
+    with pytest.raises(RZDRouteQuarantinedException) as exc_info:
+        quarantine.check(route_key)
+    return exc_info.value.retry_after
+
+
+def test_quarantine_after_threshold_with_growing_backoff(clock):
+    quarantine = RouteQuarantine(failure_threshold=3, backoff=60, max_backoff=200)
+    quarantine.on_invalid_response(ROUTE)
+    quarantine.on_invalid_response(ROUTE)
+    quarantine.check(ROUTE)
+    assert len(quarantine) == 0
+
+    quarantine.on_invalid_response(ROUTE)
+    assert _get_retry_after(quarantine) == pytest.approx(60)
+    # Другие маршруты не затронуты
+    quarantine.check(OTHER_ROUTE)
+    assert len(quarantine) == 1
+
+    for expected_backoff in (120, 200, 200):
+        clock.value += 1000
+        quarantine.check(ROUTE)
+        quarantine.on_invalid_response(ROUTE)
+        assert _get_retry_after(quarantine) == pytest.approx(expected_backoff)
+
+
+def test_valid_response_releases_route(clock):
+    quarantine = RouteQuarantine(failure_threshold=1, backoff=60)
+    quarantine.on_invalid_response(ROUTE)
+    clock.value += 60
+    quarantine.on_success(ROUTE)
+
+    # Счетчик начинается заново: backoff снова первый
+    quarantine.on_invalid_response(ROUTE)
+    assert _get_retry_after(quarantine) == pytest.approx(60)
+
+
+def test_discard_forgets_route(clock):
+    quarantine = RouteQuarantine(failure_threshold=1)
+    quarantine.on_invalid_response(ROUTE)
+    quarantine.on_invalid_response(OTHER_ROUTE)
+    quarantine.discard(ROUTE)
+    quarantine.discard(ROUTE)
+
+    quarantine.check(ROUTE)
+    assert len(quarantine) == 1
+    assert list(quarantine._routes) == [OTHER_ROUTE]
@@ -0,0 +1,164 @@
+import asyncio
+import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from background.tracking_parser import route_scheduler
+from background.tracking_parser.route_scheduler import RouteScheduler
+from utils.route_key import get_route_key
+
+MOSCOW_NOW = datetime.datetime(2026, 11, 1, 12)
+TIERS = [(12, 30), (48, 60), (24 * 7, 180)]
+
+
+def _route(date: datetime.date, to_city_id: str = '2004000'):
+    return get_route_key(from_city_id='2000000', to_city_id=to_city_id, date=date)
+
+
+@pytest.fixture
+def scheduler(monkeypatch) -> RouteScheduler:
+    monkeypatch.setattr(RouteScheduler, '_get_moscow_now', staticmethod(lambda: MOSCOW_NOW))
+    return RouteScheduler(poll_interval_tiers=TIERS, default_poll_interval=900)
+
+
+def test_poll_interval_tier_by_earliest_departure(scheduler):
+    route = _route(datetime.date(2026, 11, 1))
+    scheduler.set_earliest_departure(route, [
+        # Уже ушедший поезд не учитывается
+        MOSCOW_NOW - datetime.timedelta(hours=1),
+        MOSCOW_NOW + datetime.timedelta(hours=30),
+        MOSCOW_NOW + datetime.timedelta(hours=6),
+    ])
+    assert scheduler.get_poll_interval(route) == 30
+
+    scheduler.set_earliest_departure(route, [MOSCOW_NOW + datetime.timedelta(hours=30)])
+    assert scheduler.get_poll_interval(route) == 60
+
+    scheduler.set_earliest_departure(route, [MOSCOW_NOW + datetime.timedelta(days=10)])
+    assert scheduler.get_poll_interval(route) == 900
+
+
+def test_poll_interval_by_route_date_while_trains_unknown(scheduler):
+    # Маршрут без известных поездов - от начала его даты
+    assert scheduler.get_poll_interval(_route(datetime.date(2026, 11, 2))) == 30
+    assert scheduler.get_poll_interval(_route(datetime.date(2026, 11, 3))) == 60
+    assert scheduler.get_poll_interval(_route(datetime.date(2026, 11, 5))) == 180
+    assert scheduler.get_poll_interval(_route(datetime.date(2026, 12, 31))) == 900
+
+    # Все поезда ушли - снова по дате маршрута
+    route = _route(datetime.date(2026, 12, 31))
+    scheduler.set_earliest_departure(route, [MOSCOW_NOW + datetime.timedelta(hours=1)])
+    scheduler.set_earliest_departure(route, [MOSCOW_NOW - datetime.timedelta(hours=1)])
+    assert scheduler.get_poll_interval(route) == 900
+
+
+def test_routes_are_returned_by_due_time(scheduler):
+    async def main():
+        late_route = _route(datetime.date(2026, 11, 3))
+        early_route = _route(datetime.date(2026, 11, 4))
+        overdue_route = _route(datetime.date(2026, 11, 5))
+        await scheduler.put(late_route, delay=0.05)
+        await scheduler.put(early_route, delay=0.02)
+        await scheduler.put(overdue_route, delay=-10)
+
+        assert scheduler.get_overdue_count() == 1
+        assert await scheduler.get() == overdue_route
+        assert await scheduler.get() == early_route
+        assert await scheduler.get() == late_route
+        assert len(scheduler) == 0
+
+    asyncio.run(main())
+
+
+def test_max_overdue_is_counted_from_due_time(scheduler, monkeypatch):
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(route_scheduler, 'time', SimpleNamespace(monotonic=lambda: now.value))
+
+    async def main():
+        assert scheduler.get_max_overdue() == 0
+        await scheduler.put(_route(datetime.date(2026, 11, 3)), delay=30)
+        await scheduler.put(_route(datetime.date(2026, 11, 4)), delay=10)
+        assert scheduler.get_max_overdue() == 0
+
+        now.value += 25
+        assert scheduler.get_max_overdue() == pytest.approx(15)
+
+        # Новый маршрут просрочен с момента добавления
+        await scheduler.put(_route(datetime.date(2026, 11, 5)), first=True)
+        now.value += 5
+        assert scheduler.get_max_overdue() == pytest.approx(20)
+
+    asyncio.run(main())
+
+
+def test_get_waits_until_route_is_due(scheduler):
+    async def main():
+        route = _route(datetime.date(2026, 11, 3))
+        loop = asyncio.get_running_loop()
+        started_at = loop.time()
+        await scheduler.put(route, delay=0.1)
+        assert await scheduler.get() == route
+        assert loop.time() - started_at >= 0.09
+
+    asyncio.run(main())
+
+
+def test_get_wakes_up_for_earlier_route(scheduler):
+    async def main():
+        far_route = _route(datetime.date(2026, 11, 3))
+        near_route = _route(datetime.date(2026, 11, 4))
+        await scheduler.put(far_route, delay=60)
+        getter = asyncio.create_task(scheduler.get())
+        await asyncio.sleep(0)
+        await scheduler.put(near_route, delay=0)
+        assert await asyncio.wait_for(getter, timeout=1) == near_route
+
+    asyncio.run(main())
+
+
+def test_first_goes_before_overdue_routes(scheduler):
+    async def main():
+        overdue_routes = [_route(datetime.date(2026, 11, 3), to_city_id=str(i)) for i in range(3)]
+        for route in overdue_routes:
+            await scheduler.put(route, delay=-60)
+        new_route = _route(datetime.date(2026, 11, 4))
+        await scheduler.put(new_route, first=True)
+
+        assert await scheduler.get() == new_route
+        assert [await scheduler.get() for _ in overdue_routes] == overdue_routes
+
+    asyncio.run(main())
+
+
+def test_put_keeps_earlier_time(scheduler):
+    async def main():
+        route = _route(datetime.date(2026, 11, 3))
+        other_route = _route(datetime.date(2026, 11, 4))
+        await scheduler.put(route, delay=0)
+        # Более позднее время не откладывает уже запланированную проверку
+        await scheduler.put(route, delay=60)
+        await scheduler.put(other_route, delay=0.01)
+        assert await scheduler.get() == route
+
+        # Более раннее - переносит её вперед
+        await scheduler.put(route, delay=60)
+        await scheduler.put(route, first=True)
+        assert await scheduler.get() == route
+        assert len(scheduler) == 1
+
+    asyncio.run(main())
+
+
+def test_removed_route_is_not_returned(scheduler):
+    async def main():
+        removed_route = _route(datetime.date(2026, 11, 3))
+        route = _route(datetime.date(2026, 11, 4))
+        await scheduler.put(removed_route, delay=0)
+        await scheduler.put(route, delay=0.01)
+        scheduler.remove(removed_route)
+
+        assert removed_route not in scheduler
+        assert await scheduler.get() == route
+
+    asyncio.run(main())
@@ -0,0 +1,119 @@
+import asyncio
+import datetime
+import socket
+from types import SimpleNamespace
+
+import pytest
+from loguru import logger
+
+from background.tracking_parser.tracking_parser import TrackingParser
+from benchmarks.fake_rzd_server import FakeRZDServer, FakeRZDSettings
+from utils import rzd_response_corpus
+from utils.route_key import get_route_key
+from utils.rzd_exceptions import RZDResponseNotRecordedException
+from utils.rzd_parser import RZDParser
+from utils.rzd_response_corpus import RecordedResponse, RZDResponseCorpus
+from utils.tracing import Tracer
+
+ROUTE = get_route_key(from_city_id='2000000', to_city_id='2004000', date=datetime.date(2026, 11, 1))
+OTHER_ROUTE = get_route_key(from_city_id='2000000', to_city_id='2004000', date=datetime.date(2026, 11, 2))
+
+
+def _get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_responses_are_replayed_in_recorded_order(tmp_path):
+    async def main():
+        corpus = RZDResponseCorpus(path=str(tmp_path))
+        # Байты не из UTF-8 сохраняются как есть
+        bodies = [b'{"Trains": []}', b'\xff\xfe not utf-8', b'Service Unavailable']
+        for status, body in zip((200, 200, 503), bodies):
+            corpus.record(route_key=ROUTE, request_data={'Origin': ROUTE.from_city_id}, status=status, body=body)
+        corpus.close()
+        assert corpus.get_routes() == [ROUTE]
+
+        replay_corpus = RZDResponseCorpus(path=str(tmp_path))
+        responses = [await replay_corpus.get_response(ROUTE) for _ in range(4)]
+        # По кругу: после последнего ответа снова первый
+        assert responses == [
+            RecordedResponse(status=200, body=bodies[0]),
+            RecordedResponse(status=200, body=bodies[1]),
+            RecordedResponse(status=503, body=bodies[2]),
+            RecordedResponse(status=200, body=bodies[0]),
+        ]
+        with pytest.raises(RZDResponseNotRecordedException):
+            await replay_corpus.get_response(OTHER_ROUTE)
+
+    asyncio.run(main())
+
+
+def test_record_interval_limits_responses_of_route(tmp_path, monkeypatch):
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(rzd_response_corpus, 'time', SimpleNamespace(monotonic=lambda: now.value))
+
+    async def main():
+        corpus = RZDResponseCorpus(path=str(tmp_path), record_interval=60)
+        for body in (b'1', b'2'):
+            corpus.record(route_key=ROUTE, request_data={}, status=200, body=body)
+        corpus.record(route_key=OTHER_ROUTE, request_data={}, status=200, body=b'3')
+        now.value += 60
+        corpus.record(route_key=ROUTE, request_data={}, status=200, body=b'4')
+        corpus.close()
+
+        replay_corpus = RZDResponseCorpus(path=str(tmp_path))
+        assert [(await replay_corpus.get_response(ROUTE)).body for _ in range(2)] == [b'1', b'4']
+        assert (await replay_corpus.get_response(OTHER_ROUTE)).body == b'3'
+
+    asyncio.run(main())
+
+
+def test_parser_replays_recorded_trains_without_requests(tmp_path):
+    async def main():
+        port = _get_free_port()
+        server = FakeRZDServer(settings=FakeRZDSettings(latency=0, latency_jitter=0), port=port)
+        await server.start()
+        try:
+            async with RZDParser(
+                    base_url=server.base_url, record_corpus=RZDResponseCorpus(path=str(tmp_path))
+            ) as parser:
+                recorded_trains = await parser.get_trains(
+                    from_city_id=ROUTE.from_city_id, to_city_id=ROUTE.to_city_id, date=ROUTE.date
+                )
+        finally:
+            await server.stop()
+        assert recorded_trains
+
+        # Имитатор остановлен: ответ может прийти только из корпуса
+        async with RZDParser(base_url=server.base_url, replay_corpus=RZDResponseCorpus(path=str(tmp_path))) as parser:
+            replayed_trains = await parser.get_trains(
+                from_city_id=ROUTE.from_city_id, to_city_id=ROUTE.to_city_id, date=ROUTE.date
+            )
+            with pytest.raises(RZDResponseNotRecordedException):
+                await parser.get_trains(
+                    from_city_id=OTHER_ROUTE.from_city_id, to_city_id=OTHER_ROUTE.to_city_id, date=OTHER_ROUTE.date
+                )
+        assert [repr(train) for train in replayed_trains] == [repr(train) for train in recorded_trains]
+
+    asyncio.run(main())
+
+
+def test_route_missing_in_corpus_is_logged_as_warning():
+    async def main():
+        async def handle_route(route_key):
+            raise RZDResponseNotRecordedException(route_key=route_key)
+
+        parser = SimpleNamespace(_tracer=Tracer(), _handle_route=handle_route)
+        records = []
+        handler_id = logger.add(lambda message: records.append(message.record['level'].name), level='WARNING')
+        try:
+            retry_after = await TrackingParser._handle_route_with_exception_handling(parser, ROUTE)
+        finally:
+            logger.remove(handler_id)
+        # Ошибки уходят админу в Telegram - отсутствие маршрута в корпусе к ним не относится
+        assert records == ['WARNING']
+        assert retry_after is None
+
+    asyncio.run(main())
@@ -0,0 +1,153 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from utils import telegram_sender
+from utils.telegram_sender import MessagePriority, TelegramSender, TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(telegram_sender, 'time', SimpleNamespace(monotonic=lambda: now.value))
+    return now
+
+
+class _Bot:
+    """Bot.send_message: записывает отправленное, первые retry_after_count вызовов в чат отвечают RetryAfter"""
+
+    def __init__(self, retry_after_count: int = 0):
+        self.sent: list[tuple[int, str]] = []
+        self.calls = 0
+        self._retry_after_count = retry_after_count
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        self.calls += 1
+        if self._retry_after_count > 0:
+            self._retry_after_count -= 1
+            raise TelegramRetryAfter(
+                method=SendMessage(chat_id=chat_id, text=text), message='Too Many Requests', retry_after=0
+            )
+        self.sent.append((chat_id, text))
+        return SimpleNamespace(chat_id=chat_id, text=text)
+
+
+async def _send_all(sender: TelegramSender, messages: list[tuple[int, str, MessagePriority]]) -> list:
+    """Ставит сообщения в очередь до запуска отправки, затем ждет их всех"""
+    sending = [
+        asyncio.create_task(sender.send_message(chat_id=chat_id, text=text, priority=priority))
+        for chat_id, text, priority in messages
+    ]
+    await asyncio.sleep(0)
+    sender_task = asyncio.create_task(sender.start())
+    try:
+        return await asyncio.wait_for(asyncio.gather(*sending, return_exceptions=True), timeout=5)
+    finally:
+        sender_task.cancel()
+        await asyncio.gather(sender_task, return_exceptions=True)
+
+
+def test_token_bucket_burst_and_refill(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    for _ in range(3):
+        assert bucket.get_wait_time(clock.value) == 0
+        bucket.take(clock.value)
+    assert bucket.get_wait_time(clock.value) == pytest.approx(0.5)
+
+    clock.value += 0.5
+    assert bucket.get_wait_time(clock.value) == 0
+    # Больше capacity не копится
+    clock.value += 100
+    assert bucket.is_idle(clock.value)
+
+
+def test_token_bucket_pause_and_set_rate(clock):
+    bucket = TokenBucket(rate=10, capacity=10)
+    bucket.pause(5)
+    assert bucket.get_wait_time(clock.value) == pytest.approx(5)
+    assert not bucket.is_idle(clock.value + 1)
+
+    clock.value += 5
+    bucket.set_rate(rate=1, capacity=1)
+    assert bucket.get_wait_time(clock.value) == 0
+    bucket.take(clock.value)
+    assert bucket.get_wait_time(clock.value) == pytest.approx(1)
+
+
+def test_higher_priority_is_sent_first():
+    async def main():
+        bot = _Bot()
+        sender = TelegramSender(bot=bot, global_rate=1000, chat_rate=1000, chat_burst=1000)
+        await _send_all(sender, [
+            (1, 'reminder', MessagePriority.SUBSCRIPTION_REMINDER),
+            (2, 'closed', MessagePriority.TRACKING_CLOSED),
+            (3, 'seats 1', MessagePriority.SEATS_ALERT),
+            (4, 'seats 2', MessagePriority.SEATS_ALERT),
+        ])
+        assert [text for _, text in bot.sent] == ['seats 1', 'seats 2', 'closed', 'reminder']
+
+    asyncio.run(main())
+
+
+def test_limited_chat_does_not_block_other_chats():
+    async def main():
+        bot = _Bot()
+        sender = TelegramSender(bot=bot, global_rate=1000, chat_rate=20, chat_burst=1)
+        await _send_all(sender, [
+            (1, 'seats 1', MessagePriority.SEATS_ALERT),
+            (1, 'seats 2', MessagePriority.SEATS_ALERT),
+            (2, 'reminder', MessagePriority.SUBSCRIPTION_REMINDER),
+        ])
+        # Второе сообщение в чат 1 ждет его лимита, напоминание в чат 2 уходит раньше
+        assert [text for _, text in bot.sent] == ['seats 1', 'reminder', 'seats 2']
+
+    asyncio.run(main())
+
+
+def test_retry_after_requeues_message():
+    async def main():
+        bot = _Bot(retry_after_count=2)
+        sender = TelegramSender(bot=bot, global_rate=1000, chat_rate=100, max_retries=3)
+        results = await _send_all(sender, [(1, 'seats', MessagePriority.SEATS_ALERT)])
+        assert results[0].text == 'seats'
+        assert bot.calls == 3
+        assert len(sender) == 0
+
+    asyncio.run(main())
+
+
+def test_retry_after_over_max_retries_fails_message():
+    async def main():
+        bot = _Bot(retry_after_count=10)
+        sender = TelegramSender(bot=bot, global_rate=1000, chat_rate=100, max_retries=1)
+        results = await _send_all(sender, [(1, 'seats', MessagePriority.SEATS_ALERT)])
+        assert isinstance(results[0], TelegramRetryAfter)
+        assert bot.calls == 2
+
+    asyncio.run(main())
+
+
+def test_stop_cancels_queued_messages():
+    async def main():
+        sender = TelegramSender(bot=_Bot())
+        sending = asyncio.create_task(sender.send_message(chat_id=1, text='reminder'))
+        await asyncio.sleep(0)
+        await sender.stop()
+        with pytest.raises(asyncio.CancelledError):
+            await sending
+
+    asyncio.run(main())
+
+
+def test_dry_run_does_not_send_to_telegram():
+    async def main():
+        bot = _Bot()
+        sender = TelegramSender(bot=bot, global_rate=100, dry_run=True)
+        [message] = await _send_all(sender, [(1, 'seats', MessagePriority.SEATS_ALERT)])
+        assert bot.calls == 0
+        assert (message.message_id, message.chat.id, message.text) == (0, 1, 'seats')
+
+    asyncio.run(main())
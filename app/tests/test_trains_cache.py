@@ -0,0 +1,279 @@
+import asyncio
+import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from schemas.rzd_parser import TrainAvailability
+from utils import trains_cache
+from utils.route_key import get_route_key
+from utils.rzd_parser import RZDParser
+from utils.trains_cache import TrainsCache
+
+ROUTE = get_route_key(from_city_id='2000000', to_city_id='2004000', date=datetime.date(2026, 11, 1))
+OTHER_ROUTE = get_route_key(from_city_id='2000000', to_city_id='2004000', date=datetime.date(2026, 11, 2))
+
+
+def _train(number: str = '001А') -> TrainAvailability:
+    departure_date = datetime.datetime(2026, 11, 1, 10)
+    return TrainAvailability(
+        train_number=number,
+        departure_date=departure_date,
+        arrival_date=departure_date + datetime.timedelta(hours=8),
+        from_city_id='2000000',
+        from_city_name='Москва',
+        to_city_id='2004000',
+        to_city_name='Санкт-Петербург',
+        sw_seats=0,
+        sw_min_price=9999999999999999,
+        sid_seats=0,
+        sid_min_price=9999999999999999,
+        plaz_min_price=9999999999999999,
+        plaz_seats_plaz_down_seats=0,
+        plaz_seats_plaz_up_seats=0,
+        plaz_side_down_seats=0,
+        plaz_side_up_seats=0,
+        cupe_min_price=4500.0,
+        cupe_up_seats=2,
+        cupe_down_seats=1
+    )
+
+
+class _Fetch:
+    """fetch для get_or_fetch: считает вызовы и ждет release, пока его не отпустят"""
+
+    def __init__(self, result=None, exception: Exception = None):
+        self.calls = 0
+        self.release = asyncio.Event()
+        self._result = result if result is not None else [_train()]
+        self._exception = exception
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+
+async def _wait_for(condition, iterations: int = 100) -> None:
+    """Дает событиям цикла обработаться, пока condition() не станет истинным"""
+    for _ in range(iterations):
+        if condition():
+            return
+        await asyncio.sleep(0)
+    raise AssertionError('Условие не выполнилось')
+
+
+class _FakeRedis:
+    def __init__(self):
+        self.values: dict[str, bytes] = dict()
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, value, px=None):
+        self.values[key] = value.encode() if isinstance(value, str) else value
+
+    async def pttl(self, key):
+        return 10_000 if key in self.values else -2
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Время кэша, которое двигает тест (time.monotonic event loop'а не трогаем)"""
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(trains_cache, 'time', SimpleNamespace(monotonic=lambda: now.value))
+    return now
+
+
+def test_concurrent_calls_share_one_fetch():
+    async def main():
+        cache = TrainsCache(ttl=20)
+        fetch = _Fetch()
+        waiters = [asyncio.create_task(cache.get_or_fetch(route_key=ROUTE, fetch=fetch)) for _ in range(5)]
+        await asyncio.sleep(0)
+        fetch.release.set()
+        results = await asyncio.gather(*waiters)
+
+        assert fetch.calls == 1
+        assert all(result is results[0] for result in results)
+        # Следующий вызов - из кэша
+        assert await cache.get_or_fetch(route_key=ROUTE, fetch=fetch) is results[0]
+        assert fetch.calls == 1
+
+    asyncio.run(main())
+
+
+def test_leader_cancellation_lets_waiter_fetch_itself():
+    async def main():
+        cache = TrainsCache(ttl=20)
+        leader_fetch = _Fetch()
+        waiter_fetch = _Fetch()
+        leader = asyncio.create_task(cache.get_or_fetch(route_key=ROUTE, fetch=leader_fetch))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get_or_fetch(route_key=ROUTE, fetch=waiter_fetch))
+        await asyncio.sleep(0)
+
+        leader.cancel()
+        await _wait_for(lambda: waiter_fetch.calls == 1)
+        waiter_fetch.release.set()
+        assert len(await waiter) == 1
+        assert leader.cancelled()
+
+    asyncio.run(main())
+
+
+def test_waiter_cancelled_together_with_leader_stays_cancelled():
+    async def main():
+        cache = TrainsCache(ttl=20)
+        leader_fetch = _Fetch()
+        waiter_fetch = _Fetch()
+        leader = asyncio.create_task(cache.get_or_fetch(route_key=ROUTE, fetch=leader_fetch))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get_or_fetch(route_key=ROUTE, fetch=waiter_fetch))
+        await asyncio.sleep(0)
+
+        leader.cancel()
+        waiter.cancel()
+        await asyncio.wait_for(asyncio.gather(leader, waiter, return_exceptions=True), timeout=1)
+        assert leader.cancelled() and waiter.cancelled()
+        assert waiter_fetch.calls == 0
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_does_not_cancel_leader():
+    async def main():
+        cache = TrainsCache(ttl=20)
+        fetch = _Fetch()
+        leader = asyncio.create_task(cache.get_or_fetch(route_key=ROUTE, fetch=fetch))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get_or_fetch(route_key=ROUTE, fetch=fetch))
+        await asyncio.sleep(0)
+
+        waiter.cancel()
+        fetch.release.set()
+        assert len(await leader) == 1
+        assert waiter.cancelled()
+        assert fetch.calls == 1
+
+    asyncio.run(main())
+
+
+def test_fetch_error_is_raised_to_all_waiters_and_not_cached():
+    async def main():
+        cache = TrainsCache(ttl=20)
+        failing_fetch = _Fetch(exception=RuntimeError('РЖД недоступен'))
+        waiters = [asyncio.create_task(cache.get_or_fetch(route_key=ROUTE, fetch=failing_fetch)) for _ in range(3)]
+        await asyncio.sleep(0)
+        failing_fetch.release.set()
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        assert failing_fetch.calls == 1
+        assert all(isinstance(result, RuntimeError) for result in results)
+
+        fetch = _Fetch()
+        fetch.release.set()
+        assert len(await cache.get_or_fetch(route_key=ROUTE, fetch=fetch)) == 1
+        assert fetch.calls == 1
+
+    asyncio.run(main())
+
+
+def test_ttl_expiry(clock):
+    async def main():
+        cache = TrainsCache(ttl=20)
+        fetch = _Fetch()
+        fetch.release.set()
+        await cache.get_or_fetch(route_key=ROUTE, fetch=fetch)
+
+        clock.value += 19
+        await cache.get_or_fetch(route_key=ROUTE, fetch=fetch)
+        assert fetch.calls == 1
+
+        clock.value += 2
+        await cache.get_or_fetch(route_key=ROUTE, fetch=fetch)
+        assert fetch.calls == 2
+
+    asyncio.run(main())
+
+
+def test_lru_eviction():
+    async def main():
+        cache = TrainsCache(ttl=20, max_size=2)
+        third_route = get_route_key(from_city_id='2000000', to_city_id='2004000', date=datetime.date(2026, 11, 3))
+        fetch = _Fetch()
+        fetch.release.set()
+        await cache.get_or_fetch(route_key=ROUTE, fetch=fetch)
+        await cache.get_or_fetch(route_key=OTHER_ROUTE, fetch=fetch)
+        # ROUTE использован последним - вытесняется OTHER_ROUTE
+        await cache.get_or_fetch(route_key=ROUTE, fetch=fetch)
+        await cache.get_or_fetch(route_key=third_route, fetch=fetch)
+        assert fetch.calls == 3
+
+        await cache.get_or_fetch(route_key=ROUTE, fetch=fetch)
+        assert fetch.calls == 3
+        await cache.get_or_fetch(route_key=OTHER_ROUTE, fetch=fetch)
+        assert fetch.calls == 4
+
+    asyncio.run(main())
+
+
+def test_partial_car_types_serve_only_subsets():
+    async def main():
+        cache = TrainsCache(ttl=20)
+        fetch = _Fetch()
+        fetch.release.set()
+        await cache.get_or_fetch(route_key=ROUTE, fetch=fetch, car_types=frozenset({'КУПЕ', 'ПЛАЦ'}))
+
+        await cache.get_or_fetch(route_key=ROUTE, fetch=fetch, car_types=frozenset({'КУПЕ'}))
+        assert fetch.calls == 1
+        await cache.get_or_fetch(route_key=ROUTE, fetch=fetch, car_types=frozenset({'СВ'}))
+        assert fetch.calls == 2
+        await cache.get_or_fetch(route_key=ROUTE, fetch=fetch)
+        assert fetch.calls == 3
+
+    asyncio.run(main())
+
+
+def test_shared_cache_between_processes():
+    async def main():
+        redis = _FakeRedis()
+        worker_cache = TrainsCache(ttl=20, redis=redis)
+        bot_cache = TrainsCache(ttl=20, redis=redis)
+        fetch = _Fetch()
+        fetch.release.set()
+        await worker_cache.get_or_fetch(route_key=ROUTE, fetch=fetch)
+
+        bot_fetch = _Fetch()
+        bot_fetch.release.set()
+        trains = await bot_cache.get_or_fetch(route_key=ROUTE, fetch=bot_fetch)
+        assert bot_fetch.calls == 0
+        assert [repr(train) for train in trains] == [repr(_train())]
+
+    asyncio.run(main())
+
+
+def test_parser_with_shared_cache_parses_all_car_types():
+    async def main():
+        requested_car_types = []
+
+        async def fetch_trains(from_city_id, to_city_id, date, car_types=None):
+            requested_car_types.append(car_types)
+            return [_train()]
+
+        redis = _FakeRedis()
+        worker_parser = RZDParser(trains_cache=TrainsCache(ttl=20, redis=redis))
+        worker_parser._fetch_trains = fetch_trains
+        await worker_parser.get_trains(
+            from_city_id=ROUTE.from_city_id, to_city_id=ROUTE.to_city_id, date=ROUTE.date, car_types={'КУПЕ'}
+        )
+        # Воркер разбирает все типы вагонов, чтобы поезда попали в общий кэш
+        assert requested_car_types == [None]
+
+        bot_parser = RZDParser(trains_cache=TrainsCache(ttl=20, redis=redis))
+        bot_parser._fetch_trains = fetch_trains
+        await bot_parser.get_trains(from_city_id=ROUTE.from_city_id, to_city_id=ROUTE.to_city_id, date=ROUTE.date)
+        assert requested_car_types == [None]
+
+    asyncio.run(main())
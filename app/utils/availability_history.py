@@ -0,0 +1,293 @@
+import datetime
+import mmap
+import os
+import struct
+import time
+from typing import Iterator, NamedTuple, Optional
+
+from loguru import logger
+
+from schemas.rzd_parser import TrainAvailability
+from utils.filter_trains import SEAT_TYPES
+from utils.route_key import RouteKey
+
+# Заголовок сегмента: сигнатура, версия, количество записей
+_HEADER = struct.Struct('<4sIQ')
+_MAGIC = b'RZDH'
+_VERSION = 2
+# Запись: время опроса, откуда, куда, дата маршрута (ordinal), номер поезда, отправление (unix),
+# места и минимальные цены по типам мест в копейках (в порядке SEAT_TYPES)
+_RECORD = struct.Struct(f'<d12s12si12sq{len(SEAT_TYPES)}H{len(SEAT_TYPES)}q')
+# Запись индекса: маршрут, номер первой записи опроса, количество записей
+_INDEX_RECORD = struct.Struct('<12s12siQI')
+
+_MAX_SEATS = 0xFFFF
+# Цена типа мест, которых в поезде нет (см. parse_trains_response), и её значение в записи
+NO_PRICE = 9999999999999999
+_NO_PRICE_KOPECKS = -1
+
+
+class AvailabilityHistoryRecord(NamedTuple):
+    polled_at: float
+    route_key: RouteKey
+    train_number: str
+    departure_date: datetime.datetime
+    # Места и минимальные цены в порядке SEAT_TYPES (NO_PRICE - мест этого типа нет)
+    seats: tuple[int, ...]
+    min_prices: tuple[float, ...]
+
+
+def _encode(value: str, size: int) -> bytes:
+    return value.encode()[:size]
+
+
+def _decode(value: bytes) -> str:
+    return value.rstrip(b'\0').decode(errors='replace')
+
+
+def _encode_price(price: float) -> int:
+    if price >= NO_PRICE:
+        return _NO_PRICE_KOPECKS
+    return round(price * 100)
+
+
+def _decode_price(kopecks: int) -> float:
+    if kopecks == _NO_PRICE_KOPECKS:
+        return NO_PRICE
+    return kopecks / 100
+
+
+class _Segment:
+    """Файл записей за один день (mmap) и его индекс по маршрутам"""
+
+    def __init__(self, path: str, initial_capacity: int, index_flush_interval: float):
+        self.path = path
+        self.index_path = path[:-len('.bin')] + '.idx'
+        self.route_index: dict[RouteKey, list[tuple[int, int]]] = dict()
+
+        is_new = not os.path.exists(path)
+        self._file = open(path, 'a+b')
+        if is_new or os.path.getsize(path) < _HEADER.size:
+            self._file.truncate(_HEADER.size + initial_capacity * _RECORD.size)
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+        if is_new:
+            _HEADER.pack_into(self._mmap, 0, _MAGIC, _VERSION, 0)
+
+        magic, version, self.records_count = _HEADER.unpack_from(self._mmap, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f'Неизвестный формат сегмента истории {path}')
+        self._load_index()
+        self._index_file = open(self.index_path, 'ab')
+        # Записи индекса копятся в памяти и дописываются в файл не чаще index_flush_interval секунд
+        self._index_flush_interval = index_flush_interval
+        self._index_buffer = bytearray()
+        self._index_flushed_at = time.monotonic()
+
+    @property
+    def capacity(self) -> int:
+        return (len(self._mmap) - _HEADER.size) // _RECORD.size
+
+    def _load_index(self) -> None:
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, 'rb') as index_file:
+            raw_index = index_file.read()
+        for i in range(len(raw_index) // _INDEX_RECORD.size):
+            from_city_id, to_city_id, date_ordinal, first_record, count = _INDEX_RECORD.unpack_from(
+                raw_index, i * _INDEX_RECORD.size
+            )
+            # Записи индекса, данные которых не успели сохраниться до падения, пропускаем
+            if first_record + count > self.records_count:
+                continue
+            route_key = RouteKey(_decode(from_city_id), _decode(to_city_id), datetime.date.fromordinal(date_ordinal))
+            self.route_index.setdefault(route_key, []).append((first_record, count))
+
+    def _grow(self, min_capacity: int) -> None:
+        new_capacity = max(self.capacity * 2, min_capacity)
+        # Без flush: изменения отображения остаются в page cache и после close, msync всего файла не нужен
+        self._mmap.close()
+        self._file.truncate(_HEADER.size + new_capacity * _RECORD.size)
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+
+    def append(self, route_key: RouteKey, records: bytearray, count: int) -> None:
+        first_record = self.records_count
+        if first_record + count > self.capacity:
+            self._grow(first_record + count)
+
+        offset = _HEADER.size + first_record * _RECORD.size
+        self._mmap[offset:offset + len(records)] = records
+        # Счетчик записей обновляется после данных: при падении недописанный опрос просто не будет учтен
+        self.records_count += count
+        _HEADER.pack_into(self._mmap, 0, _MAGIC, _VERSION, self.records_count)
+
+        self._index_buffer += _INDEX_RECORD.pack(
+            _encode(route_key.from_city_id, 12),
+            _encode(route_key.to_city_id, 12),
+            route_key.date.toordinal(),
+            first_record,
+            count
+        )
+        self.route_index.setdefault(route_key, []).append((first_record, count))
+        if time.monotonic() - self._index_flushed_at >= self._index_flush_interval:
+            self.flush_index()
+
+    def flush_index(self) -> None:
+        """Запись накопленных записей индекса в файл"""
+        if self._index_buffer:
+            self._index_file.write(self._index_buffer)
+            self._index_file.flush()
+            self._index_buffer = bytearray()
+        self._index_flushed_at = time.monotonic()
+
+    def read(self, first_record: int, count: int) -> Iterator[tuple]:
+        offset = _HEADER.size + first_record * _RECORD.size
+        return _RECORD.iter_unpack(self._mmap[offset:offset + count * _RECORD.size])
+
+    def close(self) -> None:
+        self.flush_index()
+        self._mmap.flush()
+        self._mmap.close()
+        self._file.close()
+        self._index_file.close()
+
+
+class AvailabilityHistoryStore:
+    """
+    История наличия мест по всем опрошенным маршрутам.
+
+    Каждый опрос маршрута дописывается одним блоком записей фиксированной длины в файл текущего дня (UTC),
+    отображенный в память. Рядом с сегментом лежит индекс: маршрут -> блоки записей, по нему читается
+    история одного маршрута за период. Сегменты старше retention_days удаляются.
+
+    append вызывается из event loop, поэтому обходится без системных вызовов на каждый опрос: записи
+    копируются в отображение, а индекс дописывается в файл пачкой раз в index_flush_interval секунд
+    и при закрытии. При падении процесса теряются только записи индекса за последний интервал
+    """
+
+    def __init__(
+            self,
+            directory: str,
+            retention_days: int = 30,
+            initial_segment_capacity: int = 64 * 1024,
+            index_flush_interval: float = 5
+    ):
+        """
+        :param directory: папка с сегментами (создается, если её нет)
+        :param retention_days: сколько дней хранить историю
+        :param initial_segment_capacity: на сколько записей сразу выделяется место в новом сегменте
+        :param index_flush_interval: как часто (в секундах) дописывать индекс сегмента в файл
+        """
+        self._directory = directory
+        self._retention_days = retention_days
+        self._initial_segment_capacity = initial_segment_capacity
+        self._index_flush_interval = index_flush_interval
+
+        os.makedirs(directory, exist_ok=True)
+        self._segments: dict[datetime.date, _Segment] = dict()
+        self._current_day: Optional[datetime.date] = None
+
+    def _get_segment_path(self, day: datetime.date) -> str:
+        return os.path.join(self._directory, f'{day.isoformat()}.bin')
+
+    def _get_segment(self, day: datetime.date, create: bool = False) -> Optional[_Segment]:
+        segment = self._segments.get(day)
+        if segment is None and (create or os.path.exists(self._get_segment_path(day))):
+            segment = _Segment(
+                self._get_segment_path(day),
+                initial_capacity=self._initial_segment_capacity,
+                index_flush_interval=self._index_flush_interval
+            )
+            self._segments[day] = segment
+        return segment
+
+    def _on_new_day(self, day: datetime.date) -> None:
+        # Прошлые дни только читаются - держать их открытыми незачем
+        for segment_day in list(self._segments):
+            if segment_day != day:
+                self._segments.pop(segment_day).close()
+        self._current_day = day
+        self.apply_retention(today=day)
+
+    def append(self, route_key: RouteKey, trains: list[TrainAvailability], polled_at: Optional[float] = None) -> None:
+        """Запись результата опроса маршрута"""
+        if not trains:
+            return
+        polled_at = polled_at if polled_at is not None else time.time()
+        day = datetime.datetime.utcfromtimestamp(polled_at).date()
+        if day != self._current_day:
+            self._on_new_day(day)
+
+        from_city_id = _encode(route_key.from_city_id, 12)
+        to_city_id = _encode(route_key.to_city_id, 12)
+        date_ordinal = route_key.date.toordinal()
+        records = bytearray(len(trains) * _RECORD.size)
+        for i, train in enumerate(trains):
+            _RECORD.pack_into(
+                records,
+                i * _RECORD.size,
+                polled_at,
+                from_city_id,
+                to_city_id,
+                date_ordinal,
+                _encode(train.train_number, 12),
+                # Время отправления без часового пояса (местное) сохраняется как есть
+                int(train.departure_date.replace(tzinfo=datetime.timezone.utc).timestamp()),
+                *(min(getattr(train, seats_name), _MAX_SEATS) for _, seats_name, _ in SEAT_TYPES),
+                *(_encode_price(getattr(train, price_name)) for _, _, price_name in SEAT_TYPES)
+            )
+        self._get_segment(day, create=True).append(route_key=route_key, records=records, count=len(trains))
+
+    def scan(
+            self,
+            route_key: RouteKey,
+            since: datetime.datetime,
+            until: Optional[datetime.datetime] = None
+    ) -> Iterator[AvailabilityHistoryRecord]:
+        """История маршрута за период (время в UTC)"""
+        until = until or datetime.datetime.utcnow()
+        since_ts = since.replace(tzinfo=datetime.timezone.utc).timestamp()
+        until_ts = until.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+        day = since.date()
+        while day <= until.date():
+            segment = self._get_segment(day)
+            if segment is not None:
+                for first_record, count in segment.route_index.get(route_key, []):
+                    for polled_at, _, _, _, train_number, departure_ts, *values in segment.read(first_record, count):
+                        if not since_ts <= polled_at <= until_ts:
+                            continue
+                        yield AvailabilityHistoryRecord(
+                            polled_at=polled_at,
+                            route_key=route_key,
+                            train_number=_decode(train_number),
+                            departure_date=datetime.datetime.utcfromtimestamp(departure_ts),
+                            seats=tuple(values[:len(SEAT_TYPES)]),
+                            min_prices=tuple(_decode_price(kopecks) for kopecks in values[len(SEAT_TYPES):])
+                        )
+            day += datetime.timedelta(days=1)
+
+    def apply_retention(self, today: Optional[datetime.date] = None) -> None:
+        """Удаление сегментов старше retention_days"""
+        today = today or datetime.datetime.utcnow().date()
+        oldest_day = today - datetime.timedelta(days=self._retention_days)
+        for file_name in os.listdir(self._directory):
+            day_name, extension = os.path.splitext(file_name)
+            if extension not in ('.bin', '.idx'):
+                continue
+            try:
+                day = datetime.date.fromisoformat(day_name)
+            except ValueError:
+                continue
+            if day >= oldest_day:
+                continue
+            segment = self._segments.pop(day, None)
+            if segment is not None:
+                segment.close()
+            os.remove(os.path.join(self._directory, file_name))
+            logger.info(f'Availability history segment {file_name} removed by retention')
+
+    def close(self) -> None:
+        for segment in self._segments.values():
+            segment.close()
+        self._segments = dict()
+        self._current_day = None
@@ -0,0 +1,142 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from enum import Enum
+from typing import AsyncIterator, Optional
+
+from loguru import logger
+
+from utils.rzd_exceptions import RZDCircuitOpenException
+
+
+class CircuitState(str, Enum):
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker запросов к РЖД.
+
+    closed - запросы идут как обычно. После failure_threshold ошибок доступности подряд переходит в open:
+    запросы не отправляются (RZDCircuitOpenException) recovery_timeout секунд. Затем half-open: пропускается
+    один пробный запрос. Успех возвращает в closed, ошибка - снова в open на вдвое большее время
+    (но не больше max_recovery_timeout)
+    """
+
+    def __init__(
+            self,
+            failure_threshold: int = 10,
+            recovery_timeout: float = 15,
+            max_recovery_timeout: float = 300,
+            failure_exceptions: tuple[type[BaseException], ...] = (asyncio.TimeoutError,)
+    ):
+        """
+        :param failure_threshold: сколько ошибок доступности подряд размыкают цепь
+        :param recovery_timeout: через сколько секунд после размыкания отправить пробный запрос
+        :param max_recovery_timeout: предел роста recovery_timeout при неудачных пробных запросах (секунды)
+        :param failure_exceptions: исключения, которые считаются признаком недоступности сервера.
+        Остальные исключения означают, что сервер ответил, и считаются успехом
+        """
+        self._failure_threshold = failure_threshold
+        self._recovery_timeout = recovery_timeout
+        self._max_recovery_timeout = max_recovery_timeout
+        self._failure_exceptions = failure_exceptions
+
+        self._state = CircuitState.CLOSED
+        self._consecutive_failures = 0
+        # Сколько раз подряд не удался пробный запрос - от этого зависит время до следующего
+        self._failed_probes = 0
+        self._opened_until = 0.0
+        self._probe_in_flight = False
+        self._condition = asyncio.Condition()
+
+    @property
+    def state(self) -> CircuitState:
+        self._refresh_state(time.monotonic())
+        return self._state
+
+    def _refresh_state(self, now: float) -> None:
+        if self._state == CircuitState.OPEN and now >= self._opened_until:
+            self._state = CircuitState.HALF_OPEN
+            logger.info('RZD circuit breaker half-open: sending probe request')
+
+    def _get_wait_time(self, now: float) -> Optional[float]:
+        """Через сколько секунд можно отправить запрос (0 - сейчас, None - после пробного запроса)"""
+        self._refresh_state(now)
+        if self._state == CircuitState.OPEN:
+            return self._opened_until - now
+        if self._state == CircuitState.HALF_OPEN and self._probe_in_flight:
+            return None
+        return 0
+
+    def _open(self, now: float) -> None:
+        recovery_timeout = min(self._recovery_timeout * 2 ** self._failed_probes, self._max_recovery_timeout)
+        self._state = CircuitState.OPEN
+        self._opened_until = now + recovery_timeout
+        if self._failed_probes == 0:
+            logger.error(
+                f'Произошла ошибка подключения к серверу РЖД ({self._consecutive_failures} подряд), '
+                f'запросы приостановлены на {recovery_timeout:.0f}с'
+            )
+        else:
+            logger.warning(f'RZD probe request failed, requests paused for {recovery_timeout:.0f}s')
+
+    def _on_failure(self, is_probe: bool) -> None:
+        now = time.monotonic()
+        if is_probe:
+            self._failed_probes += 1
+            self._open(now)
+        elif self._state == CircuitState.CLOSED:
+            self._consecutive_failures += 1
+            if self._consecutive_failures >= self._failure_threshold:
+                self._open(now)
+
+    def _on_success(self, is_probe: bool) -> None:
+        if is_probe:
+            logger.info('RZD circuit breaker closed: RZD is available again')
+            self._state = CircuitState.CLOSED
+            self._failed_probes = 0
+        if self._state == CircuitState.CLOSED:
+            self._consecutive_failures = 0
+
+    async def wait_until_available(self) -> None:
+        """Ждет, пока запрос сможет пройти (цепь замкнута или можно отправить пробный запрос)"""
+        async with self._condition:
+            while True:
+                wait_time = self._get_wait_time(time.monotonic())
+                if wait_time is not None and wait_time <= 0:
+                    return
+                try:
+                    await asyncio.wait_for(self._condition.wait(), timeout=wait_time)
+                except asyncio.TimeoutError:
+                    pass
+
+    @asynccontextmanager
+    async def request(self) -> AsyncIterator[None]:
+        """Пропускает запрос или вызывает RZDCircuitOpenException. Результат блока учитывается в состоянии"""
+        now = time.monotonic()
+        wait_time = self._get_wait_time(now)
+        if wait_time is None or wait_time > 0:
+            raise RZDCircuitOpenException(retry_after=wait_time or 0)
+        is_probe = self._state == CircuitState.HALF_OPEN
+        if is_probe:
+            self._probe_in_flight = True
+
+        try:
+            yield
+        except self._failure_exceptions:
+            self._on_failure(is_probe=is_probe)
+            raise
+        except Exception:
+            # Сервер ответил, хоть и ошибкой в теле - доступность не страдает
+            self._on_success(is_probe=is_probe)
+            raise
+        else:
+            self._on_success(is_probe=is_probe)
+        finally:
+            if is_probe:
+                self._probe_in_flight = False
+            async with self._condition:
+                self._condition.notify_all()
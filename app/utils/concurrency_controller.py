@@ -0,0 +1,99 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from loguru import logger
+
+
+class AIMDConcurrencyController:
+    """
+    Адаптивный лимит параллельных запросов (AIMD).
+
+    Пока запросы проходят быстро и без ошибок, лимит растет примерно на additive_increase за каждый "круг"
+    из limit запросов. Таймаут, ответ-перегрузка или слишком долгий ответ уменьшают лимит в
+    multiplicative_decrease раз. На пачку ошибок от запросов, отправленных до последнего уменьшения,
+    лимит повторно не уменьшается
+    """
+
+    def __init__(
+            self,
+            min_limit: int = 1,
+            max_limit: int = 30,
+            initial_limit: int = 5,
+            additive_increase: float = 1,
+            multiplicative_decrease: float = 0.5,
+            latency_threshold: float = 3,
+            congestion_exceptions: tuple[type[BaseException], ...] = (asyncio.TimeoutError,)
+    ):
+        """
+        :param latency_threshold: время ответа (секунды), начиная с которого считаем, что сервер перегружен
+        :param congestion_exceptions: исключения, которые считаются признаком перегрузки сервера
+        """
+        self._min_limit = min_limit
+        self._max_limit = max_limit
+        self._additive_increase = additive_increase
+        self._multiplicative_decrease = multiplicative_decrease
+        self._latency_threshold = latency_threshold
+        self._congestion_exceptions = congestion_exceptions
+
+        self._limit: float = float(min(max(initial_limit, min_limit), max_limit))
+        self._in_flight = 0
+        self._last_decrease_at = 0.0
+        self._condition = asyncio.Condition()
+
+    @property
+    def limit(self) -> int:
+        """Текущий лимит параллельных запросов"""
+        return max(self._min_limit, int(self._limit))
+
+    @property
+    def max_limit(self) -> int:
+        return self._max_limit
+
+    @property
+    def in_flight(self) -> int:
+        """Количество запросов, выполняющихся прямо сейчас"""
+        return self._in_flight
+
+    def _set_limit(self, new_limit: float, reason: str) -> None:
+        old_limit = self.limit
+        self._limit = min(max(new_limit, self._min_limit), self._max_limit)
+        if self.limit < old_limit:
+            logger.info(f'RZD concurrency limit decreased {old_limit} -> {self.limit} ({reason})')
+        elif self.limit > old_limit:
+            logger.debug(f'RZD concurrency limit increased {old_limit} -> {self.limit}')
+
+    def _on_success(self) -> None:
+        self._set_limit(self._limit + self._additive_increase / self._limit, reason='success')
+
+    def _on_congestion(self, started_at: float, reason: str) -> None:
+        # Запросы, ушедшие до прошлого уменьшения, отражают старый лимит - на них уже отреагировали
+        if started_at < self._last_decrease_at:
+            return
+        self._last_decrease_at = time.monotonic()
+        self._set_limit(self._limit * self._multiplicative_decrease, reason=reason)
+
+    @asynccontextmanager
+    async def request(self) -> AsyncIterator[None]:
+        """Занимает место под запрос на время выполнения блока и учитывает его результат в лимите"""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+
+        started_at = time.monotonic()
+        try:
+            yield
+        except self._congestion_exceptions as exc:
+            self._on_congestion(started_at=started_at, reason=type(exc).__name__)
+            raise
+        else:
+            latency = time.monotonic() - started_at
+            if latency > self._latency_threshold:
+                self._on_congestion(started_at=started_at, reason=f'latency {latency:.2f}s')
+            else:
+                self._on_success()
+        finally:
+            self._in_flight -= 1
+            async with self._condition:
+                self._condition.notify_all()
@@ -1,13 +1,56 @@
-from typing import Union, Optional
+from typing import TYPE_CHECKING, Sequence, Union, Optional
 
-from schemas.rzd_parser import Train
+from schemas.rzd_parser import TrainAvailability
+
+if TYPE_CHECKING:
+    from models.trackings import TrackingModel
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Типы мест: (флаг отслеживания, места, цена). Порядок задает столбцы матриц filter_trains_by_trackings
+SEAT_TYPES = (
+    ('sw_enabled', 'sw_seats', 'sw_min_price'),
+    ('sid_enabled', 'sid_seats', 'sid_min_price'),
+    ('cupe_up_enabled', 'cupe_up_seats', 'cupe_min_price'),
+    ('cupe_down_enabled', 'cupe_down_seats', 'cupe_min_price'),
+    ('plaz_seats_plaz_down_enabled', 'plaz_seats_plaz_down_seats', 'plaz_min_price'),
+    ('plaz_seats_plaz_up_enabled', 'plaz_seats_plaz_up_seats', 'plaz_min_price'),
+    ('plaz_side_down_enabled', 'plaz_side_down_seats', 'plaz_min_price'),
+    ('plaz_side_up_enabled', 'plaz_side_up_seats', 'plaz_min_price'),
+)
 
 
 def check_min_price(max_price: Optional[Union[int, float]], min_price_on_train: Union[int, float]):
     return max_price is None or min_price_on_train <= max_price
 
+def get_car_types_by_tracking(
+        sw_enabled: bool,
+        sid_enabled: bool,
+
+        plaz_seats_plaz_down_enabled: bool,
+        plaz_seats_plaz_up_enabled: bool,
+        plaz_side_down_enabled: bool,
+        plaz_side_up_enabled: bool,
+        cupe_up_enabled: bool,
+        cupe_down_enabled: bool
+) -> set[str]:
+    """Типы вагонов РЖД (CarTypeName), места в которых проверяет filter_trains_by_tracking"""
+    car_types = set()
+    if sw_enabled:
+        car_types.add('СВ')
+    if sid_enabled:
+        car_types.add('СИД')
+    if cupe_up_enabled or cupe_down_enabled:
+        car_types.add('КУПЕ')
+    if plaz_seats_plaz_down_enabled or plaz_seats_plaz_up_enabled or plaz_side_down_enabled or plaz_side_up_enabled:
+        car_types.add('ПЛАЦ')
+    return car_types
+
 def filter_trains_by_tracking(
-        trains: list[Train],
+        trains: list[TrainAvailability],
         sw_enabled: bool,
         sid_enabled: bool,
 
@@ -20,7 +63,7 @@ def filter_trains_by_tracking(
         max_price: Union[int, float],
 
         min_seats: int = 1
-) -> list[Train]:
+) -> list[TrainAvailability]:
     specific_trains = []
     for train in trains:
 
@@ -50,3 +93,61 @@ def filter_trains_by_tracking(
 
     return specific_trains
 
+
+def filter_trains_by_trackings(
+        trains: list[TrainAvailability],
+        trackings: Sequence['TrackingModel'],
+        min_seats: int = 1
+) -> list[list[TrainAvailability]]:
+    """
+    То же, что filter_trains_by_tracking, но сразу для всех отслеживаний маршрута.
+    Возвращает подходящие поезда для каждого отслеживания (в порядке trackings).
+
+    С numpy все пары отслеживание x поезд проверяются одной матричной операцией:
+    места и цены поездов - матрицы (поезда x типы мест), флаги отслеживаний - маски, max_price - потолки цены
+    """
+    if np is None or len(trackings) < 2 or len(trains) == 0:
+        return [
+            filter_trains_by_tracking(
+                trains=trains,
+                max_price=tracking.max_price,
+                sw_enabled=tracking.sw_enabled,
+                sid_enabled=tracking.sid_enabled,
+                plaz_seats_plaz_down_enabled=tracking.plaz_seats_plaz_down_enabled,
+                plaz_seats_plaz_up_enabled=tracking.plaz_seats_plaz_up_enabled,
+                plaz_side_down_enabled=tracking.plaz_side_down_enabled,
+                plaz_side_up_enabled=tracking.plaz_side_up_enabled,
+                cupe_up_enabled=tracking.cupe_up_enabled,
+                cupe_down_enabled=tracking.cupe_down_enabled,
+                min_seats=min_seats
+            )
+            for tracking in trackings
+        ]
+
+    # (поезда x типы мест)
+    seats = np.array(
+        [[getattr(train, seats_name) for _, seats_name, _ in SEAT_TYPES] for train in trains],
+        dtype=np.int64
+    )
+    prices = np.array(
+        [[getattr(train, price_name) for _, _, price_name in SEAT_TYPES] for train in trains],
+        dtype=np.float64
+    )
+    # (отслеживания x типы мест) и (отслеживания,)
+    enabled = np.array(
+        [[bool(getattr(tracking, flag_name)) for flag_name, _, _ in SEAT_TYPES] for tracking in trackings],
+        dtype=bool
+    )
+    max_prices = np.array(
+        [np.inf if tracking.max_price is None else tracking.max_price for tracking in trackings],
+        dtype=np.float64
+    )
+
+    # (отслеживания x поезда x типы мест) -> (отслеживания x поезда)
+    matches = (
+            enabled[:, np.newaxis, :]
+            & (seats >= min_seats)[np.newaxis, :, :]
+            & (prices[np.newaxis, :, :] <= max_prices[:, np.newaxis, np.newaxis])
+    ).any(axis=2)
+
+    return [[trains[i] for i in np.flatnonzero(tracking_matches)] for tracking_matches in matches]
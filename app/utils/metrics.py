@@ -0,0 +1,52 @@
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+
+# Метрики регистрируются в общем реестре prometheus_client (REGISTRY, вместе с метриками процесса),
+# его отдает MetricsServer
+
+# Границы бакетов гистограмм времени (секунды)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# РЖД
+RZD_REQUEST_DURATION = Histogram(
+    'rzd_request_duration_seconds', 'Время запроса к РЖД', ('endpoint',),
+    buckets=DEFAULT_BUCKETS
+)
+RZD_RESPONSE_SIZE = Histogram(
+    'rzd_response_size_bytes', 'Размер ответа РЖД', ('endpoint',),
+    buckets=(1024, 4 * 1024, 16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024)
+)
+RZD_REQUEST_ERRORS = Counter('rzd_request_errors', 'Ошибки запросов к РЖД', ('endpoint', 'error'))
+RZD_CONCURRENCY_LIMIT = Gauge('rzd_concurrency_limit', 'Текущий лимит параллельных запросов к РЖД')
+RZD_REQUESTS_IN_FLIGHT = Gauge('rzd_requests_in_flight', 'Запросов к РЖД выполняется сейчас')
+RZD_CIRCUIT_OPEN = Gauge('rzd_circuit_open', 'Запросы к РЖД приостановлены circuit breaker (1/0)')
+RZD_QUARANTINED_ROUTES = Gauge('rzd_quarantined_routes', 'Маршрутов в карантине')
+
+# Фоновые циклы
+CYCLE_DURATION = Histogram(
+    'worker_cycle_duration_seconds', 'Длительность цикла фоновой задачи', ('cycle',),
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+)
+ROUTES_SCHEDULED = Gauge('tracking_parser_routes_scheduled', 'Маршрутов в очереди проверок')
+ROUTES_OVERDUE = Gauge('tracking_parser_routes_overdue', 'Маршрутов, время проверки которых уже подошло')
+ROUTES_IN_FLIGHT = Gauge('tracking_parser_routes_in_flight', 'Маршрутов обрабатывается сейчас')
+MAX_ROUTE_OVERDUE = Gauge(
+    'tracking_parser_max_route_overdue_seconds',
+    'На сколько секунд опаздывает проверка самого просроченного маршрута (от запланированного времени)'
+)
+ACTIVE_TRACKINGS = Gauge('tracking_parser_active_trackings', 'Активных отслеживаний этого воркера')
+
+# Уведомления
+NOTIFICATIONS_SENT = Counter('notifications_sent', 'Отправленных уведомлений о местах (по отслеживаниям)')
+NOTIFICATIONS_SUPPRESSED = Counter(
+    'notifications_suppressed', 'Уведомлений о местах, которые не отправлены', ('reason',)
+)
+NOTIFICATIONS_FLUSH_DURATION = Histogram(
+    'notifications_flush_duration_seconds', 'Время записи пачки нотификаций в БД', buckets=DEFAULT_BUCKETS
+)
+
+# Telegram
+TELEGRAM_SEND_DURATION = Histogram(
+    'telegram_send_duration_seconds', 'Время отправки сообщения Telegram', buckets=DEFAULT_BUCKETS
+)
+TELEGRAM_SEND_ERRORS = Counter('telegram_send_errors', 'Ошибки отправки сообщений Telegram', ('error',))
+TELEGRAM_QUEUE_DEPTH = Gauge('telegram_queue_depth', 'Сообщений в очереди отправки Telegram')
@@ -0,0 +1,17 @@
+import datetime
+from typing import NamedTuple
+
+
+class RouteKey(NamedTuple):
+    """Ключ маршрута, по которому один запрос к РЖД обслуживает все отслеживания на этом направлении и дате"""
+    from_city_id: str
+    to_city_id: str
+    date: datetime.date
+
+
+def get_route_key(from_city_id: str, to_city_id: str, date: datetime.date) -> RouteKey:
+    return RouteKey(
+        from_city_id=str(from_city_id).strip(),
+        to_city_id=str(to_city_id).strip(),
+        date=date
+    )
@@ -0,0 +1,68 @@
+import time
+
+from loguru import logger
+
+from utils.route_key import RouteKey
+from utils.rzd_exceptions import RZDRouteQuarantinedException
+
+
+class RouteQuarantine:
+    """
+    Карантин маршрутов, на которые РЖД раз за разом отдает неверный ответ.
+
+    После failure_threshold неверных ответов подряд маршрут не запрашивается backoff секунд, каждый следующий
+    неверный ответ удваивает время (до max_backoff). Первый верный ответ снимает маршрут с карантина
+    """
+
+    def __init__(
+            self,
+            failure_threshold: int = 3,
+            backoff: float = 60,
+            max_backoff: float = 3600
+    ):
+        """
+        :param failure_threshold: сколько неверных ответов подряд отправляют маршрут в карантин
+        :param backoff: время первого карантина (секунды)
+        :param max_backoff: предел роста времени карантина (секунды)
+        """
+        self._failure_threshold = failure_threshold
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+
+        # {маршрут: [неверных ответов подряд, до какого времени (time.monotonic) маршрут в карантине]}
+        self._routes: dict[RouteKey, list] = dict()
+
+    def __len__(self) -> int:
+        """Количество маршрутов в карантине"""
+        now = time.monotonic()
+        return sum(1 for _, quarantined_until in self._routes.values() if quarantined_until > now)
+
+    def check(self, route_key: RouteKey) -> None:
+        """Вызывает RZDRouteQuarantinedException, если маршрут сейчас в карантине"""
+        route = self._routes.get(route_key)
+        if route is None:
+            return
+        retry_after = route[1] - time.monotonic()
+        if retry_after > 0:
+            raise RZDRouteQuarantinedException(retry_after=retry_after)
+
+    def on_invalid_response(self, route_key: RouteKey) -> None:
+        route = self._routes.setdefault(route_key, [0, 0.0])
+        route[0] += 1
+        if route[0] < self._failure_threshold:
+            return
+        backoff = min(self._backoff * 2 ** (route[0] - self._failure_threshold), self._max_backoff)
+        route[1] = time.monotonic() + backoff
+        message = f'Маршрут {route_key} в карантине на {backoff:.0f}с: {route[0]} неверных ответов РЖД подряд'
+        if route[0] == self._failure_threshold:
+            logger.error(message)
+        else:
+            logger.warning(message)
+
+    def on_success(self, route_key: RouteKey) -> None:
+        if self._routes.pop(route_key, None) is not None:
+            logger.info(f'Route {route_key} released from quarantine')
+
+    def discard(self, route_key: RouteKey) -> None:
+        """Забыть маршрут, который больше не проверяется"""
+        self._routes.pop(route_key, None)
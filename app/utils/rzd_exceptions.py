@@ -0,0 +1,40 @@
+class RZDUnavailableException(Exception):
+    """Исключение вызывается, когда сервер РЖД отвечает статусом перегрузки/недоступности (429, 5xx)"""
+
+    def __init__(self, status: int):
+        self.status = status
+        super().__init__(f'РЖД ответил статусом {status}')
+
+
+class RZDInvalidResponseException(Exception):
+    """Исключение вызывается, когда РЖД ответил без списка поездов (ошибка в теле ответа)"""
+
+    def __init__(self, response_text: str):
+        self.response_text = response_text
+        super().__init__('РЖД отдал ответ без списка поездов')
+
+
+class RZDCircuitOpenException(Exception):
+    """Исключение вызывается вместо запроса, пока РЖД считается недоступным (circuit breaker разомкнут)"""
+
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f'Запросы к РЖД приостановлены, повтор через {retry_after:.0f}с')
+
+
+class RZDRouteQuarantinedException(Exception):
+    """Исключение вызывается вместо запроса маршрута, на который РЖД раз за разом отдает неверный ответ"""
+
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f'Маршрут в карантине, повтор через {retry_after:.0f}с')
+
+
+class RZDResponseNotRecordedException(Exception):
+    """Исключение вызывается при воспроизведении ответов РЖД, если для маршрута в корпусе нет записанных ответов"""
+
+    def __init__(self, route_key):
+        self.route_key = route_key
+        super().__init__(
+            f'Нет записанных ответов РЖД для {route_key.from_city_id} -> {route_key.to_city_id}, {route_key.date}'
+        )
@@ -1,32 +1,273 @@
 import asyncio
 import json
+import time
+from concurrent.futures import Executor
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Optional
+from typing import AsyncIterator, Collection, Optional
 
 from loguru import logger
 import aiohttp
 import fake_useragent
 
-from schemas.rzd_parser import City, Train
+from schemas.rzd_parser import City, TrainAvailability
+from utils import metrics, tracing
+from utils.circuit_breaker import CircuitBreaker, CircuitState
+from utils.concurrency_controller import AIMDConcurrencyController
+from utils.route_key import RouteKey, get_route_key
+from utils.route_quarantine import RouteQuarantine
+from utils.rzd_exceptions import RZDInvalidResponseException, RZDUnavailableException
+from utils.rzd_response_corpus import RecordedResponse, RZDResponseCorpus
+from utils.trains_cache import TrainsCache
+
+try:
+    # orjson разбирает ответ прямо из байт и в несколько раз быстрее json
+    import orjson
+    _loads_json = orjson.loads
+except ImportError:
+    logger.warning('orjson не установлен: ответы РЖД разбираются медленным json из стандартной библиотеки')
+    _loads_json = json.loads
+
+
+def parse_trains_response(raw_response: bytes, car_types: Optional[frozenset[str]] = None) -> list[TrainAvailability]:
+    """
+    Разбор ответа TrainPricing в список поездов.
+    Не использует состояние парсера, поэтому может выполняться в пуле потоков или процессов
+
+    :param car_types: типы вагонов (ПЛАЦ, КУПЕ, СВ, СИД), места в которых нужно посчитать.
+    Остальные группы вагонов пропускаются, места и цены в них остаются по умолчанию. None - все типы
+    """
+    with tracing.span('rzd.json_decode'):
+        response_data = _loads_json(raw_response)
+
+    if not isinstance(response_data, dict) or 'Trains' not in response_data:
+        raise RZDInvalidResponseException(response_text=raw_response[:1000].decode(errors='replace'))
+
+    try:
+        with tracing.span('rzd.build_trains'):
+            return _parse_trains(response_data['Trains'], car_types=car_types)
+    except (KeyError, TypeError, ValueError) as exc:
+        # Ответ без ожидаемых полей поезда/вагона
+        raise RZDInvalidResponseException(
+            response_text=f'{exc!r}: {raw_response[:1000].decode(errors="replace")}'
+        ) from exc
+
+
+def _parse_trains(trains_json: list[dict], car_types: Optional[frozenset[str]] = None) -> list[TrainAvailability]:
+    trains: list[TrainAvailability] = []
+
+    for train_json in trains_json:
+
+        # СВ
+        sw_seats: int = 0
+        sw_min_price: float = 9999999999999999
+
+        # Плацкарт
+        plaz_min_price: float = 9999999999999999
+        # [Плац] плацкарт нижнее:
+        plaz_seats_plaz_down_seats: int = 0
+        # [Плац] плацкарт верхнее:
+        plaz_seats_plaz_up_seats: int = 0
+        # [Плац] Боковое верхнее:
+        plaz_side_down_seats: int = 0
+        # [Плац] Боковое нижнее:
+        plaz_side_up_seats: int = 0
+
+        # Купе
+        cupe_min_price: float = 9999999999999999
+        # [Купе] Верхнее:
+        cupe_up_seats: int = 0
+        # [Купе] Нижнее:
+        cupe_down_seats: int = 0
+
+        # Сидячие места
+        sid_seats: int = 0
+        sid_min_price: float = 9999999999999999
+
+        for t in train_json['CarGroups']:
+            car_type_name = t['CarTypeName']
+            if car_types is not None and car_type_name not in car_types:
+                continue
+            if t.get('HasPlacesForDisabledPersons'):
+                continue
+            if car_type_name == 'ПЛАЦ':
+                plaz_seats_plaz_down_seats += int(t['LowerPlaceQuantity'])
+                plaz_seats_plaz_up_seats += int(t['UpperPlaceQuantity'])
+                plaz_side_down_seats += int(t['LowerSidePlaceQuantity'])
+                plaz_side_up_seats += int(t['UpperSidePlaceQuantity'])
+                plaz_min_price = min(plaz_min_price, float(t['MinPrice']))
+            elif car_type_name == 'КУПЕ':
+                cupe_up_seats += int(t['UpperPlaceQuantity'])
+                cupe_down_seats += int(t['LowerPlaceQuantity'])
+                cupe_min_price = min(cupe_min_price, float(t['MinPrice']))
+            elif car_type_name == 'СВ':
+                sw_seats += int(t['TotalPlaceQuantity'])
+                sw_min_price = min(sw_min_price, float(t['MinPrice']))
+            elif car_type_name == 'СИД':
+                sid_seats += int(t['PlaceQuantity'])
+                sid_min_price = min(sid_min_price, float(t['MinPrice']))
+
+        trains.append(
+            TrainAvailability(
+                train_number=train_json['DisplayTrainNumber'],
+                departure_date=datetime.fromisoformat(train_json['DepartureDateTime']),
+                arrival_date=datetime.fromisoformat(train_json['ArrivalDateTime']),
+                from_city_id=train_json['OriginStationCode'],
+                from_city_name=train_json['OriginName'],
+                to_city_id=train_json['DestinationStationCode'],
+                to_city_name=train_json['DestinationName'],
+
+                sw_seats=sw_seats,
+                sw_min_price=sw_min_price,
+
+                plaz_min_price=plaz_min_price,
+                plaz_seats_plaz_down_seats=plaz_seats_plaz_down_seats,
+                plaz_seats_plaz_up_seats=plaz_seats_plaz_up_seats,
+                plaz_side_down_seats=plaz_side_down_seats,
+                plaz_side_up_seats=plaz_side_up_seats,
+
+                cupe_min_price=cupe_min_price,
+                cupe_down_seats=cupe_down_seats,
+                cupe_up_seats=cupe_up_seats,
+
+                sid_seats=sid_seats,
+                sid_min_price=sid_min_price
+            ))
+    return trains
 
 
 class RZDParser:
+    def __init__(
+            self,
+            trains_cache: Optional[TrainsCache] = None,
+            concurrency_controller: Optional[AIMDConcurrencyController] = None,
+            request_timeout: float = 5,
+            connect_timeout: float = 5,
+            connections_limit: int = 100,
+            connections_limit_per_host: int = 30,
+            dns_cache_ttl: int = 300,
+            keepalive_timeout: float = 30,
+            parse_executor: Optional[Executor] = None,
+            parse_offload_threshold: int = 64 * 1024,
+            circuit_breaker: Optional[CircuitBreaker] = None,
+            route_quarantine: Optional[RouteQuarantine] = None,
+            base_url: str = 'https://ticket.rzd.ru',
+            record_corpus: Optional[RZDResponseCorpus] = None,
+            replay_corpus: Optional[RZDResponseCorpus] = None
+    ):
+        """
+        Клиент держит одну сессию с пулом keep-alive соединений на всё время жизни процесса.
+        Сессия создается при первом запросе, закрывать её нужно через close() (или async with)
+
+        :param trains_cache: кэш результатов get_trains. Если не передан, каждый вызов идет в РЖД
+        :param concurrency_controller: адаптивный лимит параллельных запросов поездов к РЖД
+        :param request_timeout: таймаут на весь запрос (секунды)
+        :param connect_timeout: таймаут на установку соединения (секунды)
+        :param connections_limit: общее количество соединений в пуле
+        :param connections_limit_per_host: количество соединений в пуле на один хост
+        :param dns_cache_ttl: время кэширования DNS-ответов (секунды)
+        :param keepalive_timeout: сколько держать простаивающее соединение открытым (секунды)
+        :param parse_executor: пул потоков/процессов для разбора больших ответов с поездами вне event loop.
+        Если не передан, ответы разбираются в event loop. Закрывает пул вызывающий код
+        :param parse_offload_threshold: размер ответа (байты), начиная с которого разбор уходит в parse_executor
+        :param circuit_breaker: приостановка запросов поездов, пока РЖД недоступен
+        :param route_quarantine: карантин маршрутов, на которые РЖД отдает неверный ответ
+        :param base_url: адрес API РЖД (другой - например, для локального имитатора РЖД в бенчмарке)
+        :param record_corpus: корпус, в который записываются ответы TrainPricing
+        :param replay_corpus: корпус, из которого отдаются записанные ответы TrainPricing вместо запросов к РЖД
+        """
+        if record_corpus is not None and replay_corpus is not None:
+            raise ValueError('Нельзя одновременно записывать и воспроизводить ответы РЖД')
+        self._trains_cache = trains_cache
+        self._concurrency_controller = concurrency_controller
+
+        self._request_timeout = request_timeout
+        self._connect_timeout = connect_timeout
+        self._connections_limit = connections_limit
+        self._connections_limit_per_host = connections_limit_per_host
+        self._dns_cache_ttl = dns_cache_ttl
+        self._keepalive_timeout = keepalive_timeout
+
+        self._parse_executor = parse_executor
+        self._parse_offload_threshold = parse_offload_threshold
+
+        self._circuit_breaker = circuit_breaker
+        self._route_quarantine = route_quarantine
+
+        if concurrency_controller is not None:
+            metrics.RZD_CONCURRENCY_LIMIT.set_function(lambda: concurrency_controller.limit)
+            metrics.RZD_REQUESTS_IN_FLIGHT.set_function(lambda: concurrency_controller.in_flight)
+        if circuit_breaker is not None:
+            metrics.RZD_CIRCUIT_OPEN.set_function(lambda: circuit_breaker.state != CircuitState.CLOSED)
+        if route_quarantine is not None:
+            metrics.RZD_QUARANTINED_ROUTES.set_function(lambda: len(route_quarantine))
+
+        self._record_corpus = record_corpus
+        self._replay_corpus = replay_corpus
+
+        self._base_url = base_url
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self._connections_limit,
+                limit_per_host=self._connections_limit_per_host,
+                ttl_dns_cache=self._dns_cache_ttl,
+                keepalive_timeout=self._keepalive_timeout
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers={
+                    'User-Agent': fake_useragent.UserAgent().random,
+                    'Origin': 'https://ticket.rzd.ru',
+                    'Referer': 'https://ticket.rzd.ru'
+                },
+                # Host берется из base_url
+                base_url=self._base_url,
+                timeout=aiohttp.ClientTimeout(total=self._request_timeout, connect=self._connect_timeout)
+            )
+        return self._session
+
+    async def wait_until_available(self) -> None:
+        """Ждет, пока запросы поездов к РЖД не приостановлены circuit breaker'ом"""
+        if self._circuit_breaker is not None:
+            await self._circuit_breaker.wait_until_available()
+
+    def forget_route(self, route_key: RouteKey) -> None:
+        """Удаление состояния маршрута, который больше не будет запрашиваться (карантин)"""
+        if self._route_quarantine is not None:
+            self._route_quarantine.discard(route_key)
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        if self._record_corpus is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self._record_corpus.close)
+
+    async def __aenter__(self) -> 'RZDParser':
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self.close()
+
     @staticmethod
-    def _get_new_session() -> aiohttp.ClientSession:
-        return aiohttp.ClientSession(
-            headers={
-                'User-Agent': fake_useragent.UserAgent().random,
-                'Origin': 'https://ticket.rzd.ru',
-                'Host': 'ticket.rzd.ru',
-                'Referer': 'https://ticket.rzd.ru'
-            },
-            base_url='https://ticket.rzd.ru',
-            timeout=aiohttp.ClientTimeout(total=5, connect=5)
-        )
+    @asynccontextmanager
+    async def _measure_request(endpoint: str) -> AsyncIterator[None]:
+        """Время запроса и ошибки по endpoint в метриках, запрос - этап текущей трассы"""
+        started_at = time.monotonic()
+        try:
+            with tracing.span(f'rzd.{endpoint}'):
+                yield
+        except Exception as exc:
+            metrics.RZD_REQUEST_ERRORS.labels(endpoint=endpoint, error=type(exc).__name__).inc()
+            raise
+        metrics.RZD_REQUEST_DURATION.labels(endpoint=endpoint).observe(time.monotonic() - started_at)
 
     async def get_cities_by_query(self, query: str) -> list[City]:
-        async with self._get_new_session() as session:
-            response = await session.get(
+        session = self._get_session()
+        async with self._measure_request('suggests'), session.get(
                 url='/api/v1/suggests',
                 params={
                     'Query': query,
@@ -35,13 +276,14 @@ class RZDParser:
                     'RailwaySortPriority': 'true',
                     'MergeSuburban': 'true'
                 }
-            )
+        ) as response:
             response_text = await response.text()
-            logger.debug(
-                f'Запрос к api/v1/suggests. Query: "{query}"; \n'
-                f'Ответ: "{response_text[:150]}..."'
-            )
-            response_data = json.loads(response_text)
+        metrics.RZD_RESPONSE_SIZE.labels(endpoint='suggests').observe(len(response_text.encode()))
+        logger.debug(
+            f'Запрос к api/v1/suggests. Query: "{query}"; \n'
+            f'Ответ: "{response_text[:150]}..."'
+        )
+        response_data = json.loads(response_text)
 
         if len(response_data) == 0:
             return []
@@ -53,120 +295,144 @@ class RZDParser:
             self,
             from_city_id: str,
             to_city_id: str,
-            date: datetime.date
-    ) -> list[Train]:
-        async with self._get_new_session() as session:
-            response = await session.post(
-                url='/apib2b/p/Railway/V1/Search/TrainPricing?service_provider=B2B_RZD',
-                json={
-                    "Origin": from_city_id,
-                    "Destination": to_city_id,
-                    "DepartureDate": date.isoformat(),
-                    "TimeFrom": 0,
-                    "TimeTo": 24,
-                    "CarGrouping": "DontGroup",
-                    "GetByLocalTime": True,
-                    "SpecialPlacesDemand": "StandardPlacesAndForDisabledPersons",
-                    "CarIssuingType": "PassengersAndBaggage"
-                }
+            date: datetime.date,
+            car_types: Optional[Collection[str]] = None
+    ) -> list[TrainAvailability]:
+        """
+        :param car_types: типы вагонов, которые нужны вызывающему (см. parse_trains_response).
+        В поездах, полученных с car_types, места в остальных типах вагонов не посчитаны. None - все типы.
+        При общем redis-кэше car_types не учитывается: результат нужен и другим процессам
+        """
+        if car_types is not None:
+            car_types = frozenset(car_types)
+        if self._trains_cache is not None and self._trains_cache.is_shared:
+            # В общий кэш попадают только поезда со всеми типами вагонов - иначе бот его не увидит
+            car_types = None
+        if self._trains_cache is None:
+            return await self._fetch_trains(
+                from_city_id=from_city_id, to_city_id=to_city_id, date=date, car_types=car_types
             )
-            response_text = await response.text()
-            logger.debug(
-                f'Запрос к /apib2b/p/Railway/V1/Search/TrainPricing?service_provider=B2B_RZD; \n'
-                f'Ответ: "{response_text[:150]}..."'
-            )
-            response_data = json.loads(response_text)
-
-        if 'Trains' not in response_data:
-            logger.error(f'Ржд отдал неверный ответ: {response_data}')
-
-        trains: list[Train] = []
-
-        for train_json in response_data['Trains']:
-
-            # СВ
-            sw_seats: int = 0
-            sw_min_price: float = 9999999999999999
-
-            # Плацкарт
-            plaz_min_price: float = 9999999999999999
-            # [Плац] плацкарт нижнее:
-            plaz_seats_plaz_down_seats: int = 0
-            # [Плац] плацкарт верхнее:
-            plaz_seats_plaz_up_seats: int = 0
-            # [Плац] Боковое верхнее:
-            plaz_side_down_seats: int = 0
-            # [Плац] Боковое нижнее:
-            plaz_side_up_seats: int = 0
-
-            # Купе
-            cupe_min_price: float = 9999999999999999
-            # [Купе] Верхнее:
-            cupe_up_seats: int = 0
-            # [Купе] Нижнее:
-            cupe_down_seats: int = 0
-
-            # Сидячие места
-            sid_seats: int = 0
-            sid_min_price: float = 9999999999999999
-
-            for t in train_json['CarGroups']:
-                if t.get('HasPlacesForDisabledPersons'):
-                    continue
-                if t['CarTypeName'] == 'ПЛАЦ':
-                    plaz_seats_plaz_down_seats += int(t['LowerPlaceQuantity'])
-                    plaz_seats_plaz_up_seats += int(t['UpperPlaceQuantity'])
-                    plaz_side_down_seats += int(t['LowerSidePlaceQuantity'])
-                    plaz_side_up_seats += int(t['UpperSidePlaceQuantity'])
-                    plaz_min_price = min(plaz_min_price, float(t['MinPrice']))
-                elif t['CarTypeName'] == 'КУПЕ':
-                    cupe_up_seats += int(t['UpperPlaceQuantity'])
-                    cupe_down_seats += int(t['LowerPlaceQuantity'])
-                    cupe_min_price = min(cupe_min_price, float(t['MinPrice']))
-                elif t['CarTypeName'] == 'СВ':
-                    sw_seats += int(t['TotalPlaceQuantity'])
-                    sw_min_price = min(sw_min_price, float(t['MinPrice']))
-                elif t['CarTypeName'] == 'СИД':
-                    sid_seats += int(t['PlaceQuantity'])
-                    sid_min_price = min(sid_min_price, float(t['MinPrice']))
-
-            trains.append(
-                Train(
-                    DisplayTrainNumber=train_json['DisplayTrainNumber'],
-                    DepartureDateTime=train_json['DepartureDateTime'],
-                    ArrivalDateTime=train_json['ArrivalDateTime'],
-                    OriginStationCode=train_json['OriginStationCode'],
-                    OriginName=train_json['OriginName'],
-                    DestinationStationCode=train_json['DestinationStationCode'],
-                    DestinationName=train_json['DestinationName'],
-
-                    sw_seats=sw_seats,
-                    sw_min_price=sw_min_price,
-
-                    plaz_min_price=plaz_min_price,
-                    plaz_seats_plaz_down_seats=plaz_seats_plaz_down_seats,
-                    plaz_seats_plaz_up_seats=plaz_seats_plaz_up_seats,
-                    plaz_side_down_seats=plaz_side_down_seats,
-                    plaz_side_up_seats=plaz_side_up_seats,
-
-                    cupe_min_price=cupe_min_price,
-                    cupe_down_seats=cupe_down_seats,
-                    cupe_up_seats=cupe_up_seats,
-
-                    sid_seats=sid_seats,
-                    sid_min_price=sid_min_price
-                ))
+        return await self._trains_cache.get_or_fetch(
+            route_key=get_route_key(from_city_id=from_city_id, to_city_id=to_city_id, date=date),
+            fetch=lambda: self._fetch_trains(
+                from_city_id=from_city_id, to_city_id=to_city_id, date=date, car_types=car_types
+            ),
+            car_types=car_types
+        )
+
+    async def _fetch_trains(
+            self,
+            from_city_id: str,
+            to_city_id: str,
+            date: datetime.date,
+            car_types: Optional[frozenset[str]] = None
+    ) -> list[TrainAvailability]:
+        route_key = get_route_key(from_city_id=from_city_id, to_city_id=to_city_id, date=date)
+        if self._route_quarantine is not None:
+            self._route_quarantine.check(route_key)
+        try:
+            if self._circuit_breaker is None:
+                trains = await self._request_trains_with_concurrency_limit(
+                    from_city_id=from_city_id, to_city_id=to_city_id, date=date, car_types=car_types
+                )
+            else:
+                # Разомкнутый breaker отказывает сразу, не занимая место в лимите параллельных запросов
+                async with self._circuit_breaker.request():
+                    trains = await self._request_trains_with_concurrency_limit(
+                        from_city_id=from_city_id, to_city_id=to_city_id, date=date, car_types=car_types
+                    )
+        except RZDInvalidResponseException:
+            if self._route_quarantine is not None:
+                self._route_quarantine.on_invalid_response(route_key)
+            raise
+        if self._route_quarantine is not None:
+            self._route_quarantine.on_success(route_key)
         return trains
 
+    async def _request_trains_with_concurrency_limit(
+            self,
+            from_city_id: str,
+            to_city_id: str,
+            date: datetime.date,
+            car_types: Optional[frozenset[str]] = None
+    ) -> list[TrainAvailability]:
+        if self._concurrency_controller is None:
+            return await self._request_trains(
+                from_city_id=from_city_id, to_city_id=to_city_id, date=date, car_types=car_types
+            )
+        async with self._concurrency_controller.request():
+            return await self._request_trains(
+                from_city_id=from_city_id, to_city_id=to_city_id, date=date, car_types=car_types
+            )
+
+    async def _request_trains(
+            self,
+            from_city_id: str,
+            to_city_id: str,
+            date: datetime.date,
+            car_types: Optional[frozenset[str]] = None
+    ) -> list[TrainAvailability]:
+        request_data = {
+            "Origin": from_city_id,
+            "Destination": to_city_id,
+            "DepartureDate": date.isoformat(),
+            "TimeFrom": 0,
+            "TimeTo": 24,
+            "CarGrouping": "DontGroup",
+            "GetByLocalTime": True,
+            "SpecialPlacesDemand": "StandardPlacesAndForDisabledPersons",
+            "CarIssuingType": "PassengersAndBaggage"
+        }
+        route_key = get_route_key(from_city_id=from_city_id, to_city_id=to_city_id, date=date)
+        async with self._measure_request('train_pricing'):
+            status, raw_response = await self._send_trains_request(route_key=route_key, request_data=request_data)
+            if status == 429 or status >= 500:
+                raise RZDUnavailableException(status=status)
+        metrics.RZD_RESPONSE_SIZE.labels(endpoint='train_pricing').observe(len(raw_response))
+        logger.debug(
+            f'Запрос к /apib2b/p/Railway/V1/Search/TrainPricing?service_provider=B2B_RZD; \n'
+            f'Ответ: "{raw_response[:150].decode(errors="replace")}..."'
+        )
+        try:
+            if self._parse_executor is not None and len(raw_response) >= self._parse_offload_threshold:
+                # В пуле этапы разбора не замеряются - замеряем разбор целиком вместе с передачей в пул
+                with tracing.span('rzd.parse_in_executor'):
+                    return await asyncio.get_running_loop().run_in_executor(
+                        self._parse_executor, parse_trains_response, raw_response, car_types
+                    )
+            return parse_trains_response(raw_response, car_types=car_types)
+        except RZDInvalidResponseException as exc:
+            logger.warning(f'Ржд отдал неверный ответ ({from_city_id} -> {to_city_id}, {date}): {exc.response_text}')
+            raise
+
+    async def _send_trains_request(self, route_key: RouteKey, request_data: dict) -> RecordedResponse:
+        """Статус и тело ответа TrainPricing: от РЖД или из корпуса при воспроизведении"""
+        if self._replay_corpus is not None:
+            return await self._replay_corpus.get_response(route_key)
+
+        session = self._get_session()
+        async with session.post(
+                url='/apib2b/p/Railway/V1/Search/TrainPricing?service_provider=B2B_RZD',
+                json=request_data
+        ) as response:
+            recorded_response = RecordedResponse(status=response.status, body=await response.read())
+        if self._record_corpus is not None:
+            self._record_corpus.record(
+                route_key=route_key,
+                request_data=request_data,
+                status=recorded_response.status,
+                body=recorded_response.body
+            )
+        return recorded_response
 
-async def main():
-    parser = RZDParser()
 
-    data = await parser.get_trains(
-        from_city_id='2060600',
-        to_city_id='2060000',
-        date=datetime.fromisoformat('2024-05-13T00:00:00')
-    )
+async def main():
+    async with RZDParser() as parser:
+        data = await parser.get_trains(
+            from_city_id='2060600',
+            to_city_id='2060000',
+            date=datetime.fromisoformat('2024-05-13T00:00:00')
+        )
     from pprint import pprint
     for t in data:
         print(t)
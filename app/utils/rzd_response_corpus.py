@@ -0,0 +1,121 @@
+import asyncio
+import datetime
+import gzip
+import itertools
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterator, NamedTuple, Optional
+
+from loguru import logger
+
+from utils.route_key import RouteKey, get_route_key
+from utils.rzd_exceptions import RZDResponseNotRecordedException
+
+
+class RecordedResponse(NamedTuple):
+    status: int
+    body: bytes
+
+
+class RZDResponseCorpus:
+    """
+    Корпус записанных ответов TrainPricing на диске.
+
+    Ответы одного маршрута и даты лежат в одном файле <from_city_id>-<to_city_id>/<date>.jsonl.gz,
+    по строке JSON на запрос: время записи, тело запроса, статус и тело ответа байт в байт.
+    Путь к файлу и есть индекс: ответы маршрута находятся без чтения остального корпуса.
+
+    При записи каждый ответ дописывается к файлу отдельным gzip-блоком в фоновом потоке.
+    При воспроизведении файл маршрута читается при первом обращении, записанные ответы отдаются по кругу
+    в порядке записи - одинаковые запросы получают одинаковые ответы при каждом прогоне
+    """
+
+    def __init__(self, path: str, record_interval: float = 0):
+        """
+        :param path: папка корпуса
+        :param record_interval: ответы одного маршрута записываются не чаще (секунды), чтобы воркер
+        с частыми проверками не раздувал корпус одинаковыми ответами. 0 - записывается каждый ответ
+        """
+        self._path = Path(path)
+        self._record_interval = record_interval
+        self._last_recorded_at: dict[RouteKey, float] = dict()
+        self._write_executor: Optional[ThreadPoolExecutor] = None
+
+        self._responses: dict[RouteKey, list[RecordedResponse]] = dict()
+        self._cursors: dict[RouteKey, Iterator[RecordedResponse]] = dict()
+
+    def _get_route_path(self, route_key: RouteKey) -> Path:
+        return self._path / f'{route_key.from_city_id}-{route_key.to_city_id}' / f'{route_key.date.isoformat()}.jsonl.gz'
+
+    def get_routes(self) -> list[RouteKey]:
+        """Маршруты и даты, для которых есть записанные ответы"""
+        routes = []
+        for route_path in sorted(self._path.glob('*-*/*.jsonl.gz')):
+            from_city_id, to_city_id = route_path.parent.name.split('-', 1)
+            routes.append(get_route_key(
+                from_city_id=from_city_id,
+                to_city_id=to_city_id,
+                date=datetime.date.fromisoformat(route_path.name.split('.', 1)[0])
+            ))
+        return routes
+
+    def record(self, route_key: RouteKey, request_data: dict, status: int, body: bytes) -> None:
+        """Ставит ответ в очередь на запись (не блокирует event loop)"""
+        now = time.monotonic()
+        last_recorded_at = self._last_recorded_at.get(route_key)
+        if last_recorded_at is not None and now - last_recorded_at < self._record_interval:
+            return
+        self._last_recorded_at[route_key] = now
+
+        if self._write_executor is None:
+            # Один поток - записи в файл маршрута не перемешиваются
+            self._write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rzd-corpus')
+        self._write_executor.submit(self._write, route_key, request_data, status, body)
+
+    def _write(self, route_key: RouteKey, request_data: dict, status: int, body: bytes) -> None:
+        record = {
+            'recorded_at': datetime.datetime.utcnow().isoformat(),
+            'request': request_data,
+            'status': status,
+            # surrogateescape сохраняет и байты, которые не являются UTF-8
+            'response': body.decode(errors='surrogateescape')
+        }
+        route_path = self._get_route_path(route_key)
+        try:
+            route_path.parent.mkdir(parents=True, exist_ok=True)
+            with gzip.open(route_path, 'ab') as file:
+                file.write(json.dumps(record, ensure_ascii=True).encode() + b'\n')
+        except OSError:
+            logger.exception(f'Не удалось записать ответ РЖД в корпус: {route_path}')
+
+    def _read(self, route_key: RouteKey) -> list[RecordedResponse]:
+        route_path = self._get_route_path(route_key)
+        if not route_path.exists():
+            return []
+        with gzip.open(route_path, 'rb') as file:
+            return [
+                RecordedResponse(status=record['status'], body=record['response'].encode(errors='surrogateescape'))
+                for record in map(json.loads, file)
+            ]
+
+    async def get_response(self, route_key: RouteKey) -> RecordedResponse:
+        """Следующий записанный ответ маршрута или RZDResponseNotRecordedException"""
+        cursor = self._cursors.get(route_key)
+        if cursor is None:
+            responses = self._responses.get(route_key)
+            if responses is None:
+                responses = await asyncio.get_running_loop().run_in_executor(None, self._read, route_key)
+                # Пока файл читался, его мог прочитать параллельный запрос того же маршрута
+                responses = self._responses.setdefault(route_key, responses)
+            if not responses:
+                raise RZDResponseNotRecordedException(route_key=route_key)
+            cursor = self._cursors.setdefault(route_key, itertools.cycle(responses))
+        return next(cursor)
+
+    def close(self) -> None:
+        """Дожидается записи ответов из очереди"""
+        if self._write_executor is not None:
+            self._write_executor.shutdown(wait=True)
+            self._write_executor = None
@@ -0,0 +1,252 @@
+import asyncio
+import datetime
+import heapq
+import itertools
+import time
+from enum import IntEnum
+from typing import Any, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import Chat, Message
+from loguru import logger
+
+from utils import metrics
+
+
+class MessagePriority(IntEnum):
+    """Чем меньше значение, тем раньше сообщение уходит из очереди"""
+    SEATS_ALERT = 0
+    TRACKING_CLOSED = 1
+    SUBSCRIPTION_REMINDER = 2
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        """
+        :param rate: сколько токенов добавляется в секунду
+        :param capacity: максимальное количество токенов (размер всплеска)
+        """
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated_at) * self._rate)
+        self._updated_at = now
+
+    def get_wait_time(self, now: float) -> float:
+        """Через сколько секунд можно будет взять токен"""
+        self._refill(now)
+        return max(self._paused_until - now, (1 - self._tokens) / self._rate, 0)
+
+    def set_rate(self, rate: float, capacity: float) -> None:
+        """Новый лимит: уже накопленные токены сохраняются, но не больше нового capacity"""
+        self._refill(time.monotonic())
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = min(self._tokens, capacity)
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self._tokens -= 1
+
+    def pause(self, seconds: float) -> None:
+        """Запрет брать токены на seconds секунд (ответ RetryAfter)"""
+        now = time.monotonic()
+        self._refill(now)
+        self._tokens = min(self._tokens, 0)
+        self._paused_until = max(self._paused_until, now + seconds)
+
+    def is_idle(self, now: float) -> bool:
+        """Полный и не на паузе - такой можно удалить и создать заново без потери состояния"""
+        self._refill(now)
+        return self._tokens >= self._capacity and now >= self._paused_until
+
+
+class TelegramSender:
+    """
+    Общая очередь исходящих сообщений воркера.
+
+    Соблюдает глобальный лимит Telegram и лимит на один чат (token bucket), при ответе RetryAfter ставит чат
+    на паузу и повторяет отправку. Из очереди первым уходит сообщение с наивысшим приоритетом, чат которого
+    сейчас не ограничен: уведомления о местах не ждут напоминаний о подписке.
+
+    С dry_run сообщения проходят очередь и лимиты, но в Telegram не отправляются, а только логируются
+    (например, при воспроизведении записанных ответов РЖД, чтобы пользователи не получали уведомления)
+    """
+
+    def __init__(
+            self,
+            bot: Bot,
+            global_rate: float = 25,
+            chat_rate: float = 1,
+            chat_burst: float = 3,
+            max_retries: int = 3,
+            dry_run: bool = False
+    ):
+        """
+        :param global_rate: сообщений в секунду на всего бота
+        :param chat_rate: сообщений в секунду в один чат
+        :param chat_burst: сколько сообщений подряд можно отправить в чат, не дожидаясь chat_rate
+        :param max_retries: сколько раз повторять сообщение после RetryAfter
+        :param dry_run: не отправлять сообщения в Telegram. Вместо отправленного сообщения отдается
+        сообщение с message_id=0
+        """
+        self._bot = bot
+        self._dry_run = dry_run
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._max_retries = max_retries
+
+        self._global_bucket = TokenBucket(rate=global_rate, capacity=global_rate)
+        self._chat_buckets: dict[int, TokenBucket] = dict()
+        # [приоритет, порядковый номер, chat_id, параметры send_message, future, количество повторов]
+        self._queue: list[list] = []
+        self._counter = itertools.count()
+        self._condition = asyncio.Condition()
+        self._send_tasks: set[asyncio.Task] = set()
+
+        metrics.TELEGRAM_QUEUE_DEPTH.set_function(lambda: len(self._queue))
+
+    @property
+    def bot(self) -> Bot:
+        return self._bot
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def set_global_rate(self, global_rate: float) -> None:
+        """
+        Новый лимит сообщений в секунду на всего бота.
+        При шардировании у каждого воркера своя очередь, и общий лимит Telegram делится между воркерами
+        """
+        # Всплеск не меньше одного сообщения - иначе токен для отправки никогда не накопится
+        self._global_bucket.set_rate(rate=global_rate, capacity=max(global_rate, 1))
+        logger.info(f'Telegram global rate set to {global_rate:.2f} messages/s')
+
+    def _get_chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(rate=self._chat_rate, capacity=self._chat_burst)
+        return bucket
+
+    async def _push(self, entry: list) -> None:
+        heapq.heappush(self._queue, entry)
+        async with self._condition:
+            self._condition.notify_all()
+
+    async def send_message(
+            self,
+            chat_id: int,
+            text: str,
+            priority: MessagePriority = MessagePriority.SUBSCRIPTION_REMINDER,
+            **kwargs: Any
+    ) -> Message:
+        """Ставит сообщение в очередь и ждет его отправки. Параметры - как у Bot.send_message"""
+        future = asyncio.get_running_loop().create_future()
+        await self._push([priority, next(self._counter), chat_id, dict(text=text, **kwargs), future, 0])
+        return await future
+
+    def _pop_ready(self) -> tuple[Optional[list], Optional[float]]:
+        """Сообщение, которое можно отправить сейчас, либо через сколько секунд проверить очередь снова"""
+        now = time.monotonic()
+        global_wait_time = self._global_bucket.get_wait_time(now)
+        if global_wait_time > 0:
+            return None, global_wait_time if self._queue else None
+
+        skipped = []
+        ready_entry = None
+        wait_time: Optional[float] = None
+        while self._queue:
+            entry = heapq.heappop(self._queue)
+            if entry[4].done():
+                # Ожидающий отменил отправку
+                continue
+            chat_wait_time = self._get_chat_bucket(entry[2]).get_wait_time(now)
+            if chat_wait_time <= 0:
+                ready_entry = entry
+                break
+            skipped.append(entry)
+            wait_time = chat_wait_time if wait_time is None else min(wait_time, chat_wait_time)
+        for entry in skipped:
+            heapq.heappush(self._queue, entry)
+
+        if ready_entry is not None:
+            self._global_bucket.take(now)
+            self._get_chat_bucket(ready_entry[2]).take(now)
+        return ready_entry, wait_time
+
+    @staticmethod
+    def _get_dry_run_message(chat_id: int, text: str) -> Message:
+        logger.info(f'Telegram dry run: message to chat {chat_id} is not sent ({len(text)} chars)')
+        return Message(
+            message_id=0,
+            date=datetime.datetime.utcnow(),
+            chat=Chat(id=chat_id, type='private'),
+            text=text
+        )
+
+    async def _send(self, entry: list) -> None:
+        _, _, chat_id, params, future, retries = entry
+        started_at = time.monotonic()
+        try:
+            if self._dry_run:
+                message = self._get_dry_run_message(chat_id=chat_id, text=params['text'])
+            else:
+                message = await self._bot.send_message(chat_id=chat_id, **params)
+            metrics.TELEGRAM_SEND_DURATION.observe(time.monotonic() - started_at)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except TelegramRetryAfter as exc:
+            metrics.TELEGRAM_SEND_ERRORS.labels(error=type(exc).__name__).inc()
+            self._get_chat_bucket(chat_id).pause(exc.retry_after)
+            if retries < self._max_retries:
+                logger.warning(f'Telegram RetryAfter {exc.retry_after}s for chat {chat_id}, message requeued')
+                entry[5] += 1
+                await self._push(entry)
+            elif not future.done():
+                future.set_exception(exc)
+        except Exception as exc:
+            metrics.TELEGRAM_SEND_ERRORS.labels(error=type(exc).__name__).inc()
+            if not future.done():
+                future.set_exception(exc)
+        else:
+            if not future.done():
+                future.set_result(message)
+
+        if len(self._chat_buckets) > 1000:
+            now = time.monotonic()
+            for idle_chat_id in [chat_id for chat_id, bucket in self._chat_buckets.items() if bucket.is_idle(now)]:
+                del self._chat_buckets[idle_chat_id]
+
+    async def start(self):
+        logger.info('Background TelegramSender started')
+        try:
+            while True:
+                async with self._condition:
+                    entry, wait_time = self._pop_ready()
+                    while entry is None:
+                        try:
+                            await asyncio.wait_for(self._condition.wait(), timeout=wait_time)
+                        except asyncio.TimeoutError:
+                            pass
+                        entry, wait_time = self._pop_ready()
+                # Отправка не держит очередь: следующие сообщения уходят, пока ждем ответа Telegram
+                task = asyncio.create_task(self._send(entry))
+                self._send_tasks.add(task)
+                task.add_done_callback(self._send_tasks.discard)
+        finally:
+            await self.stop()
+
+    async def stop(self):
+        """Отмена неотправленных сообщений"""
+        for task in list(self._send_tasks):
+            task.cancel()
+        await asyncio.gather(*self._send_tasks, return_exceptions=True)
+        for entry in self._queue:
+            entry[4].cancel()
+        self._queue = []
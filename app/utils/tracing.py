@@ -0,0 +1,173 @@
+import collections
+import contextvars
+import random
+import secrets
+import time
+from contextlib import contextmanager
+from typing import Iterable, Iterator, NamedTuple, Optional, Protocol
+
+from loguru import logger
+
+
+class Span(NamedTuple):
+    name: str
+    # Смещение начала от начала трассы и длительность (секунды)
+    offset: float
+    duration: float
+
+
+class Trace:
+    """
+    Замеры этапов одной операции (например, обработки маршрута).
+    links - id трасс, из которых операция выросла (например, маршруты, уведомления которых ушли одной пачкой)
+    """
+
+    __slots__ = (
+        'trace_id', 'name', 'attributes', 'links', 'started_at', 'duration', 'spans', '_started_at_monotonic'
+    )
+
+    def __init__(self, name: str, attributes: dict[str, str], links: Optional[list[str]] = None):
+        self.trace_id = secrets.token_hex(8)
+        self.name = name
+        self.attributes = attributes
+        self.links = links or []
+        self.started_at = time.time()
+        self.duration = 0.0
+        self.spans: list[Span] = []
+        self._started_at_monotonic = time.monotonic()
+
+    def get_stage_durations(self) -> dict[str, tuple[float, int]]:
+        """{этап: (суммарная длительность, количество замеров)}"""
+        stages: dict[str, tuple[float, int]] = dict()
+        for span in self.spans:
+            duration, count = stages.get(span.name, (0.0, 0))
+            stages[span.name] = (duration + span.duration, count + 1)
+        return stages
+
+    def to_dict(self) -> dict:
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'attributes': self.attributes,
+            'links': self.links,
+            'started_at': self.started_at,
+            'duration': self.duration,
+            'spans': [span._asdict() for span in self.spans]
+        }
+
+
+class TraceExporter(Protocol):
+    def export(self, trace: Trace) -> None:
+        ...
+
+
+class LogTraceExporter:
+    """Трасса одной строкой в лог: этапы с суммарной длительностью"""
+
+    def __init__(self, min_duration: float = 0):
+        """
+        :param min_duration: трассы короче (секунды) не логируются
+        """
+        self._min_duration = min_duration
+
+    def export(self, trace: Trace) -> None:
+        if trace.duration < self._min_duration:
+            return
+        stages = ', '.join(
+            f'{name}={duration * 1000:.1f}ms' + (f' (x{count})' if count > 1 else '')
+            for name, (duration, count) in trace.get_stage_durations().items()
+        )
+        attributes = ' '.join(f'{name}={value}' for name, value in trace.attributes.items())
+        links = f' links={",".join(trace.links)}' if trace.links else ''
+        logger.debug(
+            f'Trace {trace.name} {trace.trace_id} {attributes}{links}: {trace.duration * 1000:.1f}ms; {stages}'
+        )
+
+
+class RingBufferTraceExporter:
+    """Последние capacity трасс в памяти, выгружаются по запросу (dump)"""
+
+    def __init__(self, capacity: int = 1000):
+        self._traces: collections.deque[Trace] = collections.deque(maxlen=capacity)
+
+    def __len__(self) -> int:
+        return len(self._traces)
+
+    def export(self, trace: Trace) -> None:
+        self._traces.append(trace)
+
+    def dump(self) -> list[dict]:
+        return [trace.to_dict() for trace in self._traces]
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar('current_trace', default=None)
+
+
+def get_current_trace() -> Optional[Trace]:
+    """Трасса, внутри которой выполняется код (None - вне трассы или операция не выбрана)"""
+    return _current_trace.get()
+
+
+class Tracer:
+    """
+    Трассировка этапов с выборкой.
+
+    В трассу попадает доля sample_rate операций. Этапы отмечаются span() в любом месте кода, вызванного
+    внутри trace() (в том числе в задачах, созданных из него). Вне трассы и в невыбранных операциях span()
+    ничего не замеряет. Вложенный trace() начинает отдельную трассу: её этапы не попадают во внешнюю
+    """
+
+    def __init__(self, sample_rate: float = 0, exporters: tuple[TraceExporter, ...] = ()):
+        """
+        :param sample_rate: доля операций, которые трассируются (0 - выключено, 1 - все)
+        :param exporters: куда отдаются завершенные трассы
+        """
+        self._sample_rate = sample_rate
+        self._exporters = exporters
+
+    @contextmanager
+    def trace(self, name: str, links: Iterable[Optional[Trace]] = (), **attributes: str) -> Iterator[Optional[Trace]]:
+        """
+        :param links: трассы, из которых операция выросла. Если хоть одна из них выбрана,
+            операция трассируется без выборки - иначе связь потеряется
+        """
+        link_ids = [linked_trace.trace_id for linked_trace in links if linked_trace is not None]
+        if not self._exporters or (not link_ids and (
+                self._sample_rate <= 0 or random.random() >= self._sample_rate
+        )):
+            # Этапы невыбранной операции не должны попасть в трассу, внутри которой она запущена
+            token = _current_trace.set(None)
+            try:
+                yield None
+            finally:
+                _current_trace.reset(token)
+            return
+
+        trace = Trace(name=name, attributes=attributes, links=link_ids)
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            _current_trace.reset(token)
+            trace.duration = time.monotonic() - trace._started_at_monotonic
+            for exporter in self._exporters:
+                exporter.export(trace)
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Замер этапа текущей трассы"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    started_at = time.monotonic()
+    try:
+        yield
+    finally:
+        finished_at = time.monotonic()
+        trace.spans.append(Span(
+            name=name,
+            offset=started_at - trace._started_at_monotonic,
+            duration=finished_at - started_at
+        ))
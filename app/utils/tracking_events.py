@@ -0,0 +1,120 @@
+import asyncio
+import traceback
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable
+
+import asyncpg
+from loguru import logger
+from pydantic import ValidationError
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from schemas.tracking_events import TrackingEventSchema
+
+TrackingEventCallback = Callable[[TrackingEventSchema], Awaitable[None]]
+
+
+class TrackingEventsChannel(ABC):
+    """Канал событий об изменении отслеживаний: бот публикует, воркер слушает"""
+
+    @abstractmethod
+    async def publish(self, session: AsyncSession, event: TrackingEventSchema) -> None:
+        ...
+
+    @abstractmethod
+    async def listen(self, callback: TrackingEventCallback) -> None:
+        """Вызывает callback на каждое событие, пока не будет отменен"""
+        ...
+
+
+class PostgresTrackingEventsChannel(TrackingEventsChannel):
+    """
+    Канал через Postgres LISTEN/NOTIFY.
+    Событие публикуется в транзакции session и доходит до слушателей только после её коммита
+    """
+
+    def __init__(
+            self,
+            user: str,
+            password: str,
+            host: str,
+            port: int,
+            database: str,
+            channel: str = 'tracking_events',
+            reconnect_interval: float = 5,
+            health_check_interval: float = 30
+    ):
+        self._connect_kwargs = dict(user=user, password=password, host=host, port=port, database=database)
+        self._channel = channel
+        self._reconnect_interval = reconnect_interval
+        self._health_check_interval = health_check_interval
+        self._callback_tasks: set[asyncio.Task] = set()
+
+    async def publish(self, session: AsyncSession, event: TrackingEventSchema) -> None:
+        await session.execute(select(func.pg_notify(self._channel, event.model_dump_json())))
+
+    def _on_notification(self, callback: TrackingEventCallback, payload: str) -> None:
+        try:
+            event = TrackingEventSchema.model_validate_json(payload)
+        except ValidationError:
+            logger.warning(f'Неверное событие в канале {self._channel}: {payload}')
+            return
+        task = asyncio.create_task(self._run_callback(callback, event))
+        self._callback_tasks.add(task)
+        task.add_done_callback(self._callback_tasks.discard)
+
+    @staticmethod
+    async def _run_callback(callback: TrackingEventCallback, event: TrackingEventSchema) -> None:
+        try:
+            await callback(event)
+        except Exception:
+            logger.error(f'Error while handling tracking event {event}: \n{traceback.format_exc()}')
+
+    async def listen(self, callback: TrackingEventCallback) -> None:
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(**self._connect_kwargs)
+                connection_lost = asyncio.Event()
+                connection.add_termination_listener(lambda _: connection_lost.set())
+                await connection.add_listener(
+                    self._channel,
+                    lambda _connection, _pid, _channel, payload: self._on_notification(callback, payload)
+                )
+                logger.info(f'Listening to {self._channel} events')
+
+                while not connection_lost.is_set():
+                    try:
+                        await asyncio.wait_for(connection_lost.wait(), timeout=self._health_check_interval)
+                    except asyncio.TimeoutError:
+                        # Проверяем, что соединение живое (обрыв сети без закрытия сокета иначе не заметить)
+                        await connection.execute('SELECT 1')
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning(f'Connection for {self._channel} events lost: \n{traceback.format_exc()}')
+            finally:
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
+            await asyncio.sleep(self._reconnect_interval)
+
+
+class LocalTrackingEventsChannel(TrackingEventsChannel):
+    """
+    Канал в памяти процесса - замена Postgres LISTEN/NOTIFY для локального запуска и тестов.
+    События доставляются сразу, без ожидания коммита
+    """
+
+    def __init__(self):
+        self._queue: asyncio.Queue[TrackingEventSchema] = asyncio.Queue()
+
+    async def publish(self, session: AsyncSession, event: TrackingEventSchema) -> None:
+        self._queue.put_nowait(event)
+
+    async def listen(self, callback: TrackingEventCallback) -> None:
+        while True:
+            event = await self._queue.get()
+            try:
+                await callback(event)
+            except Exception:
+                logger.error(f'Error while handling tracking event {event}: \n{traceback.format_exc()}')
@@ -0,0 +1,177 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+from loguru import logger
+from redis.asyncio import Redis
+
+from schemas.rzd_parser import TrainAvailability
+from utils.route_key import RouteKey
+
+
+class TrainsCache:
+    """
+    Кэш результатов RZDParser.get_trains по маршруту и дате.
+
+    - свежесть ограничена ttl (в секундах);
+    - в памяти хранится не больше max_size маршрутов, вытесняются давно не использованные (LRU);
+    - одновременные запросы одного маршрута ждут один и тот же запрос к РЖД (single-flight);
+    - если передан redis, результаты разделяются между процессами бота и воркера.
+
+    Поезда, разобранные только по части типов вагонов (car_types), отдаются лишь запросам с подмножеством
+    этих типов и в redis не попадают
+    """
+
+    def __init__(
+            self,
+            ttl: float,
+            max_size: int = 1000,
+            redis: Optional[Redis] = None
+    ):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._redis = redis
+
+        # {RouteKey(...): (время получения, типы вагонов или None - все, [TrainAvailability(), ...])}
+        self._items: OrderedDict[RouteKey, tuple[float, Optional[frozenset[str]], list[TrainAvailability]]] = OrderedDict()
+        self._in_flight: dict[RouteKey, tuple[Optional[frozenset[str]], asyncio.Future]] = dict()
+
+    @property
+    def is_shared(self) -> bool:
+        """Результаты разделяются с другими процессами через redis"""
+        return self._redis is not None
+
+    @staticmethod
+    def _get_redis_key(route_key: RouteKey) -> str:
+        # v2: поезда хранятся строками TrainAvailability.to_row()
+        return f'rzd_trains:v2:{route_key.from_city_id}:{route_key.to_city_id}:{route_key.date.isoformat()}'
+
+    @staticmethod
+    def _covers(
+            available_car_types: Optional[frozenset[str]],
+            requested_car_types: Optional[frozenset[str]]
+    ) -> bool:
+        if available_car_types is None:
+            return True
+        return requested_car_types is not None and requested_car_types <= available_car_types
+
+    def _get_local(
+            self,
+            route_key: RouteKey,
+            car_types: Optional[frozenset[str]] = None
+    ) -> Optional[list[TrainAvailability]]:
+        item = self._items.get(route_key)
+        if item is None:
+            return None
+        fetched_at, available_car_types, trains = item
+        if time.monotonic() - fetched_at > self._ttl:
+            del self._items[route_key]
+            return None
+        if not self._covers(available_car_types, car_types):
+            return None
+        self._items.move_to_end(route_key)
+        return trains
+
+    def _put_local(
+            self,
+            route_key: RouteKey,
+            trains: list[TrainAvailability],
+            car_types: Optional[frozenset[str]] = None,
+            fetched_at: Optional[float] = None
+    ) -> None:
+        self._items[route_key] = (fetched_at if fetched_at is not None else time.monotonic(), car_types, trains)
+        self._items.move_to_end(route_key)
+        while len(self._items) > self._max_size:
+            self._items.popitem(last=False)
+
+    async def _get_shared(self, route_key: RouteKey) -> Optional[list[TrainAvailability]]:
+        if self._redis is None:
+            return None
+        try:
+            raw_trains = await self._redis.get(self._get_redis_key(route_key))
+            if raw_trains is None:
+                return None
+            trains = [TrainAvailability.from_row(row) for row in json.loads(raw_trains)]
+            # Оставшееся время жизни ключа в redis переносим в локальный кэш
+            ttl_left_ms = await self._redis.pttl(self._get_redis_key(route_key))
+        except Exception as exc:
+            logger.warning(f'Не удалось получить поезда из redis-кэша: {exc!r}')
+            return None
+        if ttl_left_ms > 0:
+            self._put_local(route_key, trains, fetched_at=time.monotonic() - (self._ttl - ttl_left_ms / 1000))
+        return trains
+
+    async def _put_shared(self, route_key: RouteKey, trains: list[TrainAvailability]) -> None:
+        if self._redis is None:
+            return
+        try:
+            await self._redis.set(
+                self._get_redis_key(route_key),
+                json.dumps([train.to_row() for train in trains], ensure_ascii=False),
+                px=int(self._ttl * 1000)
+            )
+        except Exception as exc:
+            logger.warning(f'Не удалось сохранить поезда в redis-кэш: {exc!r}')
+
+    async def _fetch(
+            self,
+            route_key: RouteKey,
+            fetch: Callable[[], Awaitable[list[TrainAvailability]]],
+            car_types: Optional[frozenset[str]] = None
+    ) -> list[TrainAvailability]:
+        trains = await self._get_shared(route_key)
+        if trains is not None:
+            return trains
+        trains = await fetch()
+        self._put_local(route_key, trains, car_types=car_types)
+        if car_types is None:
+            await self._put_shared(route_key, trains)
+        return trains
+
+    async def get_or_fetch(
+            self,
+            route_key: RouteKey,
+            fetch: Callable[[], Awaitable[list[TrainAvailability]]],
+            car_types: Optional[frozenset[str]] = None
+    ) -> list[TrainAvailability]:
+        """
+        Возвращает свежие поезда из кэша, либо получает их через fetch (один раз на все одновременные вызовы)
+
+        :param car_types: типы вагонов, с которыми fetch разбирает ответ. None - все типы
+        """
+        trains = self._get_local(route_key, car_types=car_types)
+        if trains is not None:
+            return trains
+
+        in_flight = self._in_flight.get(route_key)
+        if in_flight is not None:
+            in_flight_car_types, in_flight_future = in_flight
+            if not self._covers(in_flight_car_types, car_types):
+                # Идущий запрос считает не все нужные типы вагонов - делаем свой, не дожидаясь его
+                return await self._fetch(route_key=route_key, fetch=fetch, car_types=car_types)
+            # asyncio.wait не отменяет чужой запрос вместе с нами, а отмена чужого запроса не отменяет нас
+            await asyncio.wait([in_flight_future])
+            if in_flight_future.cancelled():
+                # Запрос, которого мы ждали, был отменен - делаем свой
+                return await self.get_or_fetch(route_key=route_key, fetch=fetch, car_types=car_types)
+            return in_flight_future.result()
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[route_key] = (car_types, future)
+        try:
+            trains = await self._fetch(route_key=route_key, fetch=fetch, car_types=car_types)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            # Исключение уже пробрасывается вызывающему, ожидающих может и не быть
+            future.exception()
+            raise
+        else:
+            future.set_result(trains)
+        finally:
+            del self._in_flight[route_key]
+        return trains
@@ -0,0 +1,36 @@
+"""add updated_at to trackings and users
+
+Revision ID: 5b7d2c9e4a1f
+Revises: 1eee2289b860
+Create Date: 2026-10-18 12:40:11.203417
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b7d2c9e4a1f'
+down_revision: Union[str, None] = '1eee2289b860'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('trackings', sa.Column(
+        'updated_at', sa.DateTime(), server_default=sa.text("timezone('utc', now())"), nullable=False
+    ))
+    op.add_column('users', sa.Column(
+        'updated_at', sa.DateTime(), server_default=sa.text("timezone('utc', now())"), nullable=False
+    ))
+    op.create_index('ix_trackings_updated_at', 'trackings', ['updated_at'], unique=False)
+    op.create_index('ix_users_updated_at', 'users', ['updated_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_updated_at', table_name='users')
+    op.drop_index('ix_trackings_updated_at', table_name='trackings')
+    op.drop_column('users', 'updated_at')
+    op.drop_column('trackings', 'updated_at')
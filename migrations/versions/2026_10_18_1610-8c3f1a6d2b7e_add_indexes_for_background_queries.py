@@ -0,0 +1,53 @@
+"""add indexes for background queries
+
+Revision ID: 8c3f1a6d2b7e
+Revises: 5b7d2c9e4a1f
+Create Date: 2026-10-18 16:10:42.518903
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c3f1a6d2b7e'
+down_revision: Union[str, None] = '5b7d2c9e4a1f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # CONCURRENTLY - без блокировки записи в таблицы на время построения, вне транзакции миграции
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_tracking_notifications_tracking_id_created_at', 'tracking_notifications',
+            ['tracking_id', sa.text('created_at DESC')], unique=False, postgresql_concurrently=True
+        )
+        op.create_index(
+            'ix_trackings_active_created_at', 'trackings',
+            [sa.text('created_at DESC')], unique=False,
+            postgresql_where=sa.text('NOT is_finished'), postgresql_concurrently=True
+        )
+        # Отслеживания пользователя (и активные, и все) и каскадное удаление по user_id - отдельный индекс
+        # только по user_id не нужен
+        op.create_index(
+            'ix_trackings_user_id_created_at', 'trackings',
+            ['user_id', sa.text('created_at DESC')], unique=False, postgresql_concurrently=True
+        )
+        op.create_index(
+            'ix_users_subscription_expires_at', 'users', ['subscription_expires_at'], unique=False,
+            postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_users_subscription_expires_at', table_name='users', postgresql_concurrently=True)
+        op.drop_index('ix_trackings_user_id_created_at', table_name='trackings', postgresql_concurrently=True)
+        op.drop_index('ix_trackings_active_created_at', table_name='trackings', postgresql_concurrently=True)
+        op.drop_index(
+            'ix_tracking_notifications_tracking_id_created_at', table_name='tracking_notifications',
+            postgresql_concurrently=True
+        )